@@ -1,17 +1,46 @@
+from .blob_store import BlobStore
 from .db import GalleryDB
+from .downloader import Downloader, downloader
+from .exif_index import ExifIndex
 from .extractor import ImageInfoExtractor
-from .gallery import Gallery
+from .gallery import Gallery, SaveResult
+from .geocoder import ReverseGeocoder
+from .image_cache import HotImageCache
+from .index import ImageIndex
+from .ingest import ImageIngestor, IngestReport
 from .manager import GalleryManager
 from .match import RelevanceBM25
 from .merger import GalleryImageMerger
+from .rate_limit import RateLimiter, TokenBucket
+from .recompress import GalleryRecompressor, RecompressJob
+from .tag_cache import TagCache
+from .usage_stats import UsageStats
+from .work_queue import WorkQueue
 from .zip_utils import ZipUtils
 
 __all__ = [
     "RelevanceBM25",
     "GalleryDB",
+    "BlobStore",
     "Gallery",
+    "SaveResult",
+    "HotImageCache",
+    "ImageIndex",
+    "ImageIngestor",
+    "IngestReport",
+    "GalleryRecompressor",
+    "RecompressJob",
     "GalleryManager",
     "GalleryImageMerger",
     "ImageInfoExtractor",
+    "ExifIndex",
+    "ReverseGeocoder",
     "ZipUtils",
+    "Downloader",
+    "downloader",
+    "RateLimiter",
+    "TokenBucket",
+    "TagCache",
+    "UsageStats",
+    "WorkQueue",
 ]
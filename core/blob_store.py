@@ -0,0 +1,121 @@
+import os
+import threading
+from pathlib import Path
+
+from astrbot.api import logger
+
+
+class BlobStore:
+    """
+    内容寻址的图片存储：每份图片字节只在 <root>/ab/cd/<sha256> 存一次，
+    图库里的文件是指向它的硬链接，同一张图在多个图库中不再重复占用空间。
+    引用计数直接使用文件系统的链接数(st_nlink)：只剩 blob 自身时即可删除。
+    文件系统不支持硬链接（跨盘、FAT 等）时回退为普通复制。
+    多个图库共用一个存储，各自的图库锁管不到彼此：查链接数→删除 blob 与
+    确认 blob 存在→建链接两段操作都持有存储级的锁，删除与链接不会交错
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._link_warned = False
+        self._lock = threading.Lock()
+
+        # 统计
+        self.linked = 0
+        self.copied = 0
+
+    def path_for(self, sha: str) -> Path:
+        """按哈希前缀分两级目录，避免单个目录下文件过多"""
+        return self.root / sha[:2] / sha[2:4] / sha
+
+    def _ensure_blob(self, data: bytes, sha: str) -> Path:
+        blob = self.path_for(sha)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, blob)
+        return blob
+
+    def _link(self, blob: Path, dest: str) -> bool:
+        """把 dest 原子地替换为 blob 的硬链接，失败返回 False"""
+        tmp = dest + ".tmp"
+        try:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            os.link(blob, tmp)
+            os.replace(tmp, dest)
+            return True
+        except OSError as e:
+            if not self._link_warned:
+                logger.warning(f"无法创建硬链接，图片将以副本保存：{e}")
+                self._link_warned = True
+            return False
+
+    def store(self, data: bytes, sha: str, dest: str):
+        """将图片写为 dest：已有相同内容的 blob 时只新增一个链接"""
+        with self._lock:
+            blob = self._ensure_blob(data, sha)
+            linked = self._link(blob, dest)
+        if linked:
+            self.linked += 1
+            return
+        tmp = dest + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest)
+        self.copied += 1
+        # 没能链接上的 blob 没有用处
+        self.release(sha)
+
+    def adopt(self, path: str, sha: str):
+        """
+        把图库中已有的普通文件纳入存储：blob 不存在时由该文件充当 blob，
+        已存在时把文件替换为指向 blob 的链接，释放重复的副本
+        """
+        blob = self.path_for(sha)
+        with self._lock:
+            if os.path.exists(blob):
+                if not os.path.samefile(blob, path):
+                    self._link(blob, path)
+                return
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, blob)
+            except OSError as e:
+                if not self._link_warned:
+                    logger.warning(f"无法创建硬链接，已有图片保持原样：{e}")
+                    self._link_warned = True
+
+    def release(self, sha: str | None):
+        """图库中的一个链接被删除后调用：没有其他链接时删除 blob"""
+        if not sha:
+            return
+        blob = self.path_for(sha)
+        with self._lock:
+            try:
+                if blob.stat().st_nlink <= 1:
+                    blob.unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """blob 数量、实际占用与按链接计算的逻辑占用"""
+        blobs = physical = logical = 0
+        for dirpath, _, files in os.walk(self.root):
+            for file in files:
+                try:
+                    st = os.stat(os.path.join(dirpath, file))
+                except FileNotFoundError:
+                    continue
+                blobs += 1
+                physical += st.st_size
+                logical += st.st_size * max(1, st.st_nlink - 1)
+        return {
+            "blobs": blobs,
+            "physical_bytes": physical,
+            "logical_bytes": logical,
+            "linked": self.linked,
+            "copied": self.copied,
+        }
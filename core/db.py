@@ -57,3 +57,31 @@ class GalleryDB:
         self.db_path.parent.mkdir(parents=True, exist_ok=True)  # 写前保证目录存在
         async with aiofiles.open(self.db_path, "w", encoding="utf-8") as f:
             await f.write(json.dumps(gallery_data, indent=4, ensure_ascii=False))
+
+    # ----------------- 使用统计 -----------------
+
+    @property
+    def stats_path(self) -> Path:
+        return self.db_path.with_name("gallery_stats.json")
+
+    async def load_stats(self) -> dict:
+        """读出使用统计：{日期: {图库名: {图片名: [发送, 查看, 匹配]}}}"""
+        if not self.stats_path.exists():
+            return {}
+        try:
+            async with aiofiles.open(self.stats_path, encoding="utf-8") as f:
+                data = json.loads(await f.read())
+            if not isinstance(data, dict):
+                raise ValueError
+            return data
+        except Exception:
+            logger.error("使用统计文件损坏，已重新开始统计")
+            return {}
+
+    async def save_stats(self, data: dict):
+        """写回全部使用统计（先写临时文件再替换，写到一半中断不会损坏原文件）"""
+        self.stats_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.stats_path.with_suffix(".tmp")
+        async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
+            await f.write(json.dumps(data, ensure_ascii=False))
+        tmp.replace(self.stats_path)
@@ -0,0 +1,280 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import TypeVar
+
+import aiofiles
+import aiohttp
+
+from astrbot.api import logger
+
+from ..utils import sniff_image_format
+
+
+T = TypeVar("T")
+
+# 下载的合并与缓存键：(url, 是否只接受图片, 大小上限, 代理)
+FetchKey = tuple[str, bool, int, str | None]
+
+
+class DownloadAbort(Exception):
+    """不值得重试的下载失败（超出大小、不是图片、4xx 等）"""
+
+
+class DownloadRetry(Exception):
+    """可重试的下载失败（5xx 等）"""
+
+
+class Downloader:
+    """
+    插件共享的 HTTP 客户端：
+    - 全局一个连接池，按主机限制并发连接，复用 keep-alive 连接
+    - 分块流式读取，超出大小上限或文件头不是图片时立即中止
+    - 网络错误与 5xx 按指数退避重试
+    - 同一 URL 的并发请求合并为一次下载，结果在短时间内缓存，
+      同一条消息被收集、匹配、命令等多个 handler 处理时只下载一次
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    SNIFF_SIZE = 32
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        # 进行中的下载：FetchKey -> Task
+        self._inflight: dict[FetchKey, asyncio.Task] = {}
+        # 短时字节缓存：FetchKey -> (过期时间, 字节)
+        self._cache: OrderedDict[FetchKey, tuple[float, bytes]] = OrderedDict()
+        self._cache_bytes = 0
+        self.hits = 0
+        self.joins = 0
+        self.misses = 0
+        self.configure()
+
+    def configure(
+        self,
+        limit: int = 32,
+        limit_per_host: int = 8,
+        connect_timeout: float = 10,
+        read_timeout: float = 30,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_bytes: int = 20 * 1024 * 1024,
+        cache_ttl: float = 60,
+        cache_max_bytes: int = 32 * 1024 * 1024,
+    ):
+        """设置连接池与下载参数，已建立的连接池在下次创建时生效"""
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_bytes = max_bytes
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """共享会话，首次使用时创建"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self):
+        for task in self._inflight.values():
+            task.cancel()
+        self._inflight.clear()
+        self._cache.clear()
+        self._cache_bytes = 0
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # ----------------- 短时缓存 -----------------
+
+    def _cache_get(self, key: FetchKey) -> bytes | None:
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        expires, data = item
+        if expires < time.monotonic():
+            self._cache_pop(key)
+            return None
+        self._cache.move_to_end(key)
+        return data
+
+    def _cache_pop(self, key: FetchKey):
+        if item := self._cache.pop(key, None):
+            self._cache_bytes -= len(item[1])
+
+    def _cache_put(self, key: FetchKey, data: bytes):
+        # 单个文件超过缓存预算的 1/4 不缓存（例如图库压缩包）
+        if self.cache_ttl <= 0 or len(data) > self.cache_max_bytes // 4:
+            return
+        self._cache_pop(key)
+        self._cache[key] = (time.monotonic() + self.cache_ttl, data)
+        self._cache_bytes += len(data)
+        while self._cache_bytes > self.cache_max_bytes:
+            self._cache_pop(next(iter(self._cache)))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "joins": self.joins,
+            "misses": self.misses,
+            "cached": len(self._cache),
+            "cached_bytes": self._cache_bytes,
+        }
+
+    # ----------------- 下载 -----------------
+
+    async def fetch(
+        self,
+        url: str,
+        max_bytes: int | None = None,
+        image_only: bool = True,
+        proxy: str | None = None,
+    ) -> bytes | None:
+        """下载为字节，失败返回 None；同一 URL 且参数相同的并发请求共享一次下载"""
+        max_bytes = max_bytes or self.max_bytes
+        # 大小上限与代理不同的请求结果可能不同，不能互相复用
+        key = (url, image_only, max_bytes, proxy)
+        if (data := self._cache_get(key)) is not None:
+            self.hits += 1
+            return data
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(
+                self._fetch_with_retry(url, max_bytes, image_only, proxy)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.joins += 1
+        # shield：单个调用方被取消不影响其他共享此下载的调用方
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: FetchKey, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            if data := task.result():
+                self._cache_put(key, data)
+
+    async def fetch_to_file(
+        self,
+        url: str,
+        path: Path,
+        max_bytes: int | None = None,
+        proxy: str | None = None,
+    ) -> bool:
+        """
+        流式下载到文件（用于压缩包等大文件，不进内存缓存），
+        先写 <path>.part，完成后再改名；失败时删除不完整的文件
+        """
+        max_bytes = max_bytes or self.max_bytes
+        part = path.with_name(path.name + ".part")
+        ok = await self._retry(
+            url, lambda u: self._stream_once(u, part, max_bytes, proxy)
+        )
+        if ok:
+            os.replace(part, path)
+            return True
+        part.unlink(missing_ok=True)
+        return False
+
+    async def _fetch_with_retry(
+        self,
+        url: str,
+        max_bytes: int | None,
+        image_only: bool,
+        proxy: str | None,
+    ) -> bytes | None:
+        max_bytes = max_bytes or self.max_bytes
+        return await self._retry(
+            url, lambda u: self._fetch_once(u, max_bytes, image_only, proxy)
+        )
+
+    async def _retry(
+        self, url: str, once: Callable[[str], Awaitable[T]]
+    ) -> T | None:
+        """按指数退避重试一次下载，失败返回 None"""
+        last_error: Exception | None = None
+        attempt = 0
+        while attempt <= self.retries:
+            try:
+                return await once(url)
+            except DownloadAbort as e:
+                logger.warning(f"下载中止：{e}（{url}）")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError, DownloadRetry) as e:
+                last_error = e
+            attempt += 1
+            if attempt <= self.retries:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+        logger.error(f"下载失败: {last_error!r}（{url}）")
+        return None
+
+    @staticmethod
+    def _check_response(resp: aiohttp.ClientResponse, max_bytes: int):
+        if resp.status >= 500:
+            raise DownloadRetry(f"HTTP {resp.status}")
+        if resp.status != 200:
+            raise DownloadAbort(f"HTTP {resp.status}")
+        if resp.content_length and resp.content_length > max_bytes:
+            raise DownloadAbort(f"文件过大：{resp.content_length} 字节")
+
+    async def _stream_once(
+        self, url: str, part: Path, max_bytes: int, proxy: str | None
+    ) -> bool:
+        async with self.session.get(url, proxy=proxy) as resp:
+            self._check_response(resp, max_bytes)
+            size = 0
+            async with aiofiles.open(part, "wb") as f:
+                async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DownloadAbort(f"文件超过 {max_bytes} 字节")
+                    await f.write(chunk)
+            return True
+
+    async def _fetch_once(
+        self, url: str, max_bytes: int, image_only: bool, proxy: str | None
+    ) -> bytes:
+        async with self.session.get(url, proxy=proxy) as resp:
+            self._check_response(resp, max_bytes)
+
+            buf = bytearray()
+            sniffed = not image_only
+            async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                buf.extend(chunk)
+                if len(buf) > max_bytes:
+                    raise DownloadAbort(f"文件超过 {max_bytes} 字节")
+                if not sniffed and len(buf) >= self.SNIFF_SIZE:
+                    self._check_image(buf)
+                    sniffed = True
+            if not sniffed:
+                self._check_image(buf)
+            return bytes(buf)
+
+    @staticmethod
+    def _check_image(head: bytes | bytearray):
+        if sniff_image_format(bytes(head[:Downloader.SNIFF_SIZE])) is None:
+            raise DownloadAbort("文件头不是图片")
+
+
+# 插件全局共享实例
+downloader = Downloader()
@@ -0,0 +1,76 @@
+import heapq
+from collections.abc import Callable
+
+
+class EvictionHeap:
+    """
+    满库淘汰的候选堆：(优先级, 文件名) 的最小堆，堆顶即最该淘汰的图片
+    - 首次淘汰时扫描一次图库建堆，之后入堆、淘汰出堆都是 O(log n)
+    - 优先级只会随使用次数增加；出堆时重新计算，变大了就以新优先级放回，
+      被删除或已过期的条目惰性丢弃
+    - aging 时采用动态老化（LFU-DA）：新入堆的图片以上一次被淘汰者的优先级为起点，
+      新图不会因为还没来得及被使用就立刻被淘汰，长期不用的老图则逐渐被新图超过
+    """
+
+    def __init__(self, priority: Callable[[str], tuple | None], aging: bool = False):
+        """
+        :param priority: 计算图片当前的淘汰优先级 (使用次数, ...)，越小越先淘汰；
+            文件不存在时返回 None
+        """
+        self.priority = priority
+        self.aging = aging
+        self._heap: list[tuple[tuple, str]] = []
+        self._latest: dict[str, tuple] = {}
+        # 动态老化：当前起点，以及每张图片入堆时的起点
+        self._floor = 0.0
+        self._base: dict[str, float] = {}
+
+    def __len__(self):
+        return len(self._latest)
+
+    def _current(self, name: str) -> tuple | None:
+        prio = self.priority(name)
+        if prio is None or not self._base.get(name):
+            return prio
+        return (prio[0] + self._base[name], *prio[1:])
+
+    def build(self, items: list[tuple[tuple, str]]):
+        """用 (优先级, 文件名) 列表一次性建堆，O(n)"""
+        self._heap = list(items)
+        heapq.heapify(self._heap)
+        self._latest = {name: prio for prio, name in self._heap}
+        self._base.clear()
+
+    def push(self, name: str):
+        if self.aging:
+            self._base[name] = self._floor
+        if (prio := self._current(name)) is None:
+            return
+        self._latest[name] = prio
+        heapq.heappush(self._heap, (prio, name))
+
+    def discard(self, name: str):
+        """图片被删除：只移除记录，堆里的条目在出堆时丢弃"""
+        self._latest.pop(name, None)
+        self._base.pop(name, None)
+
+    def pop(self) -> str | None:
+        """弹出当前最该淘汰的图片名，堆空时返回 None"""
+        while self._heap:
+            prio, name = heapq.heappop(self._heap)
+            if self._latest.get(name) != prio:
+                continue  # 过期条目
+            current = self._current(name)
+            if current is None:
+                self.discard(name)
+                continue
+            if current > prio:
+                # 入堆后又被使用过，按新优先级放回
+                self._latest[name] = current
+                heapq.heappush(self._heap, (current, name))
+                continue
+            if self.aging:
+                self._floor = max(self._floor, prio[0])
+            self.discard(name)
+            return name
+        return None
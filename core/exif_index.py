@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from astrbot.api import logger
+
+from .gallery import Gallery
+
+# EXIF 标签号
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+IFD_EXIF = 0x8769
+IFD_GPS = 0x8825
+
+
+class ExifIndex:
+    """
+    图片元数据索引：图库名 -> 文件名 -> {格式、宽高、相机、拍摄时间、经纬度}
+    - 只解析文件头与 EXIF 段，不解码像素
+    - 线程池批量提取，按 (mtime, size) 增量更新，未变化的文件不再打开
+    - 持久化为 JSON 文件，筛图时直接查索引
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path, workers: int = 4):
+        self.path = path
+        self.workers = max(1, workers)
+        self._data: dict[str, dict[str, dict]] = {}
+        self._scans: dict[str, asyncio.Task] = {}
+        self._dirty = False
+
+    # ----------------- 持久化 -----------------
+
+    async def load(self):
+        """从 JSON 文件加载"""
+        if not self.path.exists():
+            return
+        try:
+            data = await asyncio.to_thread(
+                lambda: json.loads(self.path.read_text(encoding="utf-8"))
+            )
+            if data.get("version") == self.VERSION:
+                self._data = data["galleries"]
+        except Exception as e:
+            logger.error(f"元数据索引文件损坏，已忽略：{e}")
+            self._data = {}
+
+    async def save(self):
+        """有改动时原子写回 JSON 文件"""
+        if not self._dirty:
+            return
+        payload = json.dumps(
+            {"version": self.VERSION, "galleries": self._data}, ensure_ascii=False
+        )
+        self._dirty = False
+
+        def write():
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(payload, encoding="utf-8")
+            os.replace(tmp, self.path)
+
+        await asyncio.to_thread(write)
+
+    def drop(self, name: str):
+        """删除图库时移除其索引"""
+        if self._data.pop(name, None) is not None:
+            self._dirty = True
+
+    # ----------------- 提取 -----------------
+
+    @staticmethod
+    def _dms2dec(dms, ref) -> float | None:
+        try:
+            deg, minute, sec = (float(x) for x in dms)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+        dec = deg + minute / 60 + sec / 3600
+        return round(-dec if ref in {"S", "W"} else dec, 6)
+
+    @classmethod
+    def read_header(cls, path: str) -> dict:
+        """读取文件头中的格式、宽高与常用 EXIF 字段"""
+        with Image.open(path) as img:  # 惰性打开，只解析文件头
+            meta: dict = {
+                "format": img.format,
+                "width": img.width,
+                "height": img.height,
+            }
+            exif = img.getexif()
+        if not exif:
+            return meta
+
+        def text(value) -> str:
+            if isinstance(value, bytes):
+                value = value.decode("utf-8", "ignore")
+            return str(value).strip("\x00 ") if value is not None else ""
+
+        if make := text(exif.get(TAG_MAKE)):
+            meta["make"] = make
+        if model := text(exif.get(TAG_MODEL)):
+            meta["model"] = model
+        taken = text(exif.get_ifd(IFD_EXIF).get(TAG_DATETIME_ORIGINAL)) or text(
+            exif.get(TAG_DATETIME)
+        )
+        if taken:
+            # "2023:05:01 12:00:00" -> "2023-05-01 12:00:00"，便于按字符串比较
+            date, _, clock = taken.partition(" ")
+            meta["taken"] = f"{date.replace(':', '-')} {clock}".strip()
+        gps = exif.get_ifd(IFD_GPS)
+        if gps:
+            lat = cls._dms2dec(gps.get(2), gps.get(1))
+            lon = cls._dms2dec(gps.get(4), gps.get(3))
+            if lat is not None and lon is not None:
+                meta["lat"], meta["lon"] = lat, lon
+        return meta
+
+    @classmethod
+    def _extract(cls, path: str, mtime: int, size: int) -> dict:
+        try:
+            meta = cls.read_header(path)
+        except Exception as e:
+            logger.debug(f"读取图片元数据失败：{path}，错误：{e}")
+            meta = {"error": str(e)}
+        meta["mtime"], meta["size"] = mtime, size
+        return meta
+
+    def _scan(
+        self, gallery: Gallery, old: dict[str, dict]
+    ) -> tuple[dict[str, dict], int]:
+        """
+        在线程中增量扫描一个图库，返回 (新的索引, 新提取数)；
+        不修改 self._data，由事件循环写回，避免与序列化同时进行
+        """
+        entries: dict[str, dict] = {}
+        pending: list[tuple[str, str, int, int]] = []
+        for entry in gallery.iter_images():
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                # 扫描期间被删除（如满库淘汰）的图片
+                continue
+            cached = old.get(entry.name)
+            if (
+                cached
+                and cached["mtime"] == st.st_mtime_ns
+                and cached["size"] == st.st_size
+            ):
+                entries[entry.name] = cached
+            else:
+                pending.append((entry.name, entry.path, st.st_mtime_ns, st.st_size))
+
+        if pending:
+            with ThreadPoolExecutor(self.workers) as pool:
+                results = pool.map(lambda p: self._extract(*p[1:]), pending)
+                for (name, *_), meta in zip(pending, results):
+                    entries[name] = meta
+        return entries, len(pending)
+
+    async def _scan_and_store(self, gallery: Gallery) -> tuple[int, int]:
+        """扫描一个图库并在事件循环中写回索引，返回 (图片总数, 新提取数)"""
+        old = self._data.get(gallery.name, {})
+        entries, extracted = await asyncio.to_thread(self._scan, gallery, old)
+        if extracted or len(entries) != len(old):
+            self._data[gallery.name] = entries
+            self._dirty = True
+        return len(entries), extracted
+
+    async def scan(self, gallery: Gallery) -> tuple[int, int]:
+        """增量更新一个图库的索引，同一图库同时只有一个扫描任务"""
+        task = self._scans.get(gallery.name)
+        if task is None:
+            task = asyncio.create_task(self._scan_and_store(gallery))
+            self._scans[gallery.name] = task
+
+            def on_done(t: asyncio.Task, name=gallery.name):
+                if self._scans.get(name) is t:
+                    del self._scans[name]
+
+            task.add_done_callback(on_done)
+        result = await asyncio.shield(task)
+        await self.save()
+        return result
+
+    # ----------------- 查询 -----------------
+
+    def query(
+        self,
+        name: str,
+        camera: str | None = None,
+        after: str | None = None,
+        before: str | None = None,
+    ) -> list[tuple[str, dict]]:
+        """
+        按相机与拍摄时间筛选图片，结果按拍摄时间排序
+        :param camera: 匹配制造商或型号（不区分大小写的子串）
+        :param after: 拍摄时间不早于此时刻，如 2023、2023-05、2023-05-01
+        :param before: 拍摄时间早于此时刻
+        """
+        camera = camera.lower() if camera else None
+        results = []
+        for file, meta in self._data.get(name, {}).items():
+            if camera:
+                label = f"{meta.get('make', '')} {meta.get('model', '')}".lower()
+                if camera not in label:
+                    continue
+            taken = meta.get("taken")
+            if (after or before) and not taken:
+                continue
+            if after and taken < after:
+                continue
+            if before and taken >= before:
+                continue
+            results.append((file, meta))
+        return sorted(results, key=lambda r: (r[1].get("taken") or "", r[0]))
+
+    def stats(self) -> dict:
+        return {
+            "galleries": len(self._data),
+            "images": sum(len(v) for v in self._data.values()),
+        }
@@ -1,4 +1,5 @@
 import re
+from collections import OrderedDict
 from io import BytesIO
 
 import aiohttp
@@ -7,6 +8,9 @@ from PIL import ExifTags, Image
 from astrbot.api import logger
 from astrbot.core.config.astrbot_config import AstrBotConfig
 
+from .downloader import downloader
+from .geocoder import ReverseGeocoder
+
 
 class ImageInfoExtractor:
     """图片信息提取器"""
@@ -96,9 +100,17 @@ class ImageInfoExtractor:
         "fileterIntensity": "滤镜强度",
     }
 
-    def __init__(self, config: AstrBotConfig):
+    def __init__(
+        self, config: AstrBotConfig, geocoder: ReverseGeocoder | None = None
+    ):
         self.conf = config
-        self.session = aiohttp.ClientSession()
+        self.geocoder = geocoder
+        geo_conf = config["geocode"]
+        self.online_fallback: bool = geo_conf["online_fallback"]
+        # 逆地理编码结果缓存：按保留小数位取整后的经纬度 -> 地名
+        self.location_precision: int = geo_conf["cache_precision"]
+        self.location_cache_size: int = max(1, geo_conf["cache_size"])
+        self._location_cache: OrderedDict[tuple[float, float], str] = OrderedDict()
 
     async def get_image_info(self, image: bytes) -> str | None:
         """对外统一入口：返回格式化后的图片信息字符串"""
@@ -266,8 +278,36 @@ class ImageInfoExtractor:
             logger.warning(f"GPS 解析失败: {e}")
             return gps_info  # 回退
 
+        key = (
+            round(lat, self.location_precision),
+            round(lon, self.location_precision),
+        )
+        if (location := self._location_cache.get(key)) is not None:
+            self._location_cache.move_to_end(key)
+            return location
+
+        location = await self._reverse_geocode(lat, lon)
+        if location is None:
+            return gps_info  # 回退
+        self._location_cache[key] = location
+        if len(self._location_cache) > self.location_cache_size:
+            self._location_cache.popitem(last=False)
+        return location
+
+    async def _reverse_geocode(self, lat: float, lon: float) -> str | None:
+        """优先查离线地名表，查不到时按配置回退到在线接口"""
+        if self.geocoder and await self.geocoder.ensure_loaded():
+            if found := self.geocoder.nearest(lat, lon):
+                label, dist = found
+                return label if dist < 1 else f"{label}（约 {dist:.1f} km）"
+        if self.online_fallback:
+            return await self._get_location_online(lat, lon)
+        return None
+
+    async def _get_location_online(self, lat: float, lon: float) -> str | None:
+        """通过 Nominatim 在线逆地理编码"""
         try:
-            async with self.session.get(
+            async with downloader.session.get(
                 url="https://nominatim.openstreetmap.org/reverse",
                 params={
                     "format": "json",
@@ -278,19 +318,16 @@ class ImageInfoExtractor:
                 },
                 headers={"User-Agent": "AstrBot-GalleryPlugin/2.0.3"},
                 proxy=self.conf["http_proxy"] or None,
-                timeout=10,
+                timeout=aiohttp.ClientTimeout(total=10),
             ) as resp:
                 if resp.status == 200:
                     data = await resp.json()
-                    return data.get("display_name") or gps_info
+                    return data.get("display_name")
                 else:
                     logger.warning(
                         f"逆地理编码失败 HTTP {resp.status} (Lat: {lat:.6f}, Lon: {lon:.6f})"
                     )
-                    return gps_info  # 回退
+                    return None
         except Exception as e:
             logger.warning(f"获取地理位置网络异常: {e}")
-            return gps_info
-
-    async def close(self):
-        await self.session.close()
+            return None
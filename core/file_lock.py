@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    可重入的跨进程文件锁
+    - 进程内用 RLock 串行化各线程，同一线程可嵌套获取
+    - 最外层获取时再对锁文件加排他锁（POSIX 用 flock，Windows 用 msvcrt.locking），
+      多个进程共用同一图库目录时同样互斥
+    - 锁文件的内容可用作版本戳，供各进程判断自己的内存缓存是否过期
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd: int | None = None
+
+    @staticmethod
+    def _lock(fd: int):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK 重试约 10 秒后仍拿不到会抛出，继续等待
+                time.sleep(0.1)
+
+    @staticmethod
+    def _unlock(fd: int):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def acquire(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    self._lock(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._rlock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            try:
+                self._unlock(self._fd)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self._rlock.release()
+
+    def read_stamp(self) -> bytes:
+        """读取锁文件中记录的版本戳（须持有锁）"""
+        assert self._fd is not None
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        return os.read(self._fd, 64)
+
+    def write_stamp(self, stamp: bytes):
+        """在锁文件中记录版本戳（须持有锁），其他进程据此得知被保护的数据有改动"""
+        assert self._fd is not None
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, stamp)
+        os.ftruncate(self._fd, len(stamp))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
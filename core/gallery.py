@@ -1,16 +1,60 @@
 import asyncio
-import io
 import os
-import random
 import re
 import shutil
+from collections.abc import Collection, Iterator
 from datetime import datetime
 
-from PIL import Image
-
 from astrbot import logger
 
-from ..utils import compress_image, filter_text
+from ..utils import (
+    compress_image,
+    content_hash,
+    filter_text,
+    optimize_gif,
+    probe_image,
+)
+from .blob_store import BlobStore
+from .eviction import EvictionHeap
+from .file_lock import FileLock
+from .image_cache import HotImageCache
+from .index import ImageIndex
+from .shuffle_bag import ShuffleBag
+from .usage_stats import UsageStats
+
+
+class SaveResult:
+    """
+    存图结果：status 为下列状态之一，name 为存入的文件名，
+    replaced 为被替换的原图，evicted 为满库时被淘汰的图片；提示文本由调用方拼接
+    """
+
+    ADDED = "added"
+    REPLACED = "replaced"
+    DUPLICATE = "duplicate"
+    FULL = "full"
+    ERROR = "error"
+
+    __slots__ = ("status", "name", "replaced", "evicted", "error")
+
+    def __init__(
+        self,
+        status: str,
+        name: str = "",
+        replaced: str | None = None,
+        evicted: list[str] | None = None,
+        error: str = "",
+    ):
+        self.status = status
+        self.name = name
+        self.replaced = replaced
+        self.evicted = evicted or []
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        """是否已存入"""
+        return self.status in (self.ADDED, self.REPLACED)
 
 
 class Gallery:
@@ -18,7 +62,22 @@ class Gallery:
     图库类，用于管理单个图库
     """
 
-    EXT = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"}
+    EXT = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"}
+
+    # 存储布局：flat 所有图片平铺在图库目录下；
+    # sharded 按序号每 BUCKET_SIZE 张分一个子目录（<图库>/0000/<文件>），不受 9999 张限制
+    LAYOUTS = ("flat", "sharded")
+    BUCKET_SIZE = 1000
+    LOCK_NAME = ".lock"
+
+    # 满库时的淘汰策略：reject 拒绝存入；oldest 淘汰最早存入的；
+    # least_sent 淘汰保留期内发送最少的；lfu 淘汰近期发送+查看最少的（越久远的使用权重越低）
+    EVICTIONS = {
+        "reject": "拒绝存入",
+        "oldest": "最旧优先",
+        "least_sent": "最少发送",
+        "lfu": "LFU",
+    }
 
     def __init__(
         self,
@@ -30,6 +89,14 @@ class Gallery:
         capacity: int = 200,
         compress: bool = False,
         tags: list[str] | None = None,
+        optimize_gif: bool = False,
+        gif_saved: int = 0,
+        layout: str = "flat",
+        eviction: str = "reject",
+        hash_index: ImageIndex | None = None,
+        blob_store: BlobStore | None = None,
+        usage: UsageStats | None = None,
+        image_cache: HotImageCache | None = None,
     ):
         self.path = path
         os.makedirs(self.path, exist_ok=True)
@@ -41,15 +108,49 @@ class Gallery:
         self.creation_time = creation_time or datetime.now().strftime(
             "%Y-%m-%d %H:%M:%S"
         )
-        self.capacity = min(capacity, 9999)
+        self.layout = layout if layout in self.LAYOUTS else "flat"
+        self.capacity = capacity if self.layout == "sharded" else min(capacity, 9999)
         self.compress = compress
         self.tags = tags or []
-
-        asyncio.create_task(self._specify_names())
-
+        # 存入动图时是否优化体积，以及累计节省的字节数
+        self.optimize_gif = optimize_gif
+        self.gif_saved = gif_saved
+        self.eviction = eviction if eviction in self.EVICTIONS else "reject"
+
+        # 全局指纹索引，建好之前去重回退为逐个文件比对
+        self.hash_index = hash_index
+        self._indexed = False
+        # 内容寻址存储，启用时图库中的文件是 blob 的硬链接
+        self.blob_store = blob_store
+        # 图片目录：文件名 -> 路径。初始化时持有文件锁扫描一次，之后随写入、删除、改名同步更新，
+        # 存图分配序号、统计数量、按序号查图时不必再扫描所有分桶；建好之前回退为扫描目录。
+        # 每次改动都在锁文件中写入新的版本戳，版本戳不是自己写的说明其他进程改动过，重新扫描
+        self._catalog: dict[str, str] | None = None
+        self._stamp = b""
+        # 随机发图用的洗牌袋（按文件名），首次抽取时装袋
+        self.bag = ShuffleBag(self._get_image_names)
+        # 使用统计与满库淘汰的候选堆（首次淘汰时建立）
+        self.usage = usage
+        self._evict_heap: EvictionHeap | None = None
+        self._evict_generation = 0
+        # 热点图片缓存，删图时同步移出
+        self.image_cache = image_cache
+        # 修改图库（存图、删图、替换文件）时的锁：
+        # lock 供协程排队，不占用线程池；file_lock 在线程中持有，跨线程、跨进程互斥
+        self.lock = asyncio.Lock()
+        self.file_lock = FileLock(os.path.join(self.path, self.LOCK_NAME))
+
+        asyncio.create_task(self._initialize())
 
     @classmethod
-    def from_dict(cls, d: dict):
+    def from_dict(
+        cls,
+        d: dict,
+        hash_index: ImageIndex | None = None,
+        blob_store: BlobStore | None = None,
+        usage: UsageStats | None = None,
+        image_cache: HotImageCache | None = None,
+    ):
         """工厂方法: 从字典中创建图库对象"""
         return cls(
             path=d["path"],
@@ -59,6 +160,14 @@ class Gallery:
             capacity=d.get("capacity", 200),
             compress=d.get("compress", False),
             tags=d.get("tags", [os.path.basename(d["path"])]),
+            optimize_gif=d.get("optimize_gif", False),
+            gif_saved=d.get("gif_saved", 0),
+            layout=d.get("layout", "flat"),
+            eviction=d.get("eviction", "reject"),
+            hash_index=hash_index,
+            blob_store=blob_store,
+            usage=usage,
+            image_cache=image_cache,
         )
 
     def to_dict(self):
@@ -71,6 +180,10 @@ class Gallery:
             "capacity": self.capacity,
             "compress": self.compress,
             "tags": self.tags,
+            "optimize_gif": self.optimize_gif,
+            "gif_saved": self.gif_saved,
+            "layout": self.layout,
+            "eviction": self.eviction,
         }
 
     def to_str(self):
@@ -81,132 +194,631 @@ class Gallery:
             f"创建之人：{self.creator_name}\n"
             f"创建时间：{self.creation_time}\n"
             f"容量上限：{self.capacity}\n"
-            f"已用容量：{len(os.listdir(self.path))}\n"
+            f"满库淘汰：{self.EVICTIONS[self.eviction]}\n"
+            f"已用容量：{self.image_count()}\n"
+            f"存储布局：{self.layout}\n"
             f"压缩图片：{self.compress}\n"
+            f"动图优化：{self.optimize_gif}"
+            f"（已节省 {self.gif_saved / 1024 / 1024:.2f} MB）\n"
             f"图库标签： {self.tags}"
         )
 
+    async def _initialize(self):
+        """规范化图片名称，建立图片目录，然后把图库中的图片登记到指纹索引"""
+        await self._specify_names()
+        await asyncio.to_thread(self._load_catalog)
+        if self.hash_index is not None:
+            await asyncio.to_thread(self._build_index)
+            self._indexed = True
+
+    def _build_index(self):
+        """将图库中所有图片登记到指纹索引，启用内容寻址存储时顺带把已有文件纳入存储"""
+        assert self.hash_index is not None
+        for entry in self._get_images():
+            try:
+                with open(entry.path, "rb") as f:
+                    image = f.read()
+                sha, phash = self.hash_index.fingerprint(image)
+                self.hash_index.add(self.name, entry.name, sha, phash)
+                if self.blob_store is not None:
+                    self.blob_store.adopt(entry.path, sha)
+            except Exception as e:
+                logger.warning(f"索引图片失败：{entry.path}，错误：{e}")
+
     async def _specify_names(self):
         """规范化图片名称"""
-        for image_file in self._get_images():
-            if not re.match(r"^[^_]+_\d+_[^_]+\.\w+$", image_file.name):
+        pattern = re.compile(r"^[^_]+_\d+_[^_]+\.\w+$")
+        for image_file in await asyncio.to_thread(self._get_images):
+            if not pattern.match(image_file.name):
+                # 取空闲序号与改名需与存图互斥；读图、算哈希、改名都放到线程中
+                async with self.lock:
+                    await asyncio.to_thread(self._rename_image, image_file)
+                self.bag.invalidate()
+                self._evict_heap = None
+                await asyncio.sleep(0.1)
+
+    def _rename_image(self, image_file: os.DirEntry):
+        """把不规范的图片名改为规范名称，需在持有 self.lock 时于线程中调用"""
+        author = filter_text(image_file.name)
+        with self.file_lock:
+            try:
                 with open(image_file.path, "rb") as f:
                     image = f.read()
-                author = filter_text(image_file.name)
                 new_name = self._generate_name(image, author)
-                if new_name != image_file.name:
-                    try:
-                        new_path = os.path.join(self.path, new_name)
-                        os.rename(image_file.path, new_path)
-                        logger.info(f"图片文件名更新：{image_file.name} -> {new_name}")
-                    except Exception as e:
-                        logger.error(
-                            f"重命名图片失败：{image_file.name} -> {new_name}，错误：{e}"
-                        )
-                await asyncio.sleep(0.1)
+            except Exception as e:
+                logger.error(f"读取图片失败：{image_file.name}，错误：{e}")
+                return
+            if new_name == image_file.name:
+                return
+            try:
+                new_path = self.image_path(new_name)
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.rename(image_file.path, new_path)
+                self._catalog_pop(image_file.name)
+                self._catalog_set(new_name, new_path)
+                logger.info(f"图片文件名更新：{image_file.name} -> {new_name}")
+            except Exception as e:
+                logger.error(f"重命名图片失败：{image_file.name} -> {new_name}，错误：{e}")
 
     def _get_images(self) -> list[os.DirEntry]:
-        """获取图片文件"""
+        """
+        获取图片文件：图库目录下的图片和分桶子目录中的图片都会列出，
+        两种布局混杂（迁移进行中）时同样可见
+        """
+        images: list[os.DirEntry] = []
+        buckets: list[str] = []
+        exts = tuple(self.EXT)
         with os.scandir(self.path) as entries:
-            return [
-                entry
-                for entry in entries
-                if entry.is_file() and entry.name.lower().endswith(tuple(self.EXT))
-            ]
-
-    def _get_image_names(self) -> list[str]:
-        """获取图片名称"""
-        return [entry.name for entry in self._get_images()]
-
-    def _generate_name(self, image: bytes, author: str = "", index: int = 0) -> str:
-        """生成图片名称"""
-        with Image.open(io.BytesIO(image)) as img:
-            if img.format is None:
-                logger.warning(
-                    "Image format could not be detected. Defaulting to 'jpg'."
+            for entry in entries:
+                if entry.is_file():
+                    if entry.name.lower().endswith(exts):
+                        images.append(entry)
+                elif entry.name.isdigit() and entry.is_dir():
+                    buckets.append(entry.path)
+        for bucket in buckets:
+            with os.scandir(bucket) as entries:
+                images.extend(
+                    entry
+                    for entry in entries
+                    if entry.is_file() and entry.name.lower().endswith(exts)
                 )
-                extension = "jpg"
+        return images
+
+    def _load_catalog(self):
+        """扫描目录建立图片目录；持有文件锁，扫描期间的写入、删除不会被漏掉"""
+        with self.file_lock:
+            self._catalog = {entry.name: entry.path for entry in self._get_images()}
+            self._stamp = self.file_lock.read_stamp()
+
+    def _sync_catalog(self):
+        """持有文件锁时调用：其他进程改动过图库时重新建立图片目录"""
+        if self._catalog is not None and self.file_lock.read_stamp() != self._stamp:
+            self._load_catalog()
+
+    def _touch_catalog(self):
+        """图库有改动（须持有文件锁）：写入新的版本戳"""
+        self._stamp = os.urandom(8).hex().encode()
+        self.file_lock.write_stamp(self._stamp)
+
+    def _image_entries(self) -> dict[str, str]:
+        """文件名 -> 路径：图片目录建好后返回其副本，否则扫描目录"""
+        catalog = self._catalog
+        if catalog is not None:
+            return dict(catalog)
+        return {entry.name: entry.path for entry in self._get_images()}
+
+    def _catalog_set(self, name: str, path: str):
+        if self._catalog is not None:
+            self._catalog[name] = path
+        self._touch_catalog()
+
+    def _catalog_pop(self, name: str):
+        if self._catalog is not None:
+            self._catalog.pop(name, None)
+        self._touch_catalog()
+
+    def image_count(self) -> int:
+        """图片数量"""
+        catalog = self._catalog
+        return len(catalog) if catalog is not None else len(self._get_images())
+
+    def iter_images(self) -> Iterator[os.DirEntry]:
+        """逐个列出图库中的图片文件：直接扫描目录，可取到文件的 stat 信息"""
+        yield from self._get_images()
+
+    def get_image_paths(self) -> list[str]:
+        """获取所有图片的路径"""
+        return list(self._image_entries().values())
+
+    def _bucket_of(self, name: str) -> str | None:
+        """按序号计算分桶目录名，文件名不含序号时返回 None"""
+        parts = name.split("_")
+        if len(parts) > 1 and parts[1].isdigit():
+            return f"{int(parts[1]) // self.BUCKET_SIZE:04d}"
+        return None
+
+    def image_path(self, name: str) -> str:
+        """
+        图片文件的路径：优先取当前布局下的位置，
+        文件仍在另一种布局的位置（尚未迁移）时返回实际所在位置
+        """
+        catalog = self._catalog
+        if catalog is not None and (path := catalog.get(name)):
+            return path
+        flat = os.path.join(self.path, name)
+        bucket = self._bucket_of(name)
+        sharded = os.path.join(self.path, bucket, name) if bucket else flat
+        preferred, other = (
+            (sharded, flat) if self.layout == "sharded" else (flat, sharded)
+        )
+        if os.path.exists(preferred) or not os.path.exists(other):
+            return preferred
+        return other
+
+    def migrate_layout(self, layout: str) -> int:
+        """
+        切换存储布局并移动已有图片，返回移动的文件数。
+        逐个文件原子重命名，迁移期间读写照常进行（两种位置都会被查找）
+        """
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"未知的存储布局：{layout}")
+        self.layout = layout
+        if layout == "flat":
+            self.capacity = min(self.capacity, 9999)
+        moved = 0
+        for entry in self._get_images():
+            bucket = self._bucket_of(entry.name)
+            if layout == "sharded" and bucket:
+                target = os.path.join(self.path, bucket, entry.name)
             else:
-                extension = img.format.lower()
+                target = os.path.join(self.path, entry.name)
+            if entry.path == target:
+                continue
+            # 逐个文件加锁，迁移期间存图、删图可以穿插进行
+            with self.file_lock:
+                if not os.path.exists(entry.path):
+                    continue
+                if os.path.exists(target):
+                    logger.warning(f"迁移跳过，目标已存在：{target}")
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(entry.path, target)
+                self._catalog_set(entry.name, target)
+            moved += 1
+        # 清理空的分桶目录
+        if layout == "flat":
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.isdigit() and entry.is_dir():
+                        try:
+                            os.rmdir(entry.path)
+                        except OSError:
+                            pass
+        return moved
 
+    def _get_image_names(self) -> list[str]:
+        """获取图片名称"""
+        return list(self._image_entries())
+
+    @staticmethod
+    def _detect_extension(image: bytes) -> str:
+        """识别图片格式，作为扩展名"""
+        fmt, _, _ = probe_image(image)
+        if fmt is None:
+            logger.warning("Image format could not be detected. Defaulting to 'jpg'.")
+            return "jpg"
+        return fmt.lower()
+
+    def _make_name(
+        self,
+        extension: str,
+        author: str = "",
+        index: int = 0,
+        names: list[str] | None = None,
+    ) -> str:
+        """按扩展名生成图片名称，index 为 0 时取最小的空闲序号"""
         if index == 0:
-            names = self._get_image_names()
-            existing_numbers = [
+            if names is None:
+                names = self._get_image_names()
+            existing_numbers = {
                 int(name.split("_")[1])
                 for name in names
                 if len(name.split("_")) > 1 and name.split("_")[1].isdigit()
-            ]
+            }
             index = 1
             while index in existing_numbers:
                 index += 1
 
         return f"{self.name}_{index}_{author}.{extension}"
 
-    def add_image(self, image: bytes, author: str = "default", index: int = 0) -> tuple[bool, str]:
-        """添加图片"""
-        img_name = self._generate_name(image, author, index)
-        images = self._get_images()
-
-        if len(images) >= self.capacity:
-            return False, f"图库【{self.name}】容量已满"
-
-        if self.compress:
+    def _generate_name(self, image: bytes, author: str = "", index: int = 0) -> str:
+        """生成图片名称"""
+        return self._make_name(self._detect_extension(image), author, index)
+
+    def prepare_image(self, image: bytes) -> dict:
+        """
+        存图前的耗时处理：识别格式、压缩、计算指纹。
+        不涉及图库状态，可放在线程中并行执行，结果交给 save_prepared 写入
+        """
+        source_sha = content_hash(image)
+        extension = self._detect_extension(image)
+        saved = 0
+        if self.optimize_gif and extension == "gif":
+            # 开了压缩的图库，动图同样缩到 512 以内
+            max_size = 512 if self.compress else None
+            if result := optimize_gif(image, max_size=max_size):
+                saved = len(image) - len(result)
+                image = result
+        elif self.compress:
             if result := compress_image(image, max_size=512):
                 image = result
+        sha, phash = ImageIndex.fingerprint(image)
+        return {
+            "image": image,
+            "extension": extension,
+            "sha": sha,
+            "phash": phash,
+            "source_sha": source_sha,
+            "saved": saved,
+        }
 
-        for img in images:
-            with open(img.path, "rb") as file:
-                if file.read() == image:
-                    return False, f"图库【{self.name}】中已存在该图片"
+    def has_sha(self, sha: str) -> bool:
+        """图库中是否已有此内容哈希（含压缩前的原图哈希），索引未建好时返回 False"""
+        return (
+            self.hash_index is not None
+            and self._indexed
+            and self.hash_index.contains(self.name, sha)
+        )
 
+    def save_prepared(
+        self, prepared: dict, author: str = "default", index: int = 0
+    ) -> SaveResult:
+        """
+        写入经 prepare_image 处理过的图片：容量检查、去重、命名、落盘、登记索引。
+        全程持有图库锁，并发存图不会分到同一个序号或互相覆盖
+        """
+        with self.file_lock:
+            return self._save_prepared(prepared, author, index)
+
+    def _save_prepared(self, prepared: dict, author: str, index: int) -> SaveResult:
+        self._sync_catalog()
+        images = self._image_entries()
+        names = list(images)
+
+        # 指定的序号已有图片时替换原图：图片数量不变，不受容量限制，也不淘汰其他图片
+        replaced = self._name_at(index, names) if index else None
+        full = replaced is None and len(images) >= self.capacity
+        if full and self.eviction == "reject":
+            return SaveResult(SaveResult.FULL)
+
+        image = prepared["image"]
+        sha = prepared["sha"]
+        if self.hash_index is not None and self._indexed:
+            if self.hash_index.contains(self.name, sha):
+                return SaveResult(SaveResult.DUPLICATE)
+        else:
+            for path in images.values():
+                with open(path, "rb") as file:
+                    if file.read() == image:
+                        return SaveResult(SaveResult.DUPLICATE)
+
+        evicted: list[str] = []
+        if full:
+            # 查重之后再腾位置，重复的图片不会挤掉已有图片
+            evicted = self._evict(len(images) - self.capacity + 1)
+            if len(images) - len(evicted) >= self.capacity:
+                return SaveResult(SaveResult.FULL)
+            names = [name for name in names if name not in evicted]
+        img_name = self._make_name(prepared["extension"], author, index, names)
+        old_sha = None
+        if replaced == img_name and self.blob_store is not None:
+            old_sha = self._blob_sha(img_name, images[img_name])
         try:
-            with open(os.path.join(self.path, img_name), "wb") as f:
-                f.write(image)
+            self.write_file(img_name, image, sha)
         except Exception as e:
-            return False, f"保存图片时发生错误：{str(e)}"
-
-        return True, f"图库【{self.name}】新增图片：\n{img_name}"
+            return SaveResult(SaveResult.ERROR, img_name, error=str(e))
+        if replaced is not None and replaced != img_name:
+            # 作者或格式不同，文件名也不同，删掉原图
+            try:
+                self.remove_file(replaced)
+            except FileNotFoundError:
+                pass
+            if self.hash_index is not None:
+                self.hash_index.remove(self.name, replaced)
+        elif old_sha is not None and old_sha != sha:
+            self.blob_store.release(old_sha)
+
+        if self.hash_index is not None:
+            self.hash_index.add(
+                self.name,
+                img_name,
+                sha,
+                prepared["phash"],
+                aliases=[prepared["source_sha"]],
+            )
+        self.gif_saved += prepared.get("saved", 0)
+        self.bag.add(img_name)
+        if self._evict_heap is not None:
+            self._evict_heap.push(img_name)
+
+        if replaced is not None:
+            return SaveResult(SaveResult.REPLACED, img_name, replaced=replaced)
+        return SaveResult(SaveResult.ADDED, img_name, evicted=evicted)
+
+    @staticmethod
+    def _name_at(index: int, names: list[str]) -> str | None:
+        """序号为 index 的图片名，没有时返回 None"""
+        seq = str(index)
+        for name in names:
+            parts = name.split("_")
+            if len(parts) > 1 and parts[1] == seq:
+                return name
+        return None
+
+    # ----------------- 满库淘汰 -----------------
+
+    def _usage_kinds(self) -> tuple[tuple[str, ...], bool]:
+        """当前策略参考的计数类别，以及是否按时间衰减"""
+        if self.eviction == "lfu":
+            return ("send", "view"), True
+        return ("send",), False
+
+    def _eviction_priority(self, name: str, mtime: int | None = None) -> tuple | None:
+        """淘汰优先级 (使用次数, 修改时间)，越小越先淘汰；文件不存在时返回 None"""
+        if mtime is None:
+            try:
+                mtime = os.stat(self.image_path(name)).st_mtime_ns
+            except FileNotFoundError:
+                return None
+        if self.eviction == "oldest" or self.usage is None:
+            return (0.0, mtime)
+        kinds, aging = self._usage_kinds()
+        return (self.usage.score(self.name, name, kinds, aging), mtime)
+
+    def _build_evict_heap(self) -> EvictionHeap:
+        """扫描一次图库建堆，使用次数整批取出，不逐张查询"""
+        scores: dict[str, float] = {}
+        if self.eviction != "oldest" and self.usage is not None:
+            kinds, aging = self._usage_kinds()
+            scores = self.usage.scores(self.name, kinds, aging)
+        heap = EvictionHeap(self._eviction_priority, aging=self.eviction == "lfu")
+        items = []
+        for name, path in self._image_entries().items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            items.append(((scores.get(name, 0.0), mtime), name))
+        heap.build(items)
+        return heap
+
+    def _evict(self, count: int) -> list[str]:
+        """按淘汰策略删除 count 张图片，返回被删除的文件名"""
+        generation = self.usage.generation if self.usage is not None else 0
+        if self._evict_heap is None or generation != self._evict_generation:
+            # 首次淘汰，或衰减基准日已变（分数整体缩放，堆中的旧优先级不再可比）
+            self._evict_heap = self._build_evict_heap()
+            self._evict_generation = generation
+        evicted = []
+        while len(evicted) < count and (name := self._evict_heap.pop()):
+            try:
+                self.remove_file(name)
+            except FileNotFoundError:
+                if self.hash_index is not None:
+                    self.hash_index.remove(self.name, name)
+                continue
+            if self.hash_index is not None:
+                self.hash_index.remove(self.name, name)
+            logger.info(f"图库【{self.name}】已满，淘汰图片：{name}")
+            evicted.append(name)
+        return evicted
+
+    def renamed(self, old_name: str, new_name: str, old_path: str):
+        """图片改名（如重压缩换了格式）后同步洗牌袋、淘汰候选堆与热点缓存"""
+        if self.image_cache is not None:
+            self.image_cache.invalidate(old_path)
+        self._catalog_pop(old_name)
+        self.bag.discard(old_name)
+        self.bag.add(new_name)
+        if self._evict_heap is not None:
+            self._evict_heap.discard(old_name)
+            self._evict_heap.push(new_name)
+
+    def set_eviction(self, eviction: str):
+        """切换淘汰策略，候选堆在下次淘汰时按新策略重建"""
+        if eviction not in self.EVICTIONS:
+            raise ValueError(f"未知的淘汰策略：{eviction}")
+        self.eviction = eviction
+        self._evict_heap = None
+
+    def write_file(self, name: str, data: bytes, sha: str | None = None):
+        """写入（或原子替换）图库中的一个文件，启用内容寻址存储时写为 blob 的链接"""
+        with self.file_lock:
+            self._sync_catalog()
+            path = self.image_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.blob_store is not None:
+                self.blob_store.store(data, sha or content_hash(data), path)
+            else:
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            self._catalog_set(name, path)
+
+    def remove_file(self, name: str):
+        """
+        删除图库中的一个文件，启用内容寻址存储时释放对应的 blob；
+        文件已在插件之外被删除时，清掉残留的记录后抛出 FileNotFoundError
+        """
+        with self.file_lock:
+            self._sync_catalog()
+            path = self.image_path(name)
+            try:
+                sha = self._blob_sha(name, path) if self.blob_store is not None else None
+                os.remove(path)
+            except FileNotFoundError:
+                self._forget(name, path)
+                raise
+            self._forget(name, path)
+            if self.blob_store is not None:
+                self.blob_store.release(sha)
+
+    def _forget(self, name: str, path: str):
+        """从图片目录、热点缓存、洗牌袋与淘汰候选堆中移除一张图片"""
+        self._catalog_pop(name)
+        if self.image_cache is not None:
+            self.image_cache.invalidate(path)
+        self.bag.discard(name)
+        if self._evict_heap is not None:
+            self._evict_heap.discard(name)
+
+    def _blob_sha(self, name: str, path: str) -> str:
+        """图片对应的 blob 哈希：优先取自指纹索引，索引中没有时读文件计算"""
+        sha = None
+        if self.hash_index is not None:
+            sha = self.hash_index.get_sha(self.name, name)
+        if sha is None:
+            with open(path, "rb") as f:
+                sha = content_hash(f.read())
+        return sha
+
+    def manifest(self) -> list[dict]:
+        """
+        图库清单：每张图片的 文件名、内容哈希、序号、作者、大小，用于增量同步；
+        哈希优先取自指纹索引，索引中没有时读文件计算
+        """
+        images = []
+        for name, path in self._image_entries().items():
+            sha = self._blob_sha(name, path)
+            parts = os.path.splitext(name)[0].split("_")
+            images.append(
+                {
+                    "name": name,
+                    "sha": sha,
+                    "seq": int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0,
+                    "author": parts[2] if len(parts) > 2 else "",
+                    "size": os.path.getsize(path),
+                }
+            )
+        return sorted(images, key=lambda e: e["seq"])
+
+    def add_image(self, image: bytes, author: str = "default", index: int = 0) -> SaveResult:
+        """添加图片"""
+        return self.save_prepared(self.prepare_image(image), author, index)
 
     def delete(self):
         """删除图库"""
         abs_path = os.path.abspath(self.path)
+        images = self._image_entries() if os.path.exists(abs_path) else {}
+        # 只释放本图库引用的 blob，不必扫描整个存储
+        shas: set[str] = set()
+        if self.blob_store is not None:
+            for name, path in images.items():
+                try:
+                    shas.add(self._blob_sha(name, path))
+                except OSError as e:
+                    logger.warning(f"读取图片失败：{path}，错误：{e}")
         if os.path.exists(abs_path):
             shutil.rmtree(abs_path)
+        if self.image_cache is not None:
+            for path in images.values():
+                self.image_cache.invalidate(path)
+        self._catalog = None
+        self.bag.invalidate()
+        self._evict_heap = None
+        if self.blob_store is not None:
+            for sha in shas:
+                self.blob_store.release(sha)
+        if self.hash_index is not None:
+            self.hash_index.remove_gallery(self.name)
+
+    def _index_map(self) -> dict[str, tuple[str, str]]:
+        """建立 序号 -> (文件名, 路径) 的映射"""
+        mapping: dict[str, tuple[str, str]] = {}
+        for name, path in self._image_entries().items():
+            parts = name.split("_")
+            if len(parts) > 1:
+                mapping.setdefault(parts[1], (name, path))
+        return mapping
+
+    def delete_many(self, indexes: list[str | int]) -> list[tuple[bool, str]]:
+        """批量删除图片：只扫描一次目录，结果与 indexes 一一对应"""
+        with self.file_lock:
+            return self._delete_many(indexes)
+
+    def _delete_many(self, indexes: list[str | int]) -> list[tuple[bool, str]]:
+        self._sync_catalog()
+        mapping = self._index_map()
+        if not mapping:
+            return [(False, f"图库【{self.name}】为空")] * len(indexes)
+        results: list[tuple[bool, str]] = []
+        for index in indexes:
+            entry = mapping.pop(str(index), None)
+            if not entry:
+                results.append((False, f"图库【{self.name}】中不存在图{index}"))
+                continue
+            name = entry[0]
+            # 逐张处理失败，不中断整批
+            try:
+                self.remove_file(name)
+            except FileNotFoundError:
+                if self.hash_index is not None:
+                    self.hash_index.remove(self.name, name)
+                results.append((False, f"图库【{self.name}】中的图{index}已不存在：{name}"))
+                continue
+            except OSError as e:
+                results.append((False, f"删除图{index}失败：{name}，错误：{e}"))
+                continue
+            if self.hash_index is not None:
+                self.hash_index.remove(self.name, name)
+            results.append((True, f"图库【{self.name}】已删除图片：\n{name}"))
+        return results
+
+    def view_many(self, indexes: list[str | int]) -> list[tuple[bool, str]]:
+        """批量查看图片：只扫描一次目录，成功时返回图片路径，结果与 indexes 一一对应"""
+        mapping = self._index_map()
+        if not mapping:
+            return [(False, f"图库【{self.name}】为空")] * len(indexes)
+        return [
+            (True, mapping[str(index)][1])
+            if str(index) in mapping
+            else (False, f"图库【{self.name}】中不存在图{index}")
+            for index in indexes
+        ]
 
     def delete_image_by_index(self, index: str | int) -> tuple[bool, str]:
         """通过索引删除图片"""
-        names = self._get_image_names()
-        if not names:
-            return False, f"图库【{self.name}】为空"
-        name = next((n for n in names if n.split("_")[1] == str(index)), None)
-        if name:
-            os.remove(os.path.join(self.path, name))
-            return True, f"图库【{self.name}】已删除图片：\n{name}"
-        return False, f"图库【{self.name}】中不存在图{index}"
+        return self.delete_many([index])[0]
 
     def view_by_index(self, index: str | int) -> tuple[bool, str | os.PathLike]:
         """通过索引查看图片"""
-        names = self._get_image_names()
-        if not names:
-            return False, f"图库【{self.name}】为空"
-        name = next((n for n in names if n.split("_")[1] == str(index)), None)
-        if name:
-            return True, os.path.join(self.path, name)
-        return False, f"图库【{self.name}】中不存在图{index}"
+        return self.view_many([index])[0]
 
     def view_by_bytes(self, image: bytes) -> tuple[bool, str | os.PathLike]:
         """通过字节查看图片"""
-        for file in self._get_images():
-            with open(file.path, "rb") as f:
+        for name, path in self._image_entries().items():
+            with open(path, "rb") as f:
                 if f.read() == image:
-                    return True, file.name
+                    return True, name
         return False, f"图库【{self.name}】中没有这张图"
 
-    def get_random_image(self) -> tuple[bool, str | os.PathLike]:
-        """获取一张随机图片"""
-        images = self._get_images()
-        if not images:
-            return False, f"图库【{self.name}】为空"
-        return True, random.choice(images).path
+    def get_random_image(
+        self, exclude: Collection[str] = ()
+    ) -> tuple[bool, str | os.PathLike]:
+        """
+        获取一张随机图片：从洗牌袋中抽取，一轮之内不会重复
+        :param exclude: 尽量避开的图片路径（如当前会话最近发过的）
+        """
+        names = {os.path.basename(path) for path in exclude}
+        while (name := self.bag.draw(names)) is not None:
+            path = self.image_path(name)
+            if os.path.exists(path):
+                return True, path
+            # 文件已在外部被删除（未持有文件锁，只更新本进程的图片目录）
+            if self._catalog is not None:
+                self._catalog.pop(name, None)
+            self.bag.discard(name)
+        return False, f"图库【{self.name}】为空"
 
 
@@ -0,0 +1,155 @@
+import asyncio
+import math
+import os
+from pathlib import Path
+
+from astrbot.api import logger
+
+
+class ReverseGeocoder:
+    """
+    离线逆地理编码：把经纬度解析为最近的地名
+    - 地名表使用 GeoNames 导出格式（cities1000.txt / cities15000.txt 等，制表符分隔），
+      也接受每行 "地名,纬度,经度" 的简单 CSV
+    - 同目录下存在 admin1CodesASCII.txt 时，地名附带一级行政区名
+    - 地名按 1° 网格分桶，查询时只计算半径内网格中的候选点
+    - 首次查询时在线程中加载，加载失败或文件不存在时视为不可用
+    """
+
+    CELL = 1.0  # 网格边长（度）
+    EARTH_RADIUS = 6371.0  # km
+    KM_PER_DEGREE = 111.2
+
+    def __init__(self, places_file: str | Path, max_distance_km: float = 50):
+        self.places_file = Path(places_file) if places_file else None
+        self.max_distance_km = max(1.0, max_distance_km)
+
+        self._grid: dict[tuple[int, int], list[tuple[float, float, str]]] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self.size = 0
+
+    @property
+    def available(self) -> bool:
+        return self.size > 0
+
+    async def ensure_loaded(self) -> bool:
+        """首次使用时加载地名表，返回是否可用"""
+        if self._loaded:
+            return self.available
+        async with self._lock:
+            if not self._loaded:
+                try:
+                    await asyncio.to_thread(self.load)
+                except Exception as e:
+                    # 文件损坏、编码不对或无权读取：视为不可用，交给在线解析，不再反复重试
+                    logger.error(f"加载离线地名表失败：{self.places_file}，错误：{e}")
+                    self._grid = {}
+                    self.size = 0
+                self._loaded = True
+        return self.available
+
+    # ----------------- 加载 -----------------
+
+    def _load_admin1(self) -> dict[str, str]:
+        """一级行政区表：'CN.22' -> 'Beijing'"""
+        assert self.places_file is not None
+        path = self.places_file.parent / "admin1CodesASCII.txt"
+        if not path.exists():
+            return {}
+        names = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) >= 2:
+                    names[cols[0]] = cols[1]
+        return names
+
+    def load(self) -> int:
+        """加载地名表，返回地名数量"""
+        if not self.places_file or not self.places_file.exists():
+            if self.places_file:
+                logger.warning(f"离线地名表不存在：{self.places_file}")
+            return 0
+        admin1 = self._load_admin1()
+        grid: dict[tuple[int, int], list[tuple[float, float, str]]] = {}
+        count = 0
+        with open(self.places_file, encoding="utf-8") as f:
+            for line in f:
+                place = self._parse_line(line, admin1)
+                if place is None:
+                    continue
+                lat, lon, _ = place
+                grid.setdefault(self._cell(lat, lon), []).append(place)
+                count += 1
+        self._grid = grid
+        self.size = count
+        logger.info(f"离线地名表已加载：{count} 个地名（{self.places_file.name}）")
+        return count
+
+    @staticmethod
+    def _parse_line(
+        line: str, admin1: dict[str, str]
+    ) -> tuple[float, float, str] | None:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return None
+        cols = line.split("\t")
+        try:
+            # GeoNames：1 名称，4 纬度，5 经度，8 国家代码，10 一级行政区代码
+            if len(cols) >= 11:
+                name, lat, lon = cols[1], float(cols[4]), float(cols[5])
+                country, code = cols[8], cols[10]
+                parts = [name]
+                if region := admin1.get(f"{country}.{code}"):
+                    if region != name:
+                        parts.append(region)
+                if country:
+                    parts.append(country)
+                return lat, lon, ", ".join(parts)
+            name, lat, lon = line.rsplit(",", 2)
+            return float(lat), float(lon), name.strip()
+        except ValueError:
+            return None
+
+    # ----------------- 查询 -----------------
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.CELL), math.floor(lon / self.CELL)
+
+    @classmethod
+    def distance(cls, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """两点间的大圆距离（km）"""
+        p1, p2 = math.radians(lat1), math.radians(lat2)
+        dp, dl = p2 - p1, math.radians(lon2 - lon1)
+        a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+        return 2 * cls.EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+    def nearest(self, lat: float, lon: float) -> tuple[str, float] | None:
+        """查找 max_distance_km 内最近的地名，返回 (地名, 距离km)"""
+        if not self._grid:
+            return None
+        dlat = self.max_distance_km / self.KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(89.9, abs(lat) + dlat))), 1e-3)
+        dlon = min(180.0, dlat / cos_lat)
+
+        lat_lo, lon_lo = self._cell(lat - dlat, lon - dlon)
+        lat_hi, lon_hi = self._cell(lat + dlat, lon + dlon)
+        lon_cells = int(360 / self.CELL)
+        best: tuple[str, float] | None = None
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lon_lo, min(lon_hi, lon_lo + lon_cells - 1) + 1):
+                # 经度越过 ±180° 时回绕
+                j = (j + lon_cells // 2) % lon_cells - lon_cells // 2
+                for plat, plon, label in self._grid.get((i, j), ()):
+                    dist = self.distance(lat, lon, plat, plon)
+                    if dist <= self.max_distance_km and (best is None or dist < best[1]):
+                        best = (label, dist)
+        return best
+
+    def stats(self) -> dict:
+        return {
+            "places": self.size,
+            "cells": len(self._grid),
+            "file": os.fspath(self.places_file) if self.places_file else "",
+        }
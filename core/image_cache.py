@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import io
+import os
+import threading
+from collections import Counter, OrderedDict
+from collections.abc import Iterable
+from pathlib import Path
+
+from PIL import Image
+
+from astrbot.api import logger
+
+from ..utils import open_image_safely
+
+
+class HotImageCache:
+    """
+    热点图片缓存：自动发图、看图直接发送内存中的图片字节，不再每次读盘
+    - 按内存预算的 LRU，图片被请求 min_hits 次后才进入缓存，避免冷门图片挤占热点
+    - 记录每张图片的请求次数，记录过多时整体减半并丢弃归零的
+    - 可选的发送副本：过大的 PNG/BMP/TIFF 转码为 JPEG/WEBP 并压到字节上限以内，
+      生成一次后保存在 rendition_dir 复用，原图不变
+    - 图库删图时调用 invalidate（可能在线程中），移出缓存并删除对应的发送副本
+    """
+
+    RENDITION_EXT = {".png", ".bmp", ".tiff"}
+    RENDITION_SUFFIXES = (".jpg", ".webp")
+    # 请求次数记录的条数上限
+    FREQ_MAX = 10000
+
+    def __init__(
+        self,
+        rendition_dir: Path,
+        max_bytes: int = 64 * 1024 * 1024,
+        min_hits: int = 2,
+        rendition: bool = True,
+        rendition_max_bytes: int = 1024 * 1024,
+        rendition_format: str = "jpeg",
+    ):
+        self.rendition_dir = rendition_dir
+        self.max_bytes = max_bytes
+        self.min_hits = max(1, min_hits)
+        self.rendition = rendition
+        self.rendition_max_bytes = rendition_max_bytes
+        self.rendition_format = "webp" if rendition_format == "webp" else "jpeg"
+
+        # 路径 -> (修改时间, 字节)
+        self._cache: OrderedDict[str, tuple[int, bytes]] = OrderedDict()
+        self._cache_bytes = 0
+        self.freq: Counter[str] = Counter()
+        self.hits = 0
+        self.misses = 0
+        # 事件循环与删图线程都会修改缓存
+        self._lock = threading.Lock()
+
+    async def get(self, path: str | os.PathLike) -> bytes | None:
+        """获取用于发送的图片字节（有发送副本时返回副本），图片已被删除时返回 None"""
+        path = str(path)
+        try:
+            st = await asyncio.to_thread(os.stat, path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+
+        with self._lock:
+            self.freq[path] += 1
+            hot = self.freq[path] >= self.min_hits
+            if len(self.freq) > self.FREQ_MAX:
+                self._decay_freq()
+            entry = self._cache.get(path)
+            if entry and entry[0] == st.st_mtime_ns:
+                self._cache.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        try:
+            data = await asyncio.to_thread(self._load, path, st)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+        if hot:
+            with self._lock:
+                self._put(path, st.st_mtime_ns, data)
+        return data
+
+    def _decay_freq(self):
+        """请求次数整体减半，只请求过一次的记录被丢弃"""
+        self.freq = Counter({p: n // 2 for p, n in self.freq.items() if n > 1})
+
+    def invalidate(self, path: str | os.PathLike):
+        """图片被删除或替换时移出缓存，并删除它的发送副本"""
+        path = str(path)
+        with self._lock:
+            self._pop(path)
+            self.freq.pop(path, None)
+        key = self._rendition_key(path)
+        for suffix in self.RENDITION_SUFFIXES:
+            (self.rendition_dir / f"{key}{suffix}").unlink(missing_ok=True)
+
+    def _pop(self, path: str):
+        if entry := self._cache.pop(path, None):
+            self._cache_bytes -= len(entry[1])
+
+    def _put(self, path: str, mtime: int, data: bytes):
+        if len(data) > self.max_bytes // 4:
+            return
+        self._pop(path)
+        self._cache[path] = (mtime, data)
+        self._cache_bytes += len(data)
+        while self._cache_bytes > self.max_bytes:
+            self._pop(next(iter(self._cache)))
+
+    # ----------------- 发送副本 -----------------
+
+    def _load(self, path: str, st: os.stat_result) -> bytes:
+        if (
+            self.rendition
+            and st.st_size > self.rendition_max_bytes
+            and os.path.splitext(path)[1].lower() in self.RENDITION_EXT
+        ):
+            try:
+                return self._get_rendition(path, st)
+            except Exception as e:
+                logger.warning(f"生成发送副本失败，发送原图：{path}，错误：{e}")
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _rendition_key(path: str) -> str:
+        return hashlib.sha1(path.encode()).hexdigest()
+
+    def _get_rendition(self, path: str, st: os.stat_result) -> bytes:
+        """
+        读取或生成发送副本：副本的修改时间设为与原图相同，
+        原图被替换（修改时间变化）后自动重新生成
+        """
+        ext = "jpg" if self.rendition_format == "jpeg" else "webp"
+        target = self.rendition_dir / f"{self._rendition_key(path)}.{ext}"
+        try:
+            if target.stat().st_mtime_ns == st.st_mtime_ns:
+                return target.read_bytes()
+        except FileNotFoundError:
+            pass
+
+        data = self._encode(path)
+        self.rendition_dir.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, target)
+        logger.debug(f"已生成发送副本：{path} ({st.st_size} -> {len(data)} 字节)")
+        return data
+
+    def prune_renditions(self, paths: Iterable[str | os.PathLike]) -> int:
+        """删除不属于 paths 中任何图片的发送副本（原图已在插件外被删除、改名等），返回删除数"""
+        if not self.rendition_dir.is_dir():
+            return 0
+        keys = {self._rendition_key(str(path)) for path in paths}
+        removed = 0
+        with os.scandir(self.rendition_dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext in self.RENDITION_SUFFIXES and stem in keys:
+                    continue
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def _encode(self, path: str) -> bytes:
+        """转码并逐步降低质量/尺寸，直到不超过字节上限"""
+        with open_image_safely(path) as img:
+            if self.rendition_format == "jpeg":
+                # JPEG 不支持透明，透明部分铺白底
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+
+            data = b""
+            for quality in (90, 80, 70, 60):
+                out = io.BytesIO()
+                img.save(out, format=self.rendition_format, quality=quality)
+                data = out.getvalue()
+                if len(data) <= self.rendition_max_bytes:
+                    return data
+            # 降质量仍超限，按比例缩小尺寸
+            while len(data) > self.rendition_max_bytes and min(img.size) > 64:
+                img = img.resize(
+                    (img.width * 3 // 4, img.height * 3 // 4),
+                    Image.Resampling.LANCZOS,
+                )
+                out = io.BytesIO()
+                img.save(out, format=self.rendition_format, quality=60)
+                data = out.getvalue()
+            return data
+
+    def stats(self, top: int = 5) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            top_paths = self.freq.most_common(top)
+        return {
+            "cached": len(self._cache),
+            "cached_bytes": self._cache_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "top": [(os.path.basename(p), n) for p, n in top_paths],
+        }
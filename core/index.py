@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from ..utils import content_hash, hamming, image_dhash
+
+# 索引键：(图库名, 文件名)
+Key = tuple[str, str]
+
+
+class PHashBuckets:
+    """
+    感知哈希近邻查找：把 64 位哈希切成 4 段 16 位分桶，
+    汉明距离 ≤3 的两个哈希至少有一段完全相同，查找只需比较同桶候选；
+    半径再大就可能漏掉近邻，调用方需把半径限制在 MAX_RADIUS 以内
+    """
+
+    BANDS = 4
+    BAND_BITS = 16
+    # 鸽巢原理：不同位数少于段数时必有一段完全相同
+    MAX_RADIUS = BANDS - 1
+
+    def __init__(self):
+        self._buckets: dict[tuple[int, int], set[Hashable]] = {}
+
+    def _bands(self, phash: int):
+        mask = (1 << self.BAND_BITS) - 1
+        for i in range(self.BANDS):
+            yield i, (phash >> (i * self.BAND_BITS)) & mask
+
+    def add(self, key: Hashable, phash: int):
+        for band in self._bands(phash):
+            self._buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: Hashable, phash: int):
+        for band in self._bands(phash):
+            if bucket := self._buckets.get(band):
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def candidates(self, phash: int) -> set[Hashable]:
+        """与 phash 至少有一段相同的所有键"""
+        result: set[Hashable] = set()
+        for band in self._bands(phash):
+            result |= self._buckets.get(band, set())
+        return result
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class ImageIndex:
+    """
+    全局图片指纹索引：
+    - 记录所有图库中已存图片的内容哈希(sha256)与感知哈希(dHash)
+    - 记录最近被拒收的图片（LLM 未能归类、存图失败等），带过期时间
+    自动收集在调用 LLM 之前先查此索引，命中则跳过
+    """
+
+    # 感知哈希近似匹配支持的最大汉明距离
+    MAX_RADIUS = PHashBuckets.MAX_RADIUS
+
+    def __init__(self, reject_ttl: float = 86400, reject_max: int = 2000):
+        self.reject_ttl = reject_ttl
+        self.reject_max = reject_max
+
+        self._lock = threading.RLock()
+        self._sha: dict[str, set[Key]] = {}
+        self._entries: dict[Key, tuple[list[str], int | None]] = {}
+        self._phash = PHashBuckets()
+
+        self._rejected: OrderedDict[str, tuple[float, int | None]] = OrderedDict()
+        self._rejected_phash = PHashBuckets()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def fingerprint(image: bytes) -> tuple[str, int | None]:
+        """计算 (内容哈希, 感知哈希)，耗 CPU，建议在线程中调用"""
+        return content_hash(image), image_dhash(image)
+
+    # ----------------- 已存图片 -----------------
+
+    def add(
+        self,
+        gallery: str,
+        name: str,
+        sha: str,
+        phash: int | None,
+        aliases: list[str] | None = None,
+    ):
+        """
+        登记一张已存图片
+        :param aliases: 额外的内容哈希，例如压缩前原图的哈希
+        """
+        key = (gallery, name)
+        shas = [sha, *(a for a in aliases or [] if a != sha)]
+        with self._lock:
+            self.remove(gallery, name)
+            self._entries[key] = (shas, phash)
+            for h in shas:
+                self._sha.setdefault(h, set()).add(key)
+            if phash is not None:
+                self._phash.add(key, phash)
+
+    def add_image(self, gallery: str, name: str, image: bytes):
+        """读取字节并登记，耗 CPU，建议在线程中调用"""
+        sha, phash = self.fingerprint(image)
+        self.add(gallery, name, sha, phash)
+
+    def remove(self, gallery: str, name: str):
+        """移除一张图片"""
+        key = (gallery, name)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if not entry:
+                return
+            shas, phash = entry
+            for h in shas:
+                if keys := self._sha.get(h):
+                    keys.discard(key)
+                    if not keys:
+                        del self._sha[h]
+            if phash is not None:
+                self._phash.remove(key, phash)
+
+    def replace(
+        self,
+        gallery: str,
+        old_name: str,
+        new_name: str,
+        sha: str,
+        phash: int | None,
+    ):
+        """
+        图片被重新编码后原子地更新登记：旧文件名移除、新文件名登记，
+        旧的内容哈希保留为别名，原图再次存入时仍能判重
+        """
+        with self._lock:
+            entry = self._entries.get((gallery, old_name))
+            aliases = entry[0] if entry else []
+            self.remove(gallery, old_name)
+            self.add(gallery, new_name, sha, phash, aliases=aliases)
+
+    def remove_gallery(self, gallery: str):
+        """移除整个图库"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == gallery]:
+                self.remove(*key)
+
+    def contains(self, gallery: str, sha: str) -> bool:
+        """指定图库中是否已有此内容哈希"""
+        with self._lock:
+            return any(k[0] == gallery for k in self._sha.get(sha, ()))
+
+    def get_sha(self, gallery: str, name: str) -> str | None:
+        """图片的内容哈希"""
+        with self._lock:
+            entry = self._entries.get((gallery, name))
+            return entry[0][0] if entry else None
+
+    def find(self, sha: str, phash: int | None, radius: int = 0) -> Key | None:
+        """
+        在所有图库中查找同一张图：先按内容哈希精确匹配，
+        再按感知哈希在 radius 汉明距离内近似匹配
+        """
+        with self._lock:
+            if keys := self._sha.get(sha):
+                return next(iter(keys))
+            if phash is None or radius <= 0:
+                return None
+            for key in self._phash.candidates(phash):
+                other = self._entries[key][1]  # type: ignore
+                if other is not None and hamming(phash, other) <= radius:
+                    return key  # type: ignore
+        return None
+
+    # ----------------- 近期拒收 -----------------
+
+    def _expire_rejected(self):
+        now = time.time()
+        while self._rejected:
+            sha, (ts, phash) = next(iter(self._rejected.items()))
+            if now - ts < self.reject_ttl and len(self._rejected) <= self.reject_max:
+                break
+            self._rejected.popitem(last=False)
+            if phash is not None:
+                self._rejected_phash.remove(sha, phash)
+
+    def reject(self, sha: str, phash: int | None):
+        """记录一张被拒收的图片"""
+        with self._lock:
+            if old := self._rejected.pop(sha, None):
+                if old[1] is not None:
+                    self._rejected_phash.remove(sha, old[1])
+            self._rejected[sha] = (time.time(), phash)
+            if phash is not None:
+                self._rejected_phash.add(sha, phash)
+            self._expire_rejected()
+
+    def is_rejected(self, sha: str, phash: int | None, radius: int = 0) -> bool:
+        """是否为近期拒收过的图片"""
+        with self._lock:
+            self._expire_rejected()
+            if sha in self._rejected:
+                return True
+            if phash is None or radius <= 0:
+                return False
+            return any(
+                (other := self._rejected[key][1]) is not None  # type: ignore
+                and hamming(phash, other) <= radius
+                for key in self._rejected_phash.candidates(phash)
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "images": len(self._entries),
+                "hashes": len(self._sha),
+                "rejected": len(self._rejected),
+            }
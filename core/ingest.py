@@ -0,0 +1,250 @@
+import asyncio
+import json
+import os
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+from astrbot.api import logger
+
+from ..utils import content_hash, download_file
+from .gallery import Gallery, SaveResult
+
+# 图片来源：(标签, 加载函数)，标签用于日志与报告（URL、文件路径等）
+Source = tuple[str, Callable[[], Awaitable[bytes | None]]]
+
+
+class IngestReport:
+    """一次批量存图的结果汇总"""
+
+    def __init__(self, gallery: Gallery):
+        self.gallery = gallery
+        self.added: list[str] = []
+        self.evicted: list[str] = []  # 满库时为腾位置淘汰的图片
+        self.duplicates = 0
+        self.failed = 0
+        self.full = 0
+        self.skipped = 0  # 断点续传时跳过的已处理项
+        self.bytes_in = 0
+        self.bytes_saved = 0  # 动图优化节省的字节数
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.added) + self.duplicates + self.failed + self.full
+
+    @property
+    def throughput(self) -> float:
+        """每秒处理图片数"""
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_str(self) -> str:
+        lines = [f"图库【{self.gallery.name}】新增 {len(self.added)} 张图片"]
+        lines.extend(self.added)
+        if self.duplicates:
+            lines.append(f"重复 {self.duplicates} 张")
+        if self.full:
+            lines.append(f"容量已满，未存入 {self.full} 张")
+        if self.evicted:
+            lines.append(f"满库淘汰 {len(self.evicted)} 张：{'、'.join(self.evicted)}")
+        if self.failed:
+            lines.append(f"失败 {self.failed} 张")
+        if self.skipped:
+            lines.append(f"断点续传跳过 {self.skipped} 张")
+        if self.bytes_saved:
+            lines.append(f"动图优化节省 {self.bytes_saved / 1024:.1f} KB")
+        return "\n".join(lines)
+
+    def summary(self) -> str:
+        """不列出文件名的简要汇总，附带吞吐量（用于大批量导入）"""
+        lines = [
+            f"图库【{self.gallery.name}】导入完成：新增 {len(self.added)} 张，"
+            f"重复 {self.duplicates} 张，容量已满 {self.full} 张，失败 {self.failed} 张"
+        ]
+        if self.evicted:
+            lines.append(f"满库淘汰 {len(self.evicted)} 张")
+        if self.skipped:
+            lines.append(f"断点续传跳过 {self.skipped} 张")
+        lines.append(
+            f"耗时 {self.elapsed:.1f} 秒，{self.throughput:.1f} 张/秒，"
+            f"读入 {self.bytes_in / 1024 / 1024:.2f} MB"
+        )
+        if self.bytes_saved:
+            lines.append(f"动图优化节省 {self.bytes_saved / 1024 / 1024:.2f} MB")
+        return "\n".join(lines)
+
+
+class ImageIngestor:
+    """
+    批量存图流水线：
+    加载(下载/读文件) → 解码/压缩/指纹(线程池，有界并发) → 去重/写入(单写者)
+    各阶段重叠执行：前面的图片在写入时，后面的图片仍在下载和压缩；
+    固定 concurrency 个 worker 依次领取来源，待写队列同样限长，
+    写入跟不上时 worker 停下等待，内存中最多约 2 × concurrency 张处理中的图片
+    """
+
+    # 断点文件每处理多少项写一次
+    CHECKPOINT_EVERY = 50
+
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = max(1, concurrency)
+
+    @staticmethod
+    def list_image_files(root: str) -> list[str]:
+        """递归列出目录下的所有图片文件（按路径排序，保证断点续传时顺序稳定）"""
+        exts = tuple(Gallery.EXT)
+        paths = []
+        for dirpath, _, files in os.walk(root):
+            for file in files:
+                if file.lower().endswith(exts):
+                    paths.append(os.path.join(dirpath, file))
+        return sorted(paths)
+
+    async def ingest_urls(
+        self, gallery: Gallery, urls: list[str], author: str = "default", index: int = 0
+    ) -> IngestReport:
+        """并发下载多张图片并存入图库"""
+        sources: list[Source] = [
+            (url, lambda url=url: download_file(url)) for url in urls
+        ]
+        return await self.ingest(gallery, sources, author, index)
+
+    async def ingest_files(
+        self,
+        gallery: Gallery,
+        paths: list[str],
+        author: str = "default",
+        checkpoint: Path | None = None,
+    ) -> IngestReport:
+        """
+        批量导入本地图片文件
+        :param checkpoint: 断点文件，记录已处理的文件；中途崩溃后再次导入会跳过这些文件，
+            全部完成后删除
+        """
+        done: set[str] = set()
+        if checkpoint and checkpoint.exists():
+            try:
+                done = set(json.loads(checkpoint.read_text(encoding="utf-8")))
+                logger.info(f"从断点继续导入，已处理 {len(done)} 个文件")
+            except Exception as e:
+                logger.warning(f"断点文件损坏，重新导入：{e}")
+
+        pending = [p for p in paths if p not in done]
+        sources: list[Source] = [
+            (path, lambda path=path: asyncio.to_thread(Path(path).read_bytes))
+            for path in pending
+        ]
+
+        def save_checkpoint():
+            if checkpoint is None:
+                return
+            tmp = checkpoint.with_suffix(".tmp")
+            tmp.write_text(json.dumps(sorted(done), ensure_ascii=False), "utf-8")
+            os.replace(tmp, checkpoint)
+
+        def on_done(label: str):
+            done.add(label)
+            if len(done) % self.CHECKPOINT_EVERY == 0:
+                save_checkpoint()
+
+        try:
+            report = await self.ingest(gallery, sources, author, on_done=on_done)
+        except BaseException:
+            save_checkpoint()
+            raise
+        report.skipped = len(paths) - len(pending)
+        if checkpoint:
+            checkpoint.unlink(missing_ok=True)
+        logger.info(report.summary())
+        return report
+
+    async def ingest(
+        self,
+        gallery: Gallery,
+        sources: list[Source],
+        author: str = "default",
+        index: int = 0,
+        on_done: Callable[[str], None] | None = None,
+        authors: dict[str, str] | None = None,
+    ) -> IngestReport:
+        """
+        存入多张图片
+        :param index: 指定序号，仅在只有一张图片时生效
+        :param on_done: 每一项处理完毕（无论成败）后的回调，参数为来源标签
+        :param authors: 按来源标签单独指定作者（如增量包清单中记录的作者），未指定的用 author
+        """
+        report = IngestReport(gallery)
+        index = index if len(sources) == 1 else 0
+        pending = iter(sources)
+        write_queue: asyncio.Queue[dict | None] = asyncio.Queue(
+            maxsize=self.concurrency
+        )
+
+        def finish(label: str):
+            if on_done:
+                on_done(label)
+
+        async def prepare():
+            # 处理完一张、交给写者之后才领取下一张
+            for label, load in pending:
+                try:
+                    image = await load()
+                    if not image:
+                        raise ValueError("加载图片失败")
+                    report.bytes_in += len(image)
+                    # 原图已在索引中，省去压缩与指纹计算
+                    if gallery.has_sha(content_hash(image)):
+                        report.duplicates += 1
+                        finish(label)
+                        continue
+                    prepared = await asyncio.to_thread(gallery.prepare_image, image)
+                except Exception as e:
+                    logger.warning(f"存图处理失败：{label}，错误：{e}")
+                    report.failed += 1
+                    finish(label)
+                    continue
+                prepared["label"] = label
+                await write_queue.put(prepared)
+
+        async def writer():
+            # 单写者：序号分配、容量检查与去重都在同一处串行完成
+            while (prepared := await write_queue.get()) is not None:
+                label_author = (authors or {}).get(prepared["label"]) or author
+                # 逐张持锁，其他来源（自动收集、另一批存图）可以穿插写入
+                try:
+                    async with gallery.lock:
+                        result = await asyncio.to_thread(
+                            gallery.save_prepared, prepared, label_author, index
+                        )
+                except Exception as e:
+                    # 写者退出后 worker 会阻塞在满队列上，单张失败不能中断写入
+                    result = SaveResult(SaveResult.ERROR, error=str(e))
+                if result.ok:
+                    report.added.append(result.name)
+                    report.evicted.extend(result.evicted)
+                    report.bytes_saved += prepared["saved"]
+                elif result.status == SaveResult.DUPLICATE:
+                    report.duplicates += 1
+                elif result.status == SaveResult.FULL:
+                    report.full += 1
+                else:
+                    logger.warning(f"存图写入失败：{prepared['label']}，{result.error}")
+                    report.failed += 1
+                finish(prepared["label"])
+
+        writer_task = asyncio.create_task(writer())
+        workers = [
+            asyncio.create_task(prepare())
+            for _ in range(min(self.concurrency, len(sources)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+            await write_queue.put(None)
+            await writer_task
+        finally:
+            for task in (*workers, writer_task):
+                task.cancel()
+
+        report.elapsed = time.monotonic() - report.started
+        return report
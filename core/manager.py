@@ -1,12 +1,24 @@
 import asyncio
+import json
 import os
+import shutil
+import tempfile
+from collections.abc import Callable
 from pathlib import Path
 
 from astrbot import logger
 from astrbot.core.config.astrbot_config import AstrBotConfig
 
+from ..utils import IMAGE_LIMITS, filter_text
+from .blob_store import BlobStore
 from .db import GalleryDB
+from .exif_index import ExifIndex
 from .gallery import Gallery
+from .image_cache import HotImageCache
+from .index import ImageIndex
+from .ingest import ImageIngestor, IngestReport
+from .recompress import GalleryRecompressor
+from .usage_stats import UsageStats
 from .zip_utils import ZipUtils
 
 
@@ -16,16 +28,64 @@ class GalleryManager:
     内部维护一个图库列表
     """
 
-    def __init__(self, config: AstrBotConfig, db: GalleryDB, galleries_dir: Path):
+    def __init__(
+        self,
+        config: AstrBotConfig,
+        db: GalleryDB,
+        galleries_dir: Path,
+        image_cache: HotImageCache | None = None,
+    ):
         """
         初始化图库管理器
+        :param image_cache: 热点图片缓存，图库删图时同步移出
         """
         self.galleries_dir = galleries_dir
         self.conf = config
         self.compress = self.conf["add_default"]["compress"]
         self.capacity = self.conf["add_default"]["capacity"]
+        self.eviction = self.conf["add_default"]["eviction"]
         self.galleries: dict[str, Gallery] = {}
         self.db = db
+        self.image_cache = image_cache
+        # 全局图片指纹索引
+        self.index = ImageIndex(
+            reject_ttl=self.conf["auto_collect"]["reject_ttl"] * 3600
+        )
+        # 图库导出的压缩包缓存：图库名 -> 进行中的打包任务
+        self.exports_dir = self.galleries_dir / ".exports"
+        self._exports: dict[str, asyncio.Task] = {}
+        # 内容寻址存储（可选），放在图库总目录下以保证与图库处于同一文件系统
+        self.blob_store = (
+            BlobStore(self.galleries_dir / ".blobs")
+            if self.conf["storage"]["blob_store"]
+            else None
+        )
+        # 图片元数据索引（相机、拍摄时间等），供筛图查询
+        self.exif_index = ExifIndex(
+            self.galleries_dir / ".exif_index.json",
+            workers=self.conf["ingest"]["concurrency"],
+        )
+        # 删除图库后的回调（参数为图库名），供其他模块清理与该图库相关的缓存
+        self.delete_hooks: list[Callable[[str], None]] = []
+        # 使用统计
+        stats_conf = self.conf["stats"]
+        self.usage = UsageStats(
+            db,
+            flush_interval=stats_conf["flush_interval"],
+            keep_days=stats_conf["keep_days"],
+            half_life_days=stats_conf["lfu_half_life_days"],
+        )
+        # 批量存图流水线
+        self.ingestor = ImageIngestor(concurrency=self.conf["ingest"]["concurrency"])
+        # 存量图片重压缩
+        rc_conf = self.conf["recompress"]
+        self.recompressor = GalleryRecompressor(
+            max_size=rc_conf["max_size"],
+            fmt=rc_conf["format"],
+            quality=rc_conf["quality"],
+            rate=rc_conf["rate"],
+            workers=rc_conf["workers"],
+        )
 
     # ----------------- 初始化，加载图库实例 -----------------
 
@@ -46,6 +106,30 @@ class GalleryManager:
         await self._load_from_zips()
         logger.debug("从zip文件中加载实例完成")
 
+        await self.exif_index.load()
+
+        await self.usage.load()
+        self.usage.start()
+
+        if self.image_cache is not None:
+            # 清理原图已不在任何图库中的发送副本
+            galleries = list(self.galleries.values())
+            removed = await asyncio.to_thread(
+                lambda: self.image_cache.prune_renditions(
+                    path for gallery in galleries for path in gallery.get_image_paths()
+                )
+            )
+            if removed:
+                logger.info(f"已清理 {removed} 个失效的发送副本")
+
+        if self.blob_store is not None:
+            stats = await asyncio.to_thread(self.blob_store.stats)
+            logger.info(
+                f"内容寻址存储：{stats['blobs']} 个 blob，"
+                f"实际占用 {stats['physical_bytes'] / 1024 / 1024:.2f} MB，"
+                f"按图库计 {stats['logical_bytes'] / 1024 / 1024:.2f} MB"
+            )
+
         logger.info("图库管理器插件初始化完成")
 
     async def _load_from_db(self):
@@ -59,13 +143,19 @@ class GalleryManager:
         从新的文件夹中加载图库
         """
         for item in self.galleries_dir.iterdir():
-            if item.is_dir() and item.name not in self.galleries:
+            # 跳过 .blobs 等隐藏目录
+            if (
+                item.is_dir()
+                and not item.name.startswith(".")
+                and item.name not in self.galleries
+            ):
                 info = {
                     "path": str(item.resolve()),
                     "creator_id": "new",
                     "creator_name": "new",
                     "capacity": self.capacity,
                     "compress": self.compress,
+                    "eviction": self.eviction,
                 }
                 await self.load_gallery(info)
 
@@ -78,6 +168,7 @@ class GalleryManager:
                 "creator_name": "zip",
                 "capacity": self.capacity,
                 "compress": self.compress,
+                "eviction": self.eviction,
             }
             await self.load_gallery(info)
 
@@ -90,19 +181,248 @@ class GalleryManager:
 
     async def compress_gallery(self, name: str) -> str | None:
         """
-        将指定图库压缩为ZIP文件
+        将指定图库压缩为ZIP文件；同一图库的并发请求共享一次打包
         :param name: 图库名称
         """
-        folder_path = self.galleries_dir / name
-        if folder_path.is_dir():
-            zip_path = self.galleries_dir / f"{name}.zip"
-            logger.info(f"正在将图库【{name}】压缩为ZIP文件")
-            if not ZipUtils.zip_folder(str(folder_path), str(zip_path)):
-                logger.error(f"压缩文件夹失败: {folder_path}")
-                return None
-            logger.info(f"图库【{name}】已成功压缩为ZIP文件：{zip_path}")
+        gallery = self.get_gallery(name)
+        if not gallery or not os.path.isdir(gallery.path):
+            return None
+        task = self._exports.get(name)
+        if task is None:
+            task = asyncio.create_task(self._export_gallery(gallery))
+            self._exports[name] = task
+
+            def on_done(t: asyncio.Task):
+                if self._exports.get(name) is t:
+                    del self._exports[name]
+
+            task.add_done_callback(on_done)
+        # shield：单个请求被取消不影响其他等待同一打包的请求
+        return await asyncio.shield(task)
+
+    async def _export_gallery(self, gallery: Gallery) -> str | None:
+        """
+        打包图库，压缩包缓存在 <图库总目录>/.exports 下，
+        图库内容指纹未变时直接复用上次的压缩包
+        """
+        self.exports_dir.mkdir(parents=True, exist_ok=True)
+        zip_path = self.exports_dir / f"{gallery.name}.zip"
+        fp_path = self.exports_dir / f"{gallery.name}.fingerprint"
+        fingerprint = await asyncio.to_thread(ZipUtils.folder_fingerprint, gallery.path)
+        if (
+            zip_path.exists()
+            and fp_path.exists()
+            and fp_path.read_text(encoding="utf-8") == fingerprint
+        ):
+            logger.info(f"图库【{gallery.name}】未变化，复用已有ZIP文件：{zip_path}")
             return str(zip_path)
-        return None
+
+        logger.info(f"正在将图库【{gallery.name}】压缩为ZIP文件")
+        if not await asyncio.to_thread(
+            ZipUtils.zip_folder, gallery.path, str(zip_path)
+        ):
+            logger.error(f"压缩文件夹失败: {gallery.path}")
+            return None
+        fp_path.write_text(fingerprint, encoding="utf-8")
+        logger.info(f"图库【{gallery.name}】已成功压缩为ZIP文件：{zip_path}")
+        return str(zip_path)
+
+    def _export_temp(self, gallery: Gallery, suffix: str) -> str:
+        """在导出目录中创建本次请求独占的临时文件，并发请求互不覆盖"""
+        self.exports_dir.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(
+            prefix=f"{gallery.name}.", suffix=suffix, dir=self.exports_dir
+        )
+        os.close(fd)
+        return path
+
+    async def export_manifest(self, name: str) -> str | None:
+        """导出图库清单文件，供其他实例生成增量包；文件由调用方用完后删除"""
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return None
+        images = await asyncio.to_thread(gallery.manifest)
+        manifest = ZipUtils.make_manifest(gallery.name, images)
+        path = self._export_temp(gallery, ".manifest.json")
+        await asyncio.to_thread(
+            Path(path).write_text,
+            json.dumps(manifest, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        return path
+
+    async def export_delta(self, name: str, remote: dict) -> tuple[str | None, str]:
+        """
+        按对方的清单打包增量：只包含对方没有的图片（按内容哈希判断）
+        :param remote: 对方的清单
+        :return: (增量包路径, 提示)，增量包由调用方用完后删除
+        """
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return None, f"图库【{name}】不存在"
+        images = await asyncio.to_thread(gallery.manifest)
+        remote_shas = {e.get("sha") for e in remote["images"]}
+        missing = [e for e in images if e["sha"] not in remote_shas]
+        if not missing:
+            return None, f"对方已拥有图库【{name}】的全部 {len(images)} 张图片"
+        files = {e["name"]: gallery.image_path(e["name"]) for e in missing}
+        zip_path = self._export_temp(gallery, ".delta.zip")
+        manifest = ZipUtils.make_manifest(gallery.name, missing)
+        if not await asyncio.to_thread(ZipUtils.write_delta, zip_path, manifest, files):
+            os.remove(zip_path)
+            return None, "打包增量失败"
+        return zip_path, f"图库【{name}】增量 {len(missing)}/{len(images)} 张"
+
+    async def merge_delta(
+        self,
+        name: str,
+        zip_path: str,
+        creator_id: str = "sync",
+        creator_name: str = "sync",
+    ) -> IngestReport:
+        """
+        把增量包合并进图库（不存在时新建）：清单中哈希已存在的图片直接跳过，
+        其余图片走批量存图流水线，保留清单中记录的作者
+        """
+        manifest, members = await asyncio.to_thread(ZipUtils.read_delta, zip_path)
+        gallery = self.get_gallery(name) or await self.create_gallery(
+            name, creator_id, creator_name
+        )
+        entries = {e["name"]: e for e in manifest["images"]}
+        pending = [n for n in members if not gallery.has_sha(entries[n].get("sha", ""))]
+        max_bytes = IMAGE_LIMITS["max_bytes"]
+        sources = [
+            (
+                member,
+                lambda member=member: asyncio.to_thread(
+                    ZipUtils.read_member, zip_path, member, max_bytes
+                ),
+            )
+            for member in pending
+        ]
+        authors = {
+            n: filter_text(str(entries[n].get("author", ""))) for n in pending
+        }
+        report = await self.ingestor.ingest(
+            gallery, sources, author="sync", authors=authors
+        )
+        report.duplicates += len(members) - len(pending)
+        if report.bytes_saved:
+            await self._save_to_db()
+        logger.info(report.summary())
+        return report
+
+    async def load_zip(
+        self,
+        zip_path: str,
+        name: str,
+        creator_id: str = "zip",
+        creator_name: str = "zip",
+        **limits,
+    ) -> tuple[Gallery | None, str]:
+        """
+        把一个图库压缩包安全解压为新图库：先解压到隐藏的临时目录，完成后再改名，
+        失败时清理临时目录
+        :param limits: 传给 ZipUtils.safe_extract_images 的解压限制
+        """
+        target = self.galleries_dir / name
+        if target.exists() or name in self.galleries:
+            return None, f"图库名【{name}】已被占用"
+        partial = self.galleries_dir / f".{name}.partial"
+        try:
+            count = await asyncio.to_thread(
+                ZipUtils.safe_extract_images, zip_path, str(partial), **limits
+            )
+            if count == 0:
+                raise ValueError("压缩包中没有图片")
+            os.rename(partial, target)
+        except Exception as e:
+            shutil.rmtree(partial, ignore_errors=True)
+            logger.error(f"解压图库压缩包失败：{zip_path}，错误：{e}")
+            return None, f"解压失败：{e}"
+        gallery = await self.load_gallery(
+            {
+                "path": str(target),
+                "creator_id": creator_id,
+                "creator_name": creator_name,
+                "capacity": max(self.capacity, count),
+                "compress": self.compress,
+                "eviction": self.eviction,
+            }
+        )
+        return gallery, f"✅成功下载并加载图库【{name}】，共 {count} 张图片"
+
+    async def import_images(
+        self,
+        name: str,
+        source: str | list[str],
+        author: str = "import",
+        creator_id: str = "import",
+        creator_name: str = "import",
+    ) -> IngestReport:
+        """
+        从本地目录（递归）或文件列表批量导入图片到图库，图库不存在时新建；
+        中途中断后再次导入同一批文件会从断点继续
+        :param source: 目录路径或图片文件路径列表
+        """
+        if isinstance(source, str):
+            paths = await asyncio.to_thread(ImageIngestor.list_image_files, source)
+        else:
+            paths = [str(Path(p).resolve()) for p in source]
+        gallery = self.get_gallery(name) or await self.create_gallery(
+            name, creator_id, creator_name
+        )
+        logger.info(f"开始向图库【{name}】导入 {len(paths)} 张图片")
+        report = await self.ingestor.ingest_files(
+            gallery,
+            paths,
+            author=author,
+            checkpoint=Path(gallery.path) / ".import_checkpoint.json",
+        )
+        if report.bytes_saved:
+            await self._save_to_db()
+        return report
+
+    async def ingest_urls(
+        self, gallery: Gallery, urls: list[str], author: str = "default", index: int = 0
+    ) -> IngestReport:
+        """并发下载多张图片并存入图库，动图优化节省了空间时保存统计"""
+        report = await self.ingestor.ingest_urls(gallery, urls, author, index)
+        if report.bytes_saved:
+            await self._save_to_db()
+        return report
+
+    def recompress_gallery(self, name: str) -> str:
+        """在后台按当前压缩策略重新编码图库中已有的图片"""
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return f"图库【{name}】不存在"
+        job = self.recompressor.start(gallery)
+        if job is None:
+            return f"图库【{name}】正在重压缩中"
+        return f"图库【{name}】开始重压缩，共 {job.total} 张"
+
+    async def index_gallery(self, name: str) -> str:
+        """增量更新图库的元数据索引"""
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return f"图库【{name}】不存在"
+        total, scanned = await self.exif_index.scan(gallery)
+        return f"图库【{name}】索引完成：共 {total} 张，本次读取 {scanned} 张"
+
+    async def query_images(
+        self,
+        name: str,
+        camera: str | None = None,
+        after: str | None = None,
+        before: str | None = None,
+    ) -> list[tuple[str, dict]] | None:
+        """按相机/拍摄时间筛选图库中的图片，查询前先增量更新索引"""
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return None
+        await self.exif_index.scan(gallery)
+        return self.exif_index.query(name, camera=camera, after=after, before=before)
 
     async def create_gallery(
         self, name: str, creator_id: str = "default", creator_name="default"
@@ -116,6 +436,12 @@ class GalleryManager:
             creator_name=creator_name,
             capacity=self.capacity,
             compress=self.compress,
+            layout=self.conf["storage"]["layout"],
+            eviction=self.eviction,
+            hash_index=self.index,
+            blob_store=self.blob_store,
+            usage=self.usage,
+            image_cache=self.image_cache,
         )
         self.galleries[gallery.name] = gallery
         await self._save_to_db()
@@ -126,7 +452,13 @@ class GalleryManager:
         加载图库为实例
         :param gallery_info: 图库信息字典
         """
-        gallery = Gallery.from_dict(gallery_info)
+        gallery = Gallery.from_dict(
+            gallery_info,
+            hash_index=self.index,
+            blob_store=self.blob_store,
+            usage=self.usage,
+            image_cache=self.image_cache,
+        )
         self.galleries[gallery.name] = gallery
         await self._save_to_db()
         return gallery
@@ -147,8 +479,15 @@ class GalleryManager:
         """
         if name in self.galleries:
             gallery = self.galleries[name]
-            gallery.delete()  # 删除图库文件夹
+            async with gallery.lock:
+                await asyncio.to_thread(gallery.delete)  # 删除图库文件夹
             del self.galleries[name]  # 从字典中删除图库实例
+            for suffix in (".zip", ".fingerprint"):
+                (self.exports_dir / f"{name}{suffix}").unlink(missing_ok=True)
+            self.exif_index.drop(name)
+            await self.exif_index.save()
+            for hook in self.delete_hooks:
+                hook(name)
             await self._save_to_db()
             return True
         else:
@@ -193,6 +532,8 @@ class GalleryManager:
     async def set_capacity(self, name: str, capacity: int):
         """设置图库容量上限"""
         if gallery := self.get_gallery(name):
+            if gallery.layout == "flat" and capacity > 9999:
+                return f"平铺存储的图库容量上限为9999，请先对图库【{name}】开启分桶"
             if capacity > 0:
                 gallery.capacity = capacity
                 await self._save_to_db()
@@ -209,6 +550,31 @@ class GalleryManager:
             return f"图库【{gallery.name}】压缩开关: {gallery.compress}"
         return f"图库【{name}】不存在"
 
+    async def set_optimize_gif(self, name: str, optimize_gif: bool):
+        """设置图库存入动图时是否优化体积"""
+        if gallery := self.get_gallery(name):
+            gallery.optimize_gif = optimize_gif
+            await self._save_to_db()
+            return f"图库【{gallery.name}】动图优化开关: {gallery.optimize_gif}"
+        return f"图库【{name}】不存在"
+
+    async def set_eviction(self, name: str, eviction: str) -> str:
+        """设置图库满库时的淘汰策略"""
+        if gallery := self.get_gallery(name):
+            gallery.set_eviction(eviction)
+            await self._save_to_db()
+            return f"图库【{gallery.name}】满库淘汰: {gallery.EVICTIONS[eviction]}"
+        return f"图库【{name}】不存在"
+
+    async def migrate_layout(self, name: str, layout: str) -> str:
+        """在线迁移图库的存储布局"""
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return f"图库【{name}】不存在"
+        moved = await asyncio.to_thread(gallery.migrate_layout, layout)
+        await self._save_to_db()
+        return f"图库【{name}】已切换为 {layout} 布局，移动 {moved} 张图片"
+
     async def set_tags(self, name: str, tags: list[str]) -> str:
         """设置图库标签"""
         if gallery := self.get_gallery(name):
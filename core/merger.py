@@ -7,6 +7,8 @@ from PIL import Image, ImageDraw, ImageFont
 
 from astrbot.api import logger
 
+from ..utils import open_image_safely
+
 
 class GalleryImageMerger:
     """图库图片合并器"""
@@ -17,14 +19,13 @@ class GalleryImageMerger:
 
     def _process_image(self, img_path, sequence_number, font) -> Image.Image | None:
         try:
-            img = Image.open(img_path)
-            # GIF 取第一帧
-            if img.format == "GIF":
-                img.seek(0)
-            # 转换为 RGB
-            img = img.convert("RGB")
-            # 缩放
-            img = img.resize(self.thumbnail_size)
+            # 先检查尺寸，JPEG 直接按缩略图尺寸降采样解码
+            with open_image_safely(img_path, target_size=max(self.thumbnail_size)) as src:
+                # GIF 取第一帧
+                if src.format == "GIF":
+                    src.seek(0)
+                # 转换为 RGB 并缩放
+                img = src.convert("RGB").resize(self.thumbnail_size)
 
             draw = ImageDraw.Draw(img)
 
@@ -57,17 +58,13 @@ class GalleryImageMerger:
             logger.error(f"加载图片 {img_path} 时出错：{e}")
             return None
 
-    def create_merged(self, folder_path: str) -> bytes | None:
+    def create_merged(self, image_paths: list[str]) -> bytes | None:
         thumb_w, thumb_h = self.thumbnail_size
 
-        # 文件名排序
+        # 按序号排序
         image_files = sorted(
-            [
-                f
-                for f in os.listdir(folder_path)
-                if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".gif"))
-            ],
-            key=lambda x: int(x.split("_")[1]),
+            image_paths,
+            key=lambda p: int(os.path.basename(p).split("_")[1]),
         )
 
         if not image_files:
@@ -89,9 +86,8 @@ class GalleryImageMerger:
 
         font = ImageFont.truetype(self.font_path, 15)
 
-        for idx, filename in enumerate(image_files):
-            img_path = os.path.join(folder_path, filename)
-            seq = filename.split("_")[1]
+        for idx, img_path in enumerate(image_files):
+            seq = os.path.basename(img_path).split("_")[1]
 
             img = self._process_image(img_path, seq, font)
             if img:
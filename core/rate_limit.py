@@ -0,0 +1,121 @@
+import time
+
+
+class TokenBucket:
+    """令牌桶：按 rate(个/秒) 匀速补充令牌，最多积攒 burst 个，取令牌 O(1)"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.0, rate)
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def peek(self, now: float | None = None) -> float:
+        """当前可用令牌数"""
+        self._refill(now or time.monotonic())
+        return self.tokens
+
+    def consume(self, n: float = 1.0):
+        self.tokens -= n
+
+    def is_full(self, now: float | None = None) -> bool:
+        return self.peek(now) >= self.burst
+
+
+class RateLimiter:
+    """
+    两级令牌桶限流：每个群一个桶 + 一个全局桶，两个桶都有令牌时才放行，
+    忙碌的群只会耗尽自己的桶，不会挤占安静群的额度
+    """
+
+    # 群桶数量超过此值时，清理已回满的桶
+    PRUNE_THRESHOLD = 1024
+
+    def __init__(
+        self,
+        group_rate: float,
+        group_burst: float,
+        global_rate: float,
+        global_burst: float,
+    ):
+        """
+        :param group_rate: 每个群每秒补充的令牌数
+        :param group_burst: 每个群最多积攒的令牌数
+        :param global_rate: 全局每秒补充的令牌数
+        :param global_burst: 全局最多积攒的令牌数
+        """
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.buckets: dict[str, TokenBucket] = {}
+
+        self.allowed = 0
+        self.limited = 0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.PRUNE_THRESHOLD:
+                self._prune()
+            bucket = self.buckets[key] = TokenBucket(self.group_rate, self.group_burst)
+        return bucket
+
+    def _prune(self):
+        """已回满的桶与新建桶等价，可以安全丢弃"""
+        now = time.monotonic()
+        for key in [k for k, b in self.buckets.items() if b.is_full(now)]:
+            del self.buckets[key]
+
+    def _available(self, bucket: TokenBucket, n: float, now: float) -> bool:
+        return bucket.peek(now) >= n and self.global_bucket.peek(now) >= n
+
+    def can_acquire(self, key: str, n: float = 1.0) -> bool:
+        """key 当前能否取到 n 个令牌，只查看不扣除"""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.global_bucket.peek(now) >= n
+        return self._available(bucket, n, now)
+
+    def try_acquire(self, key: str, n: float = 1.0) -> bool:
+        """尝试为 key 取 n 个令牌，成功返回 True"""
+        now = time.monotonic()
+        bucket = self._bucket(key)
+        if not self._available(bucket, n, now):
+            self.limited += 1
+            return False
+        bucket.consume(n)
+        self.global_bucket.consume(n)
+        self.allowed += 1
+        return True
+
+    def snapshot(self) -> dict:
+        """限流器状态"""
+        now = time.monotonic()
+        return {
+            "global": round(self.global_bucket.peek(now), 2),
+            "global_burst": self.global_bucket.burst,
+            "groups": {
+                key: round(bucket.peek(now), 2) for key, bucket in self.buckets.items()
+            },
+            "group_burst": self.group_burst,
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+    def to_str(self) -> str:
+        s = self.snapshot()
+        lines = [
+            f"全局令牌：{s['global']}/{s['global_burst']}",
+            f"放行 {s['allowed']} 次，限流 {s['limited']} 次",
+        ]
+        # 只列出令牌最少的 10 个群
+        for key, tokens in sorted(s["groups"].items(), key=lambda kv: kv[1])[:10]:
+            lines.append(f"  {key}：{tokens}/{s['group_burst']}")
+        return "\n".join(lines)
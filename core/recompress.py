@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+
+from astrbot.api import logger
+
+from ..utils import content_hash, optimize_gif, transcode_image
+from .gallery import Gallery
+from .index import ImageIndex
+from .rate_limit import TokenBucket
+
+
+class RecompressJob:
+    """一个图库的重压缩进度"""
+
+    def __init__(self, gallery: Gallery, total: int, skipped: int = 0):
+        self.gallery = gallery
+        self.total = total
+        self.skipped = skipped  # 断点续传时跳过的已处理项
+        self.done = 0
+        self.replaced = 0
+        self.failed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.finished = False
+
+    @property
+    def reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def to_str(self) -> str:
+        state = "已完成" if self.finished else "进行中"
+        elapsed = self.elapsed or time.monotonic() - self.started
+        lines = [
+            f"图库【{self.gallery.name}】重压缩{state}：{self.done}/{self.total}，"
+            f"替换 {self.replaced} 张，失败 {self.failed} 张",
+            f"节省 {self.reclaimed / 1024 / 1024:.2f} MB，耗时 {elapsed:.1f} 秒",
+        ]
+        if self.skipped:
+            lines.append(f"断点续传跳过 {self.skipped} 张")
+        return "\n".join(lines)
+
+
+class GalleryRecompressor:
+    """
+    存量图片重压缩：按当前策略（尺寸上限、目标格式、质量）重新编码图库中已有的图片
+    - 多个 worker 在线程中编码，令牌桶限速，避免长时间占满 CPU 与磁盘
+    - 写临时文件后 os.replace 原子替换，指纹索引同步更新，旧哈希保留为别名
+    - 新文件不比原文件小时保留原文件
+    - 断点文件记录已处理的文件，中断后再次执行从断点继续
+    """
+
+    CHECKPOINT_NAME = ".recompress_checkpoint.json"
+    CHECKPOINT_EVERY = 20
+
+    def __init__(
+        self,
+        max_size: int = 512,
+        fmt: str = "keep",
+        quality: int = 85,
+        rate: float = 5.0,
+        workers: int = 2,
+    ):
+        """
+        :param fmt: 目标格式 keep/jpeg/webp，keep 表示保持原格式
+        :param rate: 每秒最多处理的图片数
+        """
+        self.max_size = max_size
+        self.fmt = None if fmt == "keep" else fmt.upper()
+        self.quality = quality
+        self.rate = max(0.1, rate)
+        self.workers = max(1, workers)
+
+        self.jobs: dict[str, RecompressJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def is_running(self, name: str) -> bool:
+        task = self._tasks.get(name)
+        return task is not None and not task.done()
+
+    def start(self, gallery: Gallery) -> RecompressJob | None:
+        """在后台开始重压缩一个图库，已在进行中时返回 None"""
+        if self.is_running(gallery.name):
+            return None
+        checkpoint = Path(gallery.path) / self.CHECKPOINT_NAME
+        done = self._load_checkpoint(checkpoint)
+        names = sorted(gallery._get_image_names())
+        pending = [name for name in names if name not in done]
+        job = RecompressJob(gallery, total=len(pending), skipped=len(names) - len(pending))
+        self.jobs[gallery.name] = job
+        self._tasks[gallery.name] = asyncio.create_task(
+            self._run(job, pending, done, checkpoint)
+        )
+        return job
+
+    async def stop(self):
+        """取消所有进行中的任务，断点会被保存"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def progress(self) -> str:
+        if not self.jobs:
+            return "没有重压缩任务"
+        return "\n\n".join(job.to_str() for job in self.jobs.values())
+
+    # ----------------- 执行 -----------------
+
+    @staticmethod
+    def _load_checkpoint(checkpoint: Path) -> set[str]:
+        if not checkpoint.exists():
+            return set()
+        try:
+            return set(json.loads(checkpoint.read_text(encoding="utf-8")))
+        except Exception as e:
+            logger.warning(f"重压缩断点文件损坏，重新开始：{e}")
+            return set()
+
+    @staticmethod
+    def _save_checkpoint(checkpoint: Path, done: set[str]):
+        tmp = checkpoint.with_suffix(".tmp")
+        tmp.write_text(json.dumps(sorted(done), ensure_ascii=False), "utf-8")
+        os.replace(tmp, checkpoint)
+
+    async def _run(
+        self, job: RecompressJob, pending: list[str], done: set[str], checkpoint: Path
+    ):
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for name in pending:
+            queue.put_nowait(name)
+        bucket = TokenBucket(self.rate, self.workers)
+
+        async def worker():
+            while not queue.empty():
+                name = queue.get_nowait()
+                # 令牌桶限速
+                while (tokens := bucket.peek()) < 1:
+                    await asyncio.sleep((1 - tokens) / self.rate)
+                bucket.consume()
+                try:
+                    before, after, new_name = await asyncio.to_thread(
+                        self._process, job.gallery, name
+                    )
+                    job.bytes_before += before
+                    job.bytes_after += after
+                    if new_name:
+                        job.replaced += 1
+                        done.add(new_name)
+                except Exception as e:
+                    logger.warning(f"重压缩失败：{name}，错误：{e}")
+                    job.failed += 1
+                done.add(name)
+                job.done += 1
+                if job.done % self.CHECKPOINT_EVERY == 0:
+                    self._save_checkpoint(checkpoint, done)
+
+        logger.info(f"开始重压缩图库【{job.gallery.name}】，共 {job.total} 张")
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+        except BaseException:
+            self._save_checkpoint(checkpoint, done)
+            raise
+        finally:
+            job.elapsed = time.monotonic() - job.started
+        job.finished = True
+        checkpoint.unlink(missing_ok=True)
+        logger.info(job.to_str())
+
+    def _process(self, gallery: Gallery, name: str) -> tuple[int, int, str | None]:
+        """
+        重新编码一张图片，在线程中执行
+        :return: (原大小, 新大小, 新文件名)，未替换时新文件名为 None
+        """
+        path = gallery.image_path(name)
+        with open(path, "rb") as f:
+            image = f.read()
+
+        if name.lower().endswith(".gif"):
+            result = optimize_gif(image, self.max_size) if gallery.optimize_gif else None
+            encoded = (result, "GIF") if result else None
+        else:
+            encoded = transcode_image(image, self.max_size, self.fmt, self.quality)
+        if encoded is None or len(encoded[0]) >= len(image):
+            return len(image), len(image), None
+
+        data, fmt = encoded
+        ext = "jpg" if fmt == "JPEG" else fmt.lower()
+        stem, old_ext = os.path.splitext(name)
+        new_name = name if old_ext.lower() == f".{ext}" else f"{stem}.{ext}"
+
+        sha, phash = ImageIndex.fingerprint(data)
+        with gallery.file_lock:
+            # 编码期间原图可能已被删除或替换，此时放弃本次结果
+            try:
+                if os.path.getsize(path) != len(image):
+                    return len(image), len(image), None
+            except FileNotFoundError:
+                return 0, 0, None
+            if new_name != name and os.path.exists(gallery.image_path(new_name)):
+                return len(image), len(image), None
+            gallery.write_file(new_name, data, sha)
+            if new_name != name:
+                os.remove(path)
+                gallery.renamed(name, new_name, path)
+            if gallery.blob_store is not None:
+                # 原文件的链接已被替换或删除，没有其他图库引用时释放原 blob
+                gallery.blob_store.release(content_hash(image))
+
+            if gallery.hash_index is not None:
+                gallery.hash_index.replace(gallery.name, name, new_name, sha, phash)
+        return len(image), len(data), new_name
@@ -0,0 +1,105 @@
+import random
+import threading
+from collections.abc import Callable, Collection, Iterable
+
+
+class ShuffleBag:
+    """
+    洗牌袋：每一轮把所有元素不重复地随机抽一遍，抽完后重新装袋
+    - 列表前 cursor 个是本轮已抽出的，其余为待抽；抽取时从待抽区随机选一个换到 cursor 处，O(1)
+    - 增删通过 元素 -> 下标 的映射原地交换，O(1)，不必重建
+    - 可传入排除集合（如某会话最近发过的图片），尽量避开这些元素
+    """
+
+    # 随机尝试避开排除集合的次数，超过后顺序查找
+    EXCLUDE_TRIES = 8
+
+    def __init__(self, loader: Callable[[], Iterable[str]]):
+        """
+        :param loader: 重新装袋时调用，返回当前全部元素（如扫描一次图库目录）
+        """
+        self.loader = loader
+        self._items: list[str] = []
+        self._pos: dict[str, int] = {}
+        self._cursor = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _swap(self, i: int, j: int):
+        items = self._items
+        items[i], items[j] = items[j], items[i]
+        self._pos[items[i]] = i
+        self._pos[items[j]] = j
+
+    def _refill(self):
+        """重新装袋：从 loader 重新读取全部元素，外部直接增删的文件也会被同步"""
+        self._items = list(dict.fromkeys(self.loader()))
+        self._pos = {item: i for i, item in enumerate(self._items)}
+        self._cursor = 0
+        self._loaded = True
+
+    def add(self, item: str):
+        """新元素放进待抽区，本轮即可被抽到；尚未装袋时忽略，装袋时会读到"""
+        with self._lock:
+            if not self._loaded or item in self._pos:
+                return
+            self._pos[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item: str):
+        """移除元素：先换到待抽区，再与末尾交换后弹出"""
+        with self._lock:
+            i = self._pos.get(item)
+            if i is None:
+                return
+            if i < self._cursor:
+                self._cursor -= 1
+                self._swap(i, self._cursor)
+                i = self._cursor
+            self._swap(i, len(self._items) - 1)
+            self._items.pop()
+            del self._pos[item]
+
+    def invalidate(self):
+        """下次抽取时重新装袋"""
+        with self._lock:
+            self._loaded = False
+
+    def _pick(self, exclude: Collection[str]) -> int | None:
+        """在待抽区选一个不在排除集合中的下标，找不到时返回 None"""
+        lo, hi = self._cursor, len(self._items)
+        if lo >= hi:
+            return None
+        if not exclude:
+            return random.randrange(lo, hi)
+        for _ in range(self.EXCLUDE_TRIES):
+            i = random.randrange(lo, hi)
+            if self._items[i] not in exclude:
+                return i
+        start = random.randrange(lo, hi)
+        for k in range(hi - lo):
+            i = lo + (start - lo + k) % (hi - lo)
+            if self._items[i] not in exclude:
+                return i
+        return None
+
+    def draw(self, exclude: Collection[str] = ()) -> str | None:
+        """抽一个元素，袋空时返回 None；所有元素都在排除集合中时不再避开"""
+        with self._lock:
+            if not self._loaded or self._cursor >= len(self._items):
+                self._refill()
+            if not self._items:
+                return None
+            i = self._pick(exclude)
+            if i is None:
+                # 本轮剩下的都要避开：提前开始新一轮，仍避不开则随便抽
+                self._cursor = 0
+                i = self._pick(exclude)
+                if i is None:
+                    i = random.randrange(len(self._items))
+            self._swap(i, self._cursor)
+            self._cursor += 1
+            return self._items[self._cursor - 1]
@@ -0,0 +1,149 @@
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import aiofiles
+
+from astrbot.api import logger
+
+from ..utils import hamming
+from .index import PHashBuckets
+
+
+class TagCache:
+    """
+    打标结果缓存：感知哈希 -> (图库名, 标签)
+    - 按汉明距离近似命中，相似图片复用上次的归类结果，不再调用 LLM
+    - LRU 容量上限 + 过期时间，持久化到 JSON 文件；
+      运行中最多每 SAVE_INTERVAL 秒写回一次，卸载时写回剩余改动
+    """
+
+    SAVE_INTERVAL = 60
+
+    def __init__(self, path: Path, max_size: int = 5000, ttl: float = 7 * 86400):
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+
+        self._entries: OrderedDict[int, tuple[str, list[str], float]] = OrderedDict()
+        self._buckets = PHashBuckets()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, phash: int):
+        if self._entries.pop(phash, None) is not None:
+            self._buckets.remove(phash, phash)
+            self._dirty = True
+
+    def _evict(self, sweep: bool = False):
+        """
+        淘汰超出容量的条目（最久未使用的在最前面）
+        :param sweep: 是否同时清扫全部过期条目（平时过期条目在命中时惰性删除）
+        """
+        if sweep:
+            now = time.time()
+            for phash in [
+                k for k, (_, _, ts) in self._entries.items() if now - ts >= self.ttl
+            ]:
+                self._pop(phash)
+        while len(self._entries) > self.max_size:
+            phash = next(iter(self._entries))
+            self._pop(phash)
+            self.evictions += 1
+
+    def get(self, phash: int | None, radius: int = 0) -> tuple[str, list[str]] | None:
+        """查找汉明距离 radius 内最相近的归类结果"""
+        if phash is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        best: tuple[int, int] | None = None  # (距离, 哈希)
+        if phash in self._entries:
+            best = (0, phash)
+        elif radius > 0:
+            for other in self._buckets.candidates(phash):
+                dist = hamming(phash, other)  # type: ignore
+                if dist <= radius and (best is None or dist < best[0]):
+                    best = (dist, other)  # type: ignore
+
+        if best is not None:
+            gallery, tags, ts = self._entries[best[1]]
+            if now - ts < self.ttl:
+                self._entries.move_to_end(best[1])
+                self.hits += 1
+                return gallery, list(tags)
+            self._pop(best[1])
+
+        self.misses += 1
+        return None
+
+    def put(self, phash: int | None, gallery: str, tags: list[str]):
+        """记录一次归类结果"""
+        if phash is None:
+            return
+        self._pop(phash)
+        self._entries[phash] = (gallery, list(tags), time.time())
+        self._buckets.add(phash, phash)
+        self._dirty = True
+        self._evict()
+
+    def drop_gallery(self, gallery: str):
+        """移除归类到指定图库的全部条目（图库被删除时调用）"""
+        for phash in [k for k, (g, _, _) in self._entries.items() if g == gallery]:
+            self._pop(phash)
+
+    async def load(self):
+        """从 JSON 文件加载"""
+        if not self.path.exists():
+            return
+        try:
+            async with aiofiles.open(self.path, encoding="utf-8") as f:
+                data = json.loads(await f.read())
+            for phash, gallery, tags, ts in data:
+                self._entries[int(phash)] = (gallery, tags, ts)
+                self._buckets.add(int(phash), int(phash))
+            self._evict(sweep=True)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"打标缓存文件损坏，已忽略：{e}")
+            self._entries.clear()
+            self._buckets.clear()
+
+    async def save_if_due(self):
+        """距上次写回超过 SAVE_INTERVAL 秒且有改动时写回"""
+        if time.monotonic() - self._saved_at >= self.SAVE_INTERVAL:
+            await self.save()
+
+    async def save(self):
+        """有改动时写回 JSON 文件"""
+        self._saved_at = time.monotonic()
+        if not self._dirty:
+            return
+        self._evict(sweep=True)
+        data = [
+            [str(phash), gallery, tags, ts]
+            for phash, (gallery, tags, ts) in self._entries.items()
+        ]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(self.path, "w", encoding="utf-8") as f:
+            await f.write(json.dumps(data, ensure_ascii=False))
+        self._dirty = False
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
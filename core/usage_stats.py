@@ -0,0 +1,240 @@
+import asyncio
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+from astrbot.api import logger
+
+from .db import GalleryDB
+
+
+class UsageStats:
+    """
+    图片与图库的使用统计：发送、查看、匹配命中次数，按天累计
+    - 计数只自增内存里的 Counter，不落盘；满库淘汰在存图线程中建立、查询分数表，
+      所以计数、分数表与已合并统计的改动都持有一把线程锁，临界区只有几次字典操作
+    - 后台定时把积攒的计数整批合并进内存中的统计，再整体写一次文件，卸载时再刷一次
+    - 匹配命中等不对应具体图片的计数记在图库级（图片名为空串）
+    - 满库淘汰用的分数按 (计数类别, 是否衰减) 建表，首次查询时由全部计数建立，
+      之后随 record 增量更新，查询 O(1)
+    """
+
+    KINDS = ("send", "view", "match")
+    KIND_NAMES = {"send": "发送", "view": "查看", "match": "匹配"}
+
+    def __init__(
+        self,
+        db: GalleryDB,
+        flush_interval: float = 60,
+        keep_days: int = 90,
+        half_life_days: float = 7,
+    ):
+        """
+        :param half_life_days: LFU 淘汰时使用次数的衰减半衰期（天）
+        """
+        self.db = db
+        self.flush_interval = max(1.0, flush_interval)
+        self.keep_days = max(1, keep_days)
+        self.half_life = max(0.1, half_life_days)
+        # 衰减的基准日：取当天，各天的权重为 2^(-距今天数/半衰期)，不超过 1；
+        # 日期变化时换用新的基准日并重建分数表，代数加一
+        self.epoch = date.today()
+        self._generation = 0
+        # 分数表：(计数类别下标, 是否衰减) -> {图库名: {图片名: 分数}}
+        self._scores: dict[tuple[tuple[int, ...], bool], dict[str, dict[str, float]]] = {}
+        # 分数表可能在存图线程中建立，与事件循环中的 record 互斥
+        self._lock = threading.Lock()
+
+        # (日期, 图库名, 图片名, 计数类别下标) -> 次数
+        self._pending: Counter[tuple[str, str, str, int]] = Counter()
+        # 已合并的统计：{日期: {图库名: {图片名: [发送, 查看, 匹配]}}}
+        self._totals: dict = {}
+        # _totals 有未写入文件的改动（上次写入失败或被取消）
+        self._dirty = False
+        self._task: asyncio.Task | None = None
+        # 同一时间只有一次落盘
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, kind: str, gallery: str, image: str = ""):
+        """记一次使用"""
+        today = date.today()
+        k = self.KINDS.index(kind)
+        with self._lock:
+            self._check_epoch(today)
+            self._pending[(today.isoformat(), gallery, image, k)] += 1
+            if not image:
+                return
+            for (idx, _), table in self._scores.items():
+                if k in idx:
+                    images = table.setdefault(gallery, {})
+                    # 当天的权重为 1
+                    images[image] = images.get(image, 0.0) + 1.0
+
+    # ----------------- 落盘 -----------------
+
+    async def load(self):
+        totals = await self.db.load_stats()
+        with self._lock:
+            self._totals = totals
+            self._scores.clear()
+
+    def start(self):
+        """启动定时落盘"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止定时落盘，等进行中的落盘完成后把剩余计数写入"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # 定时任务被取消时，进行中的落盘照常完成，不会丢掉已取出的计数
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """把积攒的计数合并进内存中的统计，有改动时整体写一次文件"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if self._pending:
+            self._merge_pending()
+        if not self._dirty:
+            return
+        try:
+            await self.db.save_stats(self._totals)
+        except Exception as e:
+            logger.error(f"写入使用统计失败，下次重试：{e}")
+        else:
+            self._dirty = False
+
+    def _merge_pending(self):
+        """把积攒的计数合并进内存中的统计，只保留最近 keep_days 天"""
+        cutoff = (date.today() - timedelta(days=self.keep_days - 1)).isoformat()
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            for (day, gallery, image, kind), count in pending.items():
+                counts = (
+                    self._totals.setdefault(day, {})
+                    .setdefault(gallery, {})
+                    .setdefault(image, [0] * len(self.KINDS))
+                )
+                counts[kind] += count
+            for day in [day for day in self._totals if day < cutoff]:
+                del self._totals[day]
+            self._dirty = True
+
+    # ----------------- 查询 -----------------
+
+    def _iter_counts(self, days: int):
+        """遍历最近 days 天（含今天）的 (图库名, 图片名, [发送, 查看, 匹配])，含未合并的计数"""
+        cutoff = (date.today() - timedelta(days=days - 1)).isoformat()
+        with self._lock:
+            totals = [
+                (gallery, image, list(counts))
+                for day, galleries in self._totals.items()
+                if day >= cutoff
+                for gallery, images in galleries.items()
+                for image, counts in images.items()
+            ]
+            pending = list(self._pending.items())
+        yield from totals
+        for (day, gallery, image, kind), count in pending:
+            if day >= cutoff:
+                counts = [0] * len(self.KINDS)
+                counts[kind] = count
+                yield gallery, image, counts
+
+    def _check_epoch(self, today: date):
+        """日期变化时以当天为新的基准日，分数表作废（须持有锁）"""
+        if today != self.epoch:
+            self.epoch = today
+            self._scores.clear()
+            self._generation += 1
+
+    @property
+    def generation(self) -> int:
+        """基准日的代数：变化后分数整体缩放，依赖旧分数的缓存（如淘汰候选堆）需要重建"""
+        with self._lock:
+            self._check_epoch(date.today())
+            return self._generation
+
+    def _weight(self, day: str, aging: bool) -> float:
+        if not aging:
+            return 1.0
+        age = (self.epoch - date.fromisoformat(day)).days
+        return 2 ** (-max(0, age) / self.half_life)
+
+    def _score_table(
+        self, kinds: tuple[str, ...], aging: bool
+    ) -> dict[str, dict[str, float]]:
+        """取分数表，不存在时由已合并与未合并的全部计数建立（须持有锁）"""
+        self._check_epoch(date.today())
+        idx = tuple(self.KINDS.index(kind) for kind in kinds)
+        table = self._scores.get((idx, aging))
+        if table is not None:
+            return table
+        table = {}
+        for day, galleries in self._totals.items():
+            weight = self._weight(day, aging)
+            for gallery, images in galleries.items():
+                scores = table.setdefault(gallery, {})
+                for image, counts in images.items():
+                    if image:
+                        scores[image] = scores.get(image, 0.0) + weight * sum(
+                            counts[i] for i in idx
+                        )
+        for (day, gallery, image, kind), count in self._pending.items():
+            if image and kind in idx:
+                scores = table.setdefault(gallery, {})
+                scores[image] = scores.get(image, 0.0) + self._weight(day, aging) * count
+        self._scores[(idx, aging)] = table
+        return table
+
+    def scores(
+        self, gallery: str, kinds: tuple[str, ...] = ("send",), aging: bool = False
+    ) -> dict[str, float]:
+        """图库中每张图片在保留期内的使用次数之和，aging 时按天衰减"""
+        with self._lock:
+            return dict(self._score_table(kinds, aging).get(gallery, {}))
+
+    def score(
+        self,
+        gallery: str,
+        image: str,
+        kinds: tuple[str, ...] = ("send",),
+        aging: bool = False,
+    ) -> float:
+        """一张图片的使用次数之和，与 scores 的口径相同"""
+        with self._lock:
+            return self._score_table(kinds, aging).get(gallery, {}).get(image, 0.0)
+
+    def gallery_totals(self, days: int = 7) -> dict[str, list[int]]:
+        """各图库最近 days 天的 [发送, 查看, 匹配] 合计"""
+        totals: dict[str, list[int]] = {}
+        for gallery, _, counts in self._iter_counts(days):
+            total = totals.setdefault(gallery, [0] * len(self.KINDS))
+            for i, count in enumerate(counts):
+                total[i] += count
+        return totals
+
+    def top_images(
+        self,
+        days: int = 7,
+        kind: str = "send",
+        gallery: str | None = None,
+        n: int = 20,
+    ) -> list[tuple[str, int]]:
+        """最近 days 天某类计数最多的 n 张图片"""
+        k = self.KINDS.index(kind)
+        counter: Counter[str] = Counter()
+        for g, image, counts in self._iter_counts(days):
+            if image and counts[k] and (gallery is None or g == gallery):
+                counter[image] += counts[k]
+        return counter.most_common(n)
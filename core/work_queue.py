@@ -0,0 +1,167 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from astrbot.api import logger
+
+
+class WorkQueue:
+    """
+    有界异步工作队列：生产者只负责入队，N 个 worker 协程在后台消费；
+    worker 每次攒够 batch_size 个任务或等满 batch_wait 秒后，把整批交给 handler；
+    队列满时按丢弃策略处理：
+    - drop_new：丢弃新任务
+    - drop_oldest：丢弃队首最旧的任务，为新任务腾位置
+    """
+
+    DROP_POLICIES = ("drop_new", "drop_oldest")
+
+    def __init__(
+        self,
+        handler: Callable[[list[Any]], Awaitable[None]],
+        workers: int = 2,
+        maxsize: int = 50,
+        drop_policy: str = "drop_new",
+        batch_size: int = 1,
+        batch_wait: float = 0.0,
+        name: str = "工作队列",
+    ):
+        """
+        :param handler: 批处理函数，接收一批任务
+        :param batch_size: 每批最多任务数
+        :param batch_wait: 攒批的最长等待时间(秒)
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait)
+        self.drop_policy = (
+            drop_policy if drop_policy in self.DROP_POLICIES else "drop_new"
+        )
+        self.name = name
+
+        self._queue: asyncio.Queue[tuple[float, Any]] = asyncio.Queue(
+            maxsize=max(1, maxsize)
+        )
+        self._tasks: list[asyncio.Task] = []
+
+        # 统计
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self._busy = 0
+        self._busy_time = 0.0
+        self._started_at = 0.0
+        self._latencies: deque[float] = deque(maxlen=200)
+
+    def start(self):
+        """启动 worker"""
+        if self._tasks:
+            return
+        self._started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        logger.debug(f"{self.name}已启动，worker 数：{self.workers}")
+
+    async def stop(self):
+        """停止所有 worker，丢弃未处理的任务"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def put(self, item: Any) -> bool:
+        """非阻塞入队，成功返回 True，被丢弃返回 False"""
+        if self._queue.full():
+            self.dropped += 1
+            if self.drop_policy != "drop_oldest":
+                return False
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except asyncio.QueueEmpty:
+                pass
+        self._queue.put_nowait((time.monotonic(), item))
+        self.enqueued += 1
+        return True
+
+    async def _next_batch(self) -> list[tuple[float, Any]]:
+        """取出一批任务：阻塞等待第一个，之后在 batch_wait 内尽量攒满 batch_size"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            self._busy += 1
+            start = time.monotonic()
+            try:
+                await self.handler([item for _, item in batch])
+                self.processed += len(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"{self.name}处理任务失败：{e}")
+            finally:
+                end = time.monotonic()
+                self._busy -= 1
+                self._busy_time += end - start
+                for enqueued_at, _ in batch:
+                    self._latencies.append(end - enqueued_at)
+                    self._queue.task_done()
+
+    def stats(self) -> dict:
+        """队列运行状态"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        utilization = (
+            self._busy_time / (elapsed * self.workers) if elapsed > 0 else 0.0
+        )
+        latencies = sorted(self._latencies)
+        return {
+            "queue_len": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "workers": self.workers,
+            "busy": self._busy,
+            "utilization": round(min(utilization, 1.0), 4),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "failed": self.failed,
+            "latency_avg": (
+                round(sum(latencies) / len(latencies), 3) if latencies else 0.0
+            ),
+            "latency_p95": (
+                round(latencies[int(len(latencies) * 0.95) - 1], 3)
+                if latencies
+                else 0.0
+            ),
+        }
+
+    def to_str(self) -> str:
+        s = self.stats()
+        return (
+            f"【{self.name}】\n"
+            f"队列长度：{s['queue_len']}/{s['maxsize']}\n"
+            f"worker：{s['busy']}/{s['workers']} 忙碌\n"
+            f"利用率：{s['utilization']:.1%}\n"
+            f"已入队：{s['enqueued']}\n"
+            f"已丢弃：{s['dropped']}\n"
+            f"已完成：{s['processed']}\n"
+            f"失败数：{s['failed']}\n"
+            f"端到端延迟：平均 {s['latency_avg']}s，P95 {s['latency_p95']}s"
+        )
@@ -1,82 +1,268 @@
 # utils/zip_utils.py
 
+import hashlib
+import json
 import os
 import shutil
+import tempfile
 import zipfile
 
 from astrbot.api import logger
 
 
 class ZipUtils:
+    # 本身已压缩的格式，再 deflate 几乎没有收益，直接存储
+    STORED_EXT = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip"}
+    # 解压时只保留的图片格式
+    IMAGE_EXT = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"}
+
+    # 清单文件：记录压缩包/图库中每张图片的 哈希、序号、作者、大小，用于增量同步
+    MANIFEST_NAME = "manifest.json"
+    MANIFEST_FORMAT = "astrbot_gallery_manifest"
+    MANIFEST_VERSION = 1
+
+    # 解压限制（防压缩炸弹）
+    MAX_ENTRIES = 20000
+    MAX_RATIO = 100
+    MAX_UNPACKED_BYTES = 2 * 1024 * 1024 * 1024
+    CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def _walk_files(folder_path: str) -> list[str]:
+        """递归列出文件夹中的文件（跳过隐藏文件与临时文件），按路径排序"""
+        paths = []
+        for root, dirs, files in os.walk(folder_path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file in files:
+                if file.startswith(".") or file.endswith(".tmp"):
+                    continue
+                paths.append(os.path.join(root, file))
+        return sorted(paths)
+
+    @staticmethod
+    def folder_fingerprint(folder_path: str) -> str:
+        """按 (相对路径, 大小, 修改时间) 计算文件夹内容指纹，内容不变则指纹不变"""
+        h = hashlib.sha1()
+        for path in ZipUtils._walk_files(folder_path):
+            st = os.stat(path)
+            rel = os.path.relpath(path, start=folder_path)
+            h.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+        return h.hexdigest()
+
     @staticmethod
-    def unzip_file(zip_path: str, folder_path: str) -> bool:
-        """解压压缩包，成功返回 True，失败返回 False"""
+    def zip_folder(folder_path: str, zip_path: str) -> bool:
+        """
+        压缩文件夹，成功返回 True，失败返回 False；
+        图片等已压缩格式直接存储，先写临时文件再替换，不会留下写了一半的压缩包
+        """
+        tmp_path = zip_path + ".tmp"
         try:
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                zip_ref.extractall(folder_path)
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+                for file_path in ZipUtils._walk_files(folder_path):
+                    ext = os.path.splitext(file_path)[1].lower()
+                    zipf.write(
+                        file_path,
+                        arcname=os.path.relpath(file_path, start=folder_path),
+                        compress_type=zipfile.ZIP_STORED
+                        if ext in ZipUtils.STORED_EXT
+                        else zipfile.ZIP_DEFLATED,
+                    )
+            os.replace(tmp_path, zip_path)
             return True
         except Exception as e:
-            logger.error(f"解压文件 {zip_path} 失败: {e}")
+            logger.error(f"压缩文件夹 {folder_path} 失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return False
 
+    # ----------------- 清单与增量同步 -----------------
+
     @staticmethod
-    def zip_folder(folder_path: str, zip_path: str) -> bool:
-        """压缩文件夹，成功返回 True，失败返回 False"""
+    def make_manifest(gallery: str, images: list[dict]) -> dict:
+        """
+        生成清单
+        :param images: 每项为 {"name", "sha", "seq", "author", "size"}
+        """
+        return {
+            "format": ZipUtils.MANIFEST_FORMAT,
+            "version": ZipUtils.MANIFEST_VERSION,
+            "gallery": gallery,
+            "images": images,
+        }
+
+    @staticmethod
+    def parse_manifest(data: bytes | str) -> dict:
+        """解析并校验清单（含每一项的 name 与 sha），格式不对时抛 ValueError"""
         try:
-            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(folder_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        zipf.write(
-                            file_path,
-                            arcname=os.path.relpath(file_path, start=folder_path),
-                        )
+            manifest = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"清单不是有效的 JSON：{e}") from e
+        if (
+            not isinstance(manifest, dict)
+            or manifest.get("format") != ZipUtils.MANIFEST_FORMAT
+            or not isinstance(manifest.get("images"), list)
+        ):
+            raise ValueError("不是图库清单文件")
+        version = manifest.get("version", 0)
+        if not isinstance(version, int) or version > ZipUtils.MANIFEST_VERSION:
+            raise ValueError(f"清单版本不受支持：{version}")
+        for i, entry in enumerate(manifest["images"], 1):
+            if (
+                not isinstance(entry, dict)
+                or not isinstance(entry.get("name"), str)
+                or not isinstance(entry.get("sha"), str)
+            ):
+                raise ValueError(f"清单第 {i} 项格式错误：缺少字符串类型的 name 或 sha")
+        return manifest
+
+    @staticmethod
+    def write_delta(zip_path: str, manifest: dict, files: dict[str, str]) -> bool:
+        """
+        写增量包：清单 + 清单中列出的图片（直接存储，不再压缩）
+        :param files: 压缩包内文件名 -> 本地文件路径
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            suffix=".tmp", dir=os.path.dirname(zip_path) or None
+        )
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as zipf:
+                zipf.writestr(
+                    ZipUtils.MANIFEST_NAME,
+                    json.dumps(manifest, ensure_ascii=False),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+                for arcname, path in files.items():
+                    zipf.write(path, arcname=arcname)
+            os.replace(tmp_path, zip_path)
             return True
         except Exception as e:
-            logger.error(f"压缩文件夹 {folder_path} 失败: {e}")
+            logger.error(f"写入增量包 {zip_path} 失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return False
 
     @staticmethod
-    def move_files_up(directory: str):
-        """
-        保持原逻辑：
-        - 如果目录下只有一个子文件夹
-        - 把其中所有内容提升到当前目录
-        - 并删除子文件夹
-        - 递归直到不再满足条件
-        """
-        while True:
-            entries = os.listdir(directory)
-            subfolders = [
-                entry
-                for entry in entries
-                if os.path.isdir(os.path.join(directory, entry))
-            ]
-
-            if len(subfolders) == 1:
-                subfolder_path = os.path.join(directory, subfolders[0])
-
-                for root, dirs, files in os.walk(subfolder_path, topdown=False):
-                    # 移动文件
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        shutil.move(file_path, os.path.join(directory, file))
-
-                    # 移动子目录
-                    for dir in dirs:
-                        dir_path = os.path.join(root, dir)
-                        shutil.move(dir_path, os.path.join(directory, dir))
-
-                shutil.rmtree(subfolder_path)
-                continue
+    def read_delta(zip_path: str) -> tuple[dict, list[str]]:
+        """
+        读取增量包的清单，返回 (清单, 压缩包中实际存在的图片成员名)；
+        不是有效的压缩包或清单格式不对时抛 ValueError
+        """
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                try:
+                    manifest = ZipUtils.parse_manifest(
+                        zf.read(ZipUtils.MANIFEST_NAME)
+                    )
+                except KeyError as e:
+                    raise ValueError("压缩包中没有清单文件") from e
+                names = {
+                    info.filename
+                    for info in zf.infolist()
+                    if ZipUtils._safe_member_name(info.filename) == info.filename
+                }
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"不是有效的压缩包：{e}") from e
+        return manifest, [e["name"] for e in manifest["images"] if e["name"] in names]
+
+    @staticmethod
+    def read_member(zip_path: str, name: str, max_bytes: int) -> bytes:
+        """读取单个成员，解压后超过 max_bytes 时抛 ValueError"""
+        with zipfile.ZipFile(zip_path) as zf:
+            info = zf.getinfo(name)
+            if info.file_size > max_bytes:
+                raise ValueError(f"成员过大：{name}")
+            with zf.open(info) as f:
+                data = f.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise ValueError(f"成员过大：{name}")
+        return data
 
-            break
+    @staticmethod
+    def _safe_member_name(filename: str) -> str | None:
+        """
+        取成员的文件名（丢弃目录层级，即展平），
+        含路径穿越、隐藏文件或不是图片的成员返回 None
+        """
+        parts = filename.replace("\\", "/").split("/")
+        if filename.startswith(("/", "\\")) or ".." in parts or ":" in parts[0]:
+            return None
+        name = parts[-1]
+        if not name or name.startswith(".") or "__MACOSX" in parts:
+            return None
+        if os.path.splitext(name)[1].lower() not in ZipUtils.IMAGE_EXT:
+            return None
+        return name
+
+    @staticmethod
+    def safe_extract_images(
+        zip_path: str,
+        folder_path: str,
+        max_entries: int | None = None,
+        max_ratio: float | None = None,
+        max_unpacked_bytes: int | None = None,
+    ) -> int:
+        """
+        逐个成员流式解压压缩包中的图片，直接展平到 folder_path，返回解压的图片数。
+        - 成员数超过 max_entries、总解压大小超过 max_unpacked_bytes 时中止（抛 ValueError）
+        - 单个成员压缩比超过 max_ratio 时跳过
+        - 含 .. 或绝对路径的成员、非图片成员跳过；同名文件自动加后缀
+        实际解压出的字节数同样计入限制，不信任压缩包里声明的大小
+        """
+        max_entries = max_entries or ZipUtils.MAX_ENTRIES
+        max_ratio = max_ratio or ZipUtils.MAX_RATIO
+        max_unpacked_bytes = max_unpacked_bytes or ZipUtils.MAX_UNPACKED_BYTES
+
+        os.makedirs(folder_path, exist_ok=True)
+        extracted = 0
+        unpacked = 0
+        with zipfile.ZipFile(zip_path) as zf:
+            members = zf.infolist()
+            if len(members) > max_entries:
+                raise ValueError(f"压缩包成员过多：{len(members)} > {max_entries}")
+            for member in members:
+                if member.is_dir():
+                    continue
+                name = ZipUtils._safe_member_name(member.filename)
+                if name is None:
+                    logger.debug(f"跳过压缩包成员：{member.filename}")
+                    continue
+                if member.file_size > max_ratio * max(member.compress_size, 1):
+                    logger.warning(f"压缩比异常，跳过：{member.filename}")
+                    continue
+                if unpacked + member.file_size > max_unpacked_bytes:
+                    raise ValueError(f"解压总大小超过 {max_unpacked_bytes} 字节")
+
+                stem, ext = os.path.splitext(name)
+                target = os.path.join(folder_path, name)
+                n = 1
+                while os.path.exists(target):
+                    target = os.path.join(folder_path, f"{stem}_{n}{ext}")
+                    n += 1
+
+                tmp = target + ".tmp"
+                written = 0
+                try:
+                    with zf.open(member) as src, open(tmp, "wb") as dst:
+                        while chunk := src.read(ZipUtils.CHUNK_SIZE):
+                            written += len(chunk)
+                            if written > member.file_size:
+                                raise ValueError(f"成员实际大小超过声明：{member.filename}")
+                            dst.write(chunk)
+                    os.replace(tmp, target)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+                unpacked += written
+                extracted += 1
+        return extracted
 
     @staticmethod
     def unzip_to_folder(zip_file_path: str, root_dir: str) -> str | None:
         """
-        自动生成解压文件夹路径、检查冲突、解压并自动 move_files_up。
-        成功返回解压后的文件夹路径，失败返回 None。
+        以压缩包名为文件夹名，检查冲突后用 safe_extract_images 解压其中的图片，
+        目录层级展平到该文件夹。成功返回解压后的文件夹路径，失败返回 None。
         """
         folder_name = os.path.basename(zip_file_path).rsplit(".", 1)[0]
         folder_path = os.path.join(root_dir, folder_name)
@@ -86,20 +272,20 @@ class ZipUtils:
             logger.warning(f"已存在同名文件夹【{folder_name}】，跳过：{zip_file_path}")
             return None
 
-        # 解压
-        if not ZipUtils.unzip_file(zip_file_path, folder_path):
+        # 逐个成员安全解压图片，直接展平到目标文件夹
+        try:
+            ZipUtils.safe_extract_images(zip_file_path, folder_path)
+        except Exception as e:
+            logger.error(f"解压文件 {zip_file_path} 失败: {e}")
+            shutil.rmtree(folder_path, ignore_errors=True)
             return None
 
-        # 自动展开目录层级
-        ZipUtils.move_files_up(folder_path)
-
         return folder_path
 
-
     @staticmethod
     def extract_all_zips(root_dir: str):
         """
-        扫描 root_dir 下所有 zip，解压、自动展开目录、删除原 zip。
+        扫描 root_dir 下所有 zip，逐个解压为同名文件夹（图片展平）、删除原 zip。
         返回所有成功解压后的文件夹路径列表。
         """
         extracted_folders = []
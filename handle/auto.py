@@ -1,7 +1,11 @@
+import asyncio
+import base64
 import json
+import os
 import random
 import re
-import time
+from collections import OrderedDict, deque
+from pathlib import Path
 
 import astrbot.core.message.components as Comp
 from astrbot.api import logger
@@ -12,27 +16,108 @@ from astrbot.core.provider.provider import Provider
 from astrbot.core.star.context import Context
 from data.plugins.astrbot_plugin_gallery.utils import get_image
 
-from ..core import GalleryManager, RelevanceBM25
+from ..core import (
+    Gallery,
+    GalleryManager,
+    HotImageCache,
+    ImageIndex,
+    RateLimiter,
+    RelevanceBM25,
+    TagCache,
+    WorkQueue,
+    downloader,
+)
 from ..utils import download_file
 
 
 class GalleryAuto:
     def __init__(
-        self, context: Context, config: AstrBotConfig, manager: GalleryManager
+        self,
+        context: Context,
+        config: AstrBotConfig,
+        manager: GalleryManager,
+        image_cache: HotImageCache,
+        cache_path: Path,
     ):
         self.context = context
         self.conf = config
         self.manager = manager
+        self.image_cache = image_cache
         self.matcher = RelevanceBM25()
 
-        self.last_collect_time: int = 0
+        # 去重命中、省下的 LLM 打标次数（按图片计）
+        self.llm_saved: int = 0
+
+        conf = self.conf["auto_collect"]
+        # 去重半径：分段索引只保证汉明距离不超过 MAX_RADIUS 的近邻都能查到
+        self.dedup_radius: int = max(0, conf["dedup_radius"])
+        if self.dedup_radius > ImageIndex.MAX_RADIUS:
+            logger.warning(
+                f"去重相似度半径 {self.dedup_radius} 超出上限，"
+                f"已按 {ImageIndex.MAX_RADIUS} 处理"
+            )
+            self.dedup_radius = ImageIndex.MAX_RADIUS
+        self.queue = WorkQueue(
+            handler=self._process_batch,
+            workers=conf["workers"],
+            maxsize=conf["queue_size"],
+            drop_policy=conf["drop_policy"],
+            batch_size=conf["batch_size"],
+            batch_wait=conf["batch_wait"],
+            name="自动收集队列",
+        )
+        # 打标限流：每群一个令牌桶 + 全局令牌桶（配置单位为 张/分钟）
+        self.limiter = RateLimiter(
+            group_rate=conf["group_rate"] / 60,
+            group_burst=conf["group_burst"],
+            global_rate=conf["global_rate"] / 60,
+            global_burst=conf["global_burst"],
+        )
+        # 打标结果缓存
+        self.tag_cache = TagCache(
+            cache_path,
+            max_size=conf["tag_cache_size"],
+            ttl=conf["tag_cache_ttl"] * 86400,
+        )
+
+        # 每个会话最近发过的图片，自动发图时尽量避开
+        self.recent_window: int = self.conf["auto_match"]["recent_window"]
+        self._recent: OrderedDict[str, deque[str]] = OrderedDict()
+
+    async def initialize(self):
+        """加载打标缓存，启动自动收集队列"""
+        await self.tag_cache.load()
+        self.manager.delete_hooks.append(self.tag_cache.drop_gallery)
+        self.queue.start()
+
+    async def stop(self):
+        """停止自动收集队列，保存打标缓存"""
+        await self.queue.stop()
+        await self.tag_cache.save()
+
+    def collect_status(self) -> str:
+        """自动收集队列的运行状态"""
+        index_stats = self.manager.index.stats()
+        cache_stats = self.tag_cache.stats()
+        dl_stats = downloader.stats()
+        return (
+            f"{self.queue.to_str()}\n"
+            f"去重节省打标：{self.llm_saved} 次\n"
+            f"指纹索引：{index_stats['images']} 张，近期拒收 {index_stats['rejected']} 张\n"
+            f"打标缓存：{cache_stats['size']} 条，命中率 {cache_stats['hit_rate']:.1%}"
+            f"（{cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}），"
+            f"淘汰 {cache_stats['evictions']} 条\n"
+            f"【打标限流】\n{self.limiter.to_str()}\n"
+            f"下载缓存：命中 {dl_stats['hits']} 次，合并 {dl_stats['joins']} 次，"
+            f"实际下载 {dl_stats['misses']} 次"
+        )
 
     # --------------自动收集、打标-------------------
 
     async def get_llm_tags(
-        self, image_url: str, galleries_names: list[str]
+        self, image_urls: list[str], galleries_names: list[str]
     ) -> str | None:
-        """调用 LLM 获取格式化标签文本"""
+        """调用 LLM 获取格式化标签文本（一次请求可包含多张图片）"""
         provider = (
             self.context.get_provider_by_id(self.conf["auto_collect"]["provider_id"])
             or self.context.get_using_provider()
@@ -45,26 +130,28 @@ class GalleryAuto:
         system_prompt = (
             "你是用于图片自动分类的助手，请严格按照以下规则工作：\n"
             "\n"
-            "1. 只允许输出 **完整合法 JSON**，禁止输出解释或额外文本。\n"
+            "1. 只允许输出 **完整合法 JSON 数组**，禁止输出解释或额外文本。\n"
             f"2. 当前已有图库列表：{galleries_names}\n"
             "\n"
-            "3. 判断图片是否属于已有图库：\n"
+            f"3. 共有 {len(image_urls)} 张图片，按发送顺序编号为 1~{len(image_urls)}，"
+            "逐张判断图片是否属于已有图库：\n"
             "   - 如果属于：输出：\n"
-            '     {"gallery": "<已有图库名>", "tags": []}\n'
+            '     {"index": <图片编号>, "gallery": "<已有图库名>", "tags": []}\n'
             "   - 如果不属于：输出：\n"
-            '     {"gallery": "<建议的新图库名>", "tags": ["tag1", "tag2", "tag3"]}\n'
+            '     {"index": <图片编号>, "gallery": "<建议的新图库名>", "tags": ["tag1", "tag2", "tag3"]}\n'
             "\n"
             "4. 要求：\n"
+            "   - index 必须为整数\n"
             "   - gallery 必须为字符串\n"
             "   - tags 必须为字符串数组\n"
-            "   - 必须且只能返回一个 JSON 对象\n"
+            "   - 必须返回一个 JSON 数组，每张图片对应数组中的一个对象\n"
         )
         try:
             logger.debug(system_prompt)
             llm_response = await provider.text_chat(
                 system_prompt=system_prompt,
-                prompt="这是要进行归类的图片",
-                image_urls=[image_url],
+                prompt=f"这是要进行归类的 {len(image_urls)} 张图片",
+                image_urls=image_urls,
             )
             text = llm_response.completion_text
             logger.debug(text)
@@ -75,50 +162,82 @@ class GalleryAuto:
             return None
 
     @staticmethod
-    def parse_llm_tags(text: str) -> tuple[str | None, list[str]]:
+    def _parse_llm_item(data) -> tuple[str | None, list[str]]:
+        """解析单个 {"gallery": ..., "tags": [...]} 对象"""
+        if not isinstance(data, dict):
+            return None, []
+        gallery_name = str(data.get("gallery")) if data.get("gallery") else None
+        tags: list[str] = []
+        if isinstance(data.get("tags"), list):
+            tags = [str(t) for t in data["tags"]]
+        return gallery_name, tags
+
+    @staticmethod
+    def _load_llm_json(text: str) -> dict | list | None:
+        """从 LLM 输出中提取 JSON 对象或数组"""
+        # 1) 尝试直接 JSON
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict | list):
+                return data
+        except Exception:
+            pass
+
+        # 2) 从第一个 [ 或 { 开始逐个尝试提取 JSON 块
+        decoder = json.JSONDecoder()
+        for match in re.finditer(r"[\[{]", text):
+            try:
+                data, _ = decoder.raw_decode(text, match.start())
+            except ValueError:
+                continue
+            if isinstance(data, dict) or (
+                isinstance(data, list) and any(isinstance(d, dict) for d in data)
+            ):
+                return data
+        return None
+
+    @classmethod
+    def parse_llm_tags(cls, text: str) -> tuple[str | None, list[str]]:
         """
         返回格式：(gallery_name, tags)
         gallery_name: str | None
         tags: list[str]
+        输出为数组时取第一项
         """
+        results = cls.parse_llm_tags_batch(text, 1)
+        return results[0]
 
-        gallery_name = None
-        tags: list[str] = []
+    @classmethod
+    def parse_llm_tags_batch(
+        cls, text: str, count: int
+    ) -> list[tuple[str | None, list[str]]]:
+        """
+        解析多图打标结果，返回长度为 count 的 [(gallery_name, tags), ...]，
+        与图片顺序一一对应，缺失或无法解析的位置为 (None, [])
+        """
+        results: list[tuple[str | None, list[str]]] = [(None, [])] * count
 
         if not text:
-            return gallery_name, tags
+            return results
 
-        # 1) 尝试直接 JSON
-        try:
-            data = json.loads(text)
-            if isinstance(data, dict):
-                gallery_name = str(data.get("gallery")) if data.get("gallery") else None
-                if isinstance(data.get("tags"), list):
-                    tags = [str(t) for t in data["tags"]]
-                return gallery_name, tags
-        except Exception:
-            pass
+        data = cls._load_llm_json(text)
+        if data is None:
+            logger.warning(f"无法解析 LLM 标签输出：{text!r}")
+            return results
 
-        # 2) 正则提取 JSON 块 { ... }
-        match = re.search(r"\{[\s\S]*?\}", text)
-        if match:
-            try:
-                data = json.loads(match.group(0))
-                if isinstance(data, dict):
-                    gallery_name = (
-                        str(data.get("gallery")) if data.get("gallery") else None
-                    )
-                    if isinstance(data.get("tags"), list):
-                        tags = [str(t) for t in data["tags"]]
-                    return gallery_name, tags
-            except Exception:
-                pass
-
-        logger.warning(f"无法解析 LLM 标签输出：{text!r}")
-        return gallery_name, tags
+        items = data if isinstance(data, list) else [data]
+        for pos, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            # 优先按 index 对号入座，没有 index 则按顺序
+            index = item.get("index")
+            slot = index - 1 if isinstance(index, int) else pos
+            if 0 <= slot < count:
+                results[slot] = cls._parse_llm_item(item)
+        return results
 
     async def collect_image(self, event: AstrMessageEvent):
-        """自动收集、打标图片"""
+        """自动收集图片：只做过滤与入队，打标、下载、存储由队列 worker 完成"""
         conf = self.conf["auto_collect"]
         # 开关
         if not conf["enable_collect"]:
@@ -126,42 +245,161 @@ class GalleryAuto:
         # 群聊白名单
         if conf["whitelist"] and event.get_group_id() not in conf["whitelist"]:
             return
-        # 冷却时间
-        if (
-            conf["collect_cd"] > 0
-            and int(time.time()) - self.last_collect_time < conf["collect_cd"]
-        ):
-            return
         # 获取图片URL
         image_url = await get_image(event, reply=False, get_url=True)
         if not isinstance(image_url, str):
             return
-        # 打标
-        galleries_names = self.manager.get_all_galleries_names()
-        llm_text = await self.get_llm_tags(image_url, galleries_names)
-        if not llm_text:
-            return
-        gallery_name, tags = self.parse_llm_tags(llm_text)
-        if not gallery_name:
+        # 限流：群桶与全局桶都有令牌才收集；
+        # 这里只查看额度，真正送去打标时才扣令牌，去重、缓存命中的图片不占额度
+        group_id = event.get_group_id()
+        limit_key = group_id or f"private_{event.get_sender_id()}"
+        if not self.limiter.can_acquire(limit_key):
             return
+        # 入队（事件对象在 handler 返回后不再可靠，只保留需要的字段）
+        task = {
+            "limit_key": limit_key,
+            "group_id": group_id,
+            "sender_id": event.get_sender_id(),
+            "sender_name": event.get_sender_name(),
+            "image_url": image_url,
+        }
+        if not self.queue.put(task):
+            logger.debug(f"自动收集队列已满，丢弃图片：{image_url}")
+
+    async def _dedup_gate(self, tasks: list[dict]) -> list[dict]:
+        """
+        LLM 前置去重：先下载图片并计算指纹，
+        已存入任一图库、近期被拒收或同批重复的图片直接跳过，不再调用 LLM
+        """
+        index = self.manager.index
+        radius = self.dedup_radius
+        images = await asyncio.gather(
+            *(download_file(task["image_url"]) for task in tasks)
+        )
+        passed: list[dict] = []
+        seen: set[str] = set()
+        for task, image in zip(tasks, images):
+            if not image:
+                continue
+            sha, phash = await asyncio.to_thread(index.fingerprint, image)
+            if (
+                sha in seen
+                or index.find(sha, phash, radius)
+                or index.is_rejected(sha, phash, radius)
+            ):
+                self.llm_saved += 1
+                logger.debug(f"图片已收集或近期被拒收，跳过打标：{task['image_url']}")
+                continue
+            seen.add(sha)
+            task.update(image=image, sha=sha, phash=phash)
+            passed.append(task)
+        return passed
+
+    async def _process_batch(self, tasks: list[dict]):
+        """
+        队列 worker：下载去重后，先复用打标缓存，
+        缓存未命中且限流放行的图片再一次 LLM 请求整批打标，最后逐张存储
+        """
+        tasks = await self._dedup_gate(tasks)
+        radius = self.dedup_radius
+        pending: list[dict] = []
+        for task in tasks:
+            cached = self.tag_cache.get(task["phash"], radius)
+            if cached and not self.manager.get_gallery(cached[0]):
+                # 缓存指向的图库已被删除，不能据此重建图库
+                self.tag_cache.drop_gallery(cached[0])
+                cached = None
+            if cached:
+                self.llm_saved += 1
+                await self._classified(task, *cached)
+            elif self.limiter.try_acquire(task["limit_key"]):
+                pending.append(task)
+            else:
+                logger.debug(f"打标额度已用完，跳过图片：{task['image_url']}")
+
+        if pending:
+            # 直接把已下载的图片交给 LLM，避免提供商再下载一遍
+            image_urls = [
+                "base64://" + base64.b64encode(task["image"]).decode()
+                for task in pending
+            ]
+            # 打标
+            galleries_names = self.manager.get_all_galleries_names()
+            llm_text = await self.get_llm_tags(image_urls, galleries_names)
+            if llm_text:
+                results = self.parse_llm_tags_batch(llm_text, len(pending))
+                for task, (gallery_name, tags) in zip(pending, results):
+                    if gallery_name:
+                        self.tag_cache.put(task["phash"], gallery_name, tags)
+                    await self._classified(task, gallery_name, tags)
+
+        await self.tag_cache.save_if_due()
+
+    async def _classified(
+        self, task: dict, gallery_name: str | None, tags: list[str]
+    ):
+        """按归类结果存图，未归类或存图失败的图片记为近期拒收"""
+        if not gallery_name or not await self._store(task, gallery_name, tags):
+            self.manager.index.reject(task["sha"], task["phash"])
+
+    async def _store(self, task: dict, gallery_name: str, tags: list[str]) -> bool:
+        """将图片存入打标得到的图库，图库不存在时新建"""
         gallery = self.manager.get_gallery(gallery_name)
         if not gallery:
             gallery = await self.manager.create_gallery(
                 gallery_name,
-                creator_id=event.get_sender_id(),
-                creator_name=event.get_sender_name(),
+                creator_id=task["sender_id"],
+                creator_name=task["sender_name"],
             )
             await self.manager.set_tags(name=gallery.name, tags=tags)
         # 收集图片
-        if image_bytes := await download_file(image_url):
-            succ, result = gallery.add_image(
-                image_bytes, author=event.get_sender_name()
+        # 压缩、动图优化较耗时，放到线程中执行，且不持锁，只在写入时排队
+        saved = gallery.gif_saved
+        prepared = await asyncio.to_thread(gallery.prepare_image, task["image"])
+        async with gallery.lock:
+            result = await asyncio.to_thread(
+                gallery.save_prepared, prepared, task["sender_name"]
             )
-            if succ:
-                logger.info(f"自动收集图片：{result}")
+        if result.ok:
+            msg = f"自动收集图片：图库【{gallery.name}】新增图片 {result.name}"
+            if result.evicted:
+                msg += f"，已淘汰：{'、'.join(result.evicted)}"
+            logger.info(msg)
+            if gallery.gif_saved != saved:
+                await self.manager.save_gallery(gallery)
+        return result.ok
 
     # --------------自动匹配、发图-------------------
 
+    # 最多记录多少个会话的发图历史
+    MAX_SESSIONS = 1000
+
+    def _pick_image(self, event: AstrMessageEvent, gallery: Gallery) -> str | None:
+        """从图库中随机抽一张图，避开本会话最近 recent_window 次发过的"""
+        if self.recent_window <= 0:
+            succ, image = gallery.get_random_image()
+            return str(image) if succ else None
+        session = event.unified_msg_origin
+        recent = self._recent.pop(session, None) or deque(maxlen=self.recent_window)
+        self._recent[session] = recent
+        while len(self._recent) > self.MAX_SESSIONS:
+            self._recent.popitem(last=False)
+        succ, image = gallery.get_random_image(exclude=recent)
+        if not succ:
+            return None
+        recent.append(str(image))
+        return str(image)
+
+    async def _send_image(
+        self, event: AstrMessageEvent, gallery: Gallery, path: str
+    ):
+        """从热点缓存发送图片，图片已被删除时不发送"""
+        data = await self.image_cache.get(path)
+        if data is None:
+            return
+        await event.send(event.chain_result([Comp.Image.fromBytes(data)]))
+        self.manager.usage.record("send", gallery.name, os.path.basename(path))
+
     async def match_user_msg(self, event: AstrMessageEvent):
         """给用户发送的消息匹配图片"""
         text = event.message_str
@@ -173,9 +411,9 @@ class GalleryAuto:
                 score = self.matcher.calc(tags=gallery.tags, msg=text)
                 #print(f"{gallery.tags}: {score}")
                 if score > conf["user_threshold"]:
-                    succ, image = gallery.get_random_image()
-                    if succ:
-                        await event.send(event.image_result(image))  # type: ignore
+                    self.manager.usage.record("match", gallery.name)
+                    if image := self._pick_image(event, gallery):
+                        await self._send_image(event, gallery, image)
                     break
 
     async def match_llm_msg(self, event: AstrMessageEvent, resp: LLMResponse):
@@ -193,7 +431,7 @@ class GalleryAuto:
             for gallery in self.manager.get_all_gallery():
                 score = self.matcher.calc(tags=gallery.tags, msg=text)
                 if score > conf["llm_threshold"]:
-                    succ, image = gallery.get_random_image()
-                    if succ:
-                        await event.send(event.image_result(image))  # type: ignore
+                    self.manager.usage.record("match", gallery.name)
+                    if image := self._pick_image(event, gallery):
+                        await self._send_image(event, gallery, image)
                 break
@@ -1,23 +1,52 @@
+import asyncio
+import os
+
 from astrbot.api import logger
 from astrbot.core import AstrBotConfig
-from astrbot.core.message.components import Image
+from astrbot.core.message.components import Image, Node, Nodes, Plain
 from astrbot.core.platform import AstrMessageEvent
 from astrbot.core.utils.session_waiter import SessionController, session_waiter
 from data.plugins.astrbot_plugin_gallery.utils import (
+    filter_text,
     get_args,
     get_image,
+    get_image_urls,
 )
 
-from ..core import Gallery, GalleryImageMerger, GalleryManager
+from ..core import Gallery, GalleryImageMerger, GalleryManager, HotImageCache
 
 
 class GalleryOperate:
+    # 看图时超过这么多张图片则打包为合并转发
+    FORWARD_THRESHOLD = 10
+    # 筛图最多列出的图片数
+    QUERY_LIMIT = 30
+    # 筛图条件名 -> 查询参数
+    QUERY_KEYS = {"相机": "camera", "之后": "after", "之前": "before"}
+    # 淘汰策略的命令参数 -> 策略
+    EVICTION_ALIASES = {
+        "拒绝": "reject",
+        "reject": "reject",
+        "最旧": "oldest",
+        "oldest": "oldest",
+        "最少发送": "least_sent",
+        "leastsent": "least_sent",
+        "lfu": "lfu",
+    }
+    # 用量统计列出的热门图片数
+    TOP_N = 20
+
     def __init__(
-        self, config: AstrBotConfig, manager: GalleryManager, merger: GalleryImageMerger
+        self,
+        config: AstrBotConfig,
+        manager: GalleryManager,
+        merger: GalleryImageMerger,
+        image_cache: HotImageCache,
     ):
         self.manager = manager
         self.conf = config
         self.merger = merger
+        self.image_cache = image_cache
 
     def verify_perm(
         self, event: AstrMessageEvent, gallery: Gallery, allow_noadmin: bool
@@ -64,6 +93,38 @@ class GalleryOperate:
                 result.append(msg)
         await event.send(event.plain_result("\n".join(result)))
 
+    async def set_optimize_gif(self, event: AstrMessageEvent, mode: bool):
+        """打开/关闭图库的动图优化开关"""
+        args = await get_args(event)
+        result = []
+        for name in args["names"]:
+            gallery = self.manager.get_gallery(name)
+            if not gallery:
+                result.append(f"未找到图库【{name}】")
+            else:
+                msg = await self.manager.set_optimize_gif(name, optimize_gif=mode)
+                result.append(msg)
+        await event.send(event.plain_result("\n".join(result)))
+
+    async def set_eviction(self, event: AstrMessageEvent):
+        """
+        淘汰策略 图库名s 策略(拒绝/最旧/最少发送/LFU)
+        """
+        args = await get_args(event)
+        texts = args["texts"]
+        eviction = self.EVICTION_ALIASES.get(texts[-1].lower()) if texts else None
+        if not eviction:
+            await event.send(
+                event.plain_result("用法：淘汰策略 <图库名s> <拒绝/最旧/最少发送/LFU>")
+            )
+            return
+        names = [name for name in args["names"] if name != texts[-1]]
+        if not names:
+            await event.send(event.plain_result("未指定图库"))
+            return
+        result = [await self.manager.set_eviction(name, eviction) for name in names]
+        await event.send(event.plain_result("\n".join(result)))
+
     async def add_images(self, event: AstrMessageEvent):
         """
         存图 图库名 序号 (图库名不填则默认自己昵称，序号指定时会替换掉原图)
@@ -86,14 +147,15 @@ class GalleryOperate:
             await event.send(event.plain_result(f"你无权操作图库【{name}】"))
             return
 
-        #  获取图片
-        image = await get_image(event)
+        #  获取图片（消息、引用消息、合并转发中的所有图片）
+        urls = await get_image_urls(event)
 
-        #  图片存在，直接图片处理
-        if image:
-            succ, result = gallery.add_image(image=image, author=author, index=index)  # type: ignore
-            if succ:
-                await event.send(event.plain_result(result))
+        #  图片存在，并发下载、处理后统一回复
+        if urls:
+            report = await self.manager.ingest_urls(
+                gallery, urls, author=author, index=index
+            )
+            await event.send(event.plain_result(report.to_str()))
         #  图片不存在，等待用户发图片
         else:
             await event.send(event.plain_result("发一下图片"))
@@ -108,12 +170,13 @@ class GalleryOperate:
                     or event.get_sender_id() != sender_id
                 ):
                     return
-                image = await get_image(event)
-                if image and gallery:
+                urls = await get_image_urls(event)
+                if urls and gallery:
                     controller.keep(timeout=30, reset_timeout=True)
-                    succ, result = gallery.add_image(image=image, author=author)  # type: ignore
-                    if succ:
-                        await event.send(event.plain_result(result))
+                    report = await self.manager.ingest_urls(
+                        gallery, urls, author=author
+                    )
+                    await event.send(event.plain_result(report.to_str()))
                     return
 
                 controller.stop()
@@ -127,6 +190,101 @@ class GalleryOperate:
 
             event.stop_event()
 
+    async def import_images(self, event: AstrMessageEvent):
+        """
+        导入图库 图库名 本地目录路径
+        """
+        # 路径含特殊字符，不经过 get_args 的过滤
+        parts = event.message_str.strip().split(maxsplit=2)
+        if len(parts) < 3:
+            await event.send(event.plain_result("用法：导入图库 <图库名> <本地目录路径>"))
+            return
+        name, root = filter_text(parts[1]), parts[2].strip()
+        if not name or not os.path.isdir(root):
+            await event.send(event.plain_result(f"目录不存在：{root}"))
+            return
+        await event.send(event.plain_result(f"正在向图库【{name}】导入 {root} ..."))
+        report = await self.manager.import_images(
+            name,
+            os.path.abspath(root),
+            author=filter_text(event.get_sender_name()) or "import",
+            creator_id=event.get_sender_id(),
+            creator_name=event.get_sender_name(),
+        )
+        await event.send(event.plain_result(report.summary()))
+
+    async def migrate_layout(self, event: AstrMessageEvent, layout: str):
+        """
+        开启分桶/关闭分桶 图库名s
+        """
+        args = await get_args(event)
+        result = [
+            await self.manager.migrate_layout(name, layout) for name in args["names"]
+        ]
+        await event.send(event.plain_result("\n".join(result)))
+
+    async def recompress(self, event: AstrMessageEvent):
+        """
+        重压缩 图库名s
+        """
+        args = await get_args(event)
+        result = [self.manager.recompress_gallery(name) for name in args["names"]]
+        await event.send(event.plain_result("\n".join(result)))
+
+    async def index_galleries(self, event: AstrMessageEvent):
+        """
+        建立索引 图库名s
+        """
+        args = await get_args(event)
+        result = [await self.manager.index_gallery(name) for name in args["names"]]
+        await event.send(event.plain_result("\n".join(result)))
+
+    async def query_images(self, event: AstrMessageEvent):
+        """
+        筛图 图库名 相机=型号 之后=日期 之前=日期 (条件可任选，日期如 2023、2023-05-01)
+        """
+        # 条件值可能含空格以外的特殊字符，不经过 get_args 的过滤
+        parts = event.message_str.strip().split()
+        if len(parts) < 2:
+            await event.send(
+                event.plain_result("用法：筛图 <图库名> [相机=型号] [之后=日期] [之前=日期]")
+            )
+            return
+        name = filter_text(parts[1])
+        conds: dict[str, str] = {}
+        for part in parts[2:]:
+            key, sep, value = part.partition("=")
+            if not sep or key not in self.QUERY_KEYS or not value:
+                await event.send(event.plain_result(f"无法识别的条件：{part}"))
+                return
+            conds[self.QUERY_KEYS[key]] = value
+
+        gallery = self.manager.get_gallery(name)
+        if not gallery:
+            await event.send(event.plain_result(f"未找到图库【{name}】"))
+            return
+        perm = self.conf["perm_config"]["allow_view"]
+        if self.verify_perm(event, gallery, perm) is False:
+            await event.send(event.plain_result(f"你无权查看图库【{name}】"))
+            return
+
+        results = await self.manager.query_images(name, **conds) or []
+        if not results:
+            await event.send(event.plain_result(f"图库【{name}】中没有符合条件的图片"))
+            return
+        lines = [f"图库【{name}】共 {len(results)} 张符合条件："]
+        for file, meta in results[: self.QUERY_LIMIT]:
+            camera = " ".join(filter(None, (meta.get("make"), meta.get("model"))))
+            info = [
+                f"{meta.get('width')}x{meta.get('height')}",
+                camera,
+                meta.get("taken", ""),
+            ]
+            lines.append(f"{file}  " + " | ".join(filter(None, info)))
+        if len(results) > self.QUERY_LIMIT:
+            lines.append(f"...仅显示前 {self.QUERY_LIMIT} 张")
+        await event.send(event.plain_result("\n".join(lines)))
+
     async def delete_images(self, event: AstrMessageEvent):
         """
         删图 图库名 序号/all (多个序号用空格隔开)
@@ -148,11 +306,9 @@ class GalleryOperate:
 
         # 删除图片
         if indexs != [0]:
-            reply = []
-            for index in indexs:
-                succ, result = gallery.delete_image_by_index(index)
-                if succ:
-                    reply.append(result)
+            async with gallery.lock:
+                results = await asyncio.to_thread(gallery.delete_many, indexs)
+            reply = [result for _, result in results]
             await event.send(event.plain_result("\n".join(reply)))
         # 删除图库
         else:
@@ -181,17 +337,41 @@ class GalleryOperate:
 
         # 查看图片
         if indexs != [0]:
-            for index in indexs:
-                succ, result = gallery.view_by_index(index)
-                if succ:
-                    await event.send(event.image_result(result))  # type: ignore
+            # 所有图片与提示合并为一条消息发送，图片较多时打包为合并转发
+            images: list = []
+            missing: list[str] = []
+            for index, (succ, result) in zip(indexs, gallery.view_many(indexs)):
+                data = await self.image_cache.get(result) if succ else None
+                if data is not None:
+                    images.append(Image.fromBytes(data))
+                    self.manager.usage.record(
+                        "view", gallery.name, os.path.basename(result)
+                    )
+                elif succ:
+                    # 查找之后、读取之前被删除
+                    missing.append(f"图库【{gallery.name}】中不存在图{index}")
                 else:
-                    await event.send(event.plain_result(result))  # type: ignore
+                    missing.append(result)
+            tip = [Plain("\n".join(missing))] if missing else []
+            if (
+                len(images) > self.FORWARD_THRESHOLD
+                and event.get_platform_name() == "aiocqhttp"
+            ):
+                nodes = [
+                    Node(uin=event.get_self_id(), name=gallery.name, content=[image])
+                    for image in images
+                ]
+                await event.send(event.chain_result([Nodes(nodes)]))
+                if tip:
+                    await event.send(event.chain_result(tip))
+            else:
+                await event.send(event.chain_result([*images, *tip]))
 
         # 查看图库
         else:
-            merged = self.merger.create_merged(gallery.path)
+            merged = self.merger.create_merged(gallery.get_image_paths())
             if merged:
+                self.manager.usage.record("view", gallery.name)
                 await event.send(event.chain_result([Image.fromBytes(merged)]))
             else:
                 await event.send(event.plain_result(f"图库【{name}】为空"))
@@ -219,6 +399,38 @@ class GalleryOperate:
                 return
             await event.send(event.plain_result(gallery.to_str()))
 
+    async def usage_stats(self, event: AstrMessageEvent):
+        """
+        用量统计 [图库名] [天数] (默认最近7天、所有图库)
+        """
+        args = await get_args(event)
+        name = args["texts"][0] if args["texts"] else None
+        days = args["numbers"][0] or 7
+        if name and not self.manager.get_gallery(name):
+            await event.send(event.plain_result(f"未找到图库【{name}】"))
+            return
+        usage = self.manager.usage
+        totals = usage.gallery_totals(days)
+        if name:
+            totals = {name: totals[name]} if name in totals else {}
+        if not totals:
+            await event.send(event.plain_result(f"最近{days}天没有使用记录"))
+            return
+
+        lines = [f"------最近{days}天使用统计------", "图库（发送/查看/匹配）："]
+        for gallery, (send, view, match) in sorted(
+            totals.items(), key=lambda item: item[1], reverse=True
+        ):
+            lines.append(f"{gallery}：{send}/{view}/{match}")
+        for kind in ("send", "view"):
+            top = usage.top_images(days, kind=kind, gallery=name, n=self.TOP_N)
+            if top:
+                lines.append(f"{usage.KIND_NAMES[kind]}最多的图片：")
+                lines.extend(
+                    f"{i}. {image}：{count}次" for i, (image, count) in enumerate(top, 1)
+                )
+        await event.send(event.plain_result("\n".join(lines)))
+
     async def find_path(self, event: AstrMessageEvent):
         """查看图库路径"""
         args = await get_args(event)
@@ -1,4 +1,6 @@
 import os
+import tempfile
+from pathlib import Path
 
 import astrbot.core.message.components as Comp
 from astrbot.api import logger
@@ -8,18 +10,20 @@ from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
     AiocqhttpMessageEvent,
 )
 from data.plugins.astrbot_plugin_gallery.utils import (
-    download_file,
+    download_to_file,
     get_args,
 )
 
-from ..core import GalleryManager
+from ..core import GalleryManager, ZipUtils
+
+# 清单文件大小上限
+MANIFEST_MAX_BYTES = 16 * 1024 * 1024
 
 
 class GalleryShare:
     def __init__(self, config: AstrBotConfig, manager: GalleryManager):
         self.conf = config
         self.manager = manager
-        self.galleries_dir: str = os.path.abspath(config["galleries_dir"])
 
     async def upload_gallery(self, event: AiocqhttpMessageEvent):
         """压缩并上传图库文件夹(仅aiocqhttp)"""
@@ -30,57 +34,165 @@ class GalleryShare:
             if not zip_path:
                 await event.send(event.plain_result(f"未找到图库【{name}】"))
                 return
-            client = event.bot
-            group_id = event.get_group_id()
-            if group_id:
-                await client.upload_group_file(
-                    group_id=int(group_id),
-                    file=zip_path,
-                    name=os.path.basename(zip_path),
-                )
-            else:
-                await client.upload_private_file(
-                    user_id=int(event.get_sender_id()),
-                    file=str(zip_path),
-                    name=os.path.basename(zip_path),
-                )
+            await self._upload_file(event, zip_path)
 
-    async def download_gallery(
-        self, event: AstrMessageEvent, gallery_name: str | None = None
+    @staticmethod
+    async def _upload_file(
+        event: AiocqhttpMessageEvent, path: str, name: str | None = None
     ):
-        """下载图库压缩包并加载(仅aiocqhttp)"""
-        if not gallery_name:
-            await event.send(event.plain_result("必须输入一个新图库名"))
-            return
-        if gallery_name in self.manager.get_all_galleries_names():
-            await event.send(event.plain_result(f"图库名【{gallery_name}】已被占用"))
-            return
+        """上传文件到当前群聊/私聊，name 为对方看到的文件名（默认取本地文件名）"""
+        client = event.bot
+        group_id = event.get_group_id()
+        name = name or os.path.basename(path)
+        if group_id:
+            await client.upload_group_file(
+                group_id=int(group_id),
+                file=path,
+                name=name,
+            )
+        else:
+            await client.upload_private_file(
+                user_id=int(event.get_sender_id()),
+                file=str(path),
+                name=name,
+            )
+
+    @staticmethod
+    def _get_reply_file_url(event: AstrMessageEvent) -> str | None:
+        """获取引用消息中文件的下载地址"""
         chain = event.message_obj.message
         logger.debug(chain)
         reply_chain = (
             chain[0].chain if chain and isinstance(chain[0], Comp.Reply) else None
         )
-        url = (
+        return (
             reply_chain[0].url
             if reply_chain and isinstance(reply_chain[0], Comp.File)
             else None
         )
+
+    async def _download_reply_file(
+        self, event: AstrMessageEvent, filename: str, max_bytes: int
+    ) -> Path | None:
+        """
+        把引用的文件流式下载到临时目录，失败时回复原因并返回 None；
+        每次请求使用独立的文件名（以 filename 为前缀），由调用方用完后删除
+        """
+        url = self._get_reply_file_url(event)
         if not url:
+            await event.send(event.plain_result("请引用一个文件"))
+            return None
+        logger.info(f"正在从URL下载文件：{url}")
+        download_dir = self.manager.galleries_dir / ".downloads"
+        download_dir.mkdir(parents=True, exist_ok=True)
+        stem, ext = os.path.splitext(filename)
+        fd, tmp = tempfile.mkstemp(prefix=f"{stem}.", suffix=ext, dir=download_dir)
+        os.close(fd)
+        path = Path(tmp)
+        if not await download_to_file(url, path, max_bytes=max_bytes):
+            path.unlink(missing_ok=True)
+            await event.send(event.plain_result("文件下载失败"))
+            return None
+        return path
+
+    async def download_gallery(
+        self, event: AstrMessageEvent, gallery_name: str | None = None
+    ):
+        """下载图库压缩包并加载(仅aiocqhttp)"""
+        if not gallery_name:
+            await event.send(event.plain_result("必须输入一个新图库名"))
+            return
+        if gallery_name in self.manager.get_all_galleries_names():
+            await event.send(event.plain_result(f"图库名【{gallery_name}】已被占用"))
+            return
+        if not self._get_reply_file_url(event):
             await event.send(event.plain_result("请引用一个zip文件"))
             return
         await event.send(event.plain_result("正在下载..."))
-        logger.info(f"正在从URL下载文件：{url}")
-        file: bytes | None = await download_file(url)
-        if not file:
-            await event.send(event.plain_result("文件下载失败"))
+        dl_conf = self.conf["download"]
+        # 流式写入临时文件，不把整个压缩包读进内存
+        zip_path = await self._download_reply_file(
+            event,
+            f"{gallery_name}.zip",
+            max_bytes=int(dl_conf["max_zip_mb"] * 1024 * 1024),
+        )
+        if not zip_path:
             return
-        save_path = os.path.join(self.galleries_dir, f"{gallery_name}.zip")
         try:
-            with open(save_path, "wb") as f:
-                f.write(file)
-            await self.manager._load_from_zips()
-            await event.send(event.plain_result(f"✅成功下载并加载图库【{gallery_name}】"))
-        except Exception as e:
-            await event.send(event.plain_result(f"保存文件时出错: {e}"))
+            # 只处理这一个压缩包
+            _, msg = await self.manager.load_zip(
+                str(zip_path),
+                gallery_name,
+                creator_id=event.get_sender_id(),
+                creator_name=event.get_sender_name(),
+                max_entries=dl_conf["zip_max_entries"],
+                max_ratio=dl_conf["zip_max_ratio"],
+                max_unpacked_bytes=int(dl_conf["zip_max_unpacked_mb"] * 1024 * 1024),
+            )
+            await event.send(event.plain_result(msg))
+        finally:
+            zip_path.unlink(missing_ok=True)
+
+    # ----------------- 增量同步 -----------------
+
+    async def upload_manifest(self, event: AiocqhttpMessageEvent):
+        """上传图库清单，对方据此打包增量(仅aiocqhttp)"""
+        args = await get_args(event)
+        for name in args["names"]:
+            path = await self.manager.export_manifest(name)
+            if not path:
+                await event.send(event.plain_result(f"未找到图库【{name}】"))
+                continue
+            try:
+                await self._upload_file(event, path, f"{name}.manifest.json")
+            finally:
+                os.remove(path)
+
+    async def upload_delta(self, event: AiocqhttpMessageEvent):
+        """(引用清单)按对方的清单打包增量并上传(仅aiocqhttp)"""
+        args = await get_args(event)
+        name = args["names"][0]
+        path = await self._download_reply_file(
+            event, f"{name}.remote.manifest.json", max_bytes=MANIFEST_MAX_BYTES
+        )
+        if not path:
+            return
+        try:
+            remote = ZipUtils.parse_manifest(path.read_bytes())
+        except ValueError as e:
+            await event.send(event.plain_result(str(e)))
             return
+        finally:
+            path.unlink(missing_ok=True)
+        zip_path, msg = await self.manager.export_delta(name, remote)
+        await event.send(event.plain_result(msg))
+        if zip_path:
+            try:
+                await self._upload_file(event, zip_path, f"{name}.delta.zip")
+            finally:
+                os.remove(zip_path)
 
+    async def download_delta(self, event: AstrMessageEvent):
+        """(引用增量包)下载增量包并合并进图库，按哈希去重(仅aiocqhttp)"""
+        args = await get_args(event)
+        name = args["names"][0]
+        dl_conf = self.conf["download"]
+        zip_path = await self._download_reply_file(
+            event,
+            f"{name}.delta.zip",
+            max_bytes=int(dl_conf["max_zip_mb"] * 1024 * 1024),
+        )
+        if not zip_path:
+            return
+        try:
+            report = await self.manager.merge_delta(
+                name,
+                str(zip_path),
+                creator_id=event.get_sender_id(),
+                creator_name=event.get_sender_name(),
+            )
+            await event.send(event.plain_result(report.summary()))
+        except ValueError as e:
+            await event.send(event.plain_result(f"增量包无效：{e}"))
+        finally:
+            zip_path.unlink(missing_ok=True)
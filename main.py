@@ -10,13 +10,20 @@ from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
 from astrbot.core.provider.entities import LLMResponse
 from astrbot.core.star.filter.event_message_type import EventMessageType
 from astrbot.core.star.star_tools import StarTools
-from data.plugins.astrbot_plugin_gallery.utils import HELP_TEXT, get_image
+from data.plugins.astrbot_plugin_gallery.utils import (
+    HELP_TEXT,
+    configure_image_limits,
+    get_image,
+)
 
 from .core import (
     GalleryDB,
     GalleryImageMerger,
     GalleryManager,
+    HotImageCache,
     ImageInfoExtractor,
+    ReverseGeocoder,
+    downloader,
 )
 from .handle.auto import GalleryAuto
 from .handle.operate import GalleryOperate
@@ -45,20 +52,74 @@ class GalleryPlugin(Star):
 
     async def initialize(self):
         """初始化"""
+        dl_conf = self.conf["download"]
+        downloader.configure(
+            limit_per_host=dl_conf["limit_per_host"],
+            connect_timeout=dl_conf["connect_timeout"],
+            read_timeout=dl_conf["read_timeout"],
+            retries=dl_conf["retries"],
+            max_bytes=int(dl_conf["max_image_mb"] * 1024 * 1024),
+            cache_ttl=dl_conf["cache_ttl"],
+            cache_max_bytes=int(dl_conf["cache_mb"] * 1024 * 1024),
+        )
+        ingest_conf = self.conf["ingest"]
+        configure_image_limits(
+            max_pixels=int(ingest_conf["max_megapixels"] * 1_000_000),
+            max_bytes=int(ingest_conf["max_file_mb"] * 1024 * 1024),
+        )
         self.db = GalleryDB(self.db_path)
         self.merger = GalleryImageMerger()
-        self.extractor = ImageInfoExtractor(self.conf)
-        self.manager = GalleryManager(self.conf, self.db, self.galleries_dir)
+        geo_conf = self.conf["geocode"]
+        geocoder = ReverseGeocoder(
+            geo_conf["places_file"]
+            or self.plugin_data_dir / "geonames" / "cities15000.txt",
+            max_distance_km=geo_conf["max_distance_km"],
+        )
+        self.extractor = ImageInfoExtractor(self.conf, geocoder)
+        send_conf = self.conf["send"]
+        self.image_cache = HotImageCache(
+            self.plugin_data_dir / "renditions",
+            max_bytes=int(send_conf["cache_mb"] * 1024 * 1024),
+            min_hits=send_conf["min_hits"],
+            rendition=send_conf["rendition"],
+            rendition_max_bytes=int(send_conf["rendition_kb"] * 1024),
+            rendition_format=send_conf["rendition_format"],
+        )
+        self.manager = GalleryManager(
+            self.conf, self.db, self.galleries_dir, self.image_cache
+        )
         await self.manager.initialize()
-        self.operator = GalleryOperate(self.conf, self.manager, self.merger)
+        self.operator = GalleryOperate(
+            self.conf, self.manager, self.merger, self.image_cache
+        )
         self.share = GalleryShare(self.conf, self.manager)
-        self.auto = GalleryAuto(self.context, self.conf, self.manager)
+        self.auto = GalleryAuto(
+            self.context,
+            self.conf,
+            self.manager,
+            self.image_cache,
+            cache_path=self.plugin_data_dir / "tag_cache.json",
+        )
+        await self.auto.initialize()
+
+    async def terminate(self):
+        """插件卸载时释放资源"""
+        await self.auto.stop()
+        await self.manager.recompressor.stop()
+        await self.manager.usage.stop()
+        await downloader.close()
 
     @filter.event_message_type(EventMessageType.ALL)
     async def auto_collect_image(self, event: AstrMessageEvent):
         """自动收集图片并打标"""
         await self.auto.collect_image(event)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("收集状态")
+    async def collect_status(self, event: AstrMessageEvent):
+        """查看自动收集队列的运行状态"""
+        yield event.plain_result(self.auto.collect_status())
+
     @filter.event_message_type(EventMessageType.ALL, priority=0)
     async def match_user_msg(self, event: AstrMessageEvent):
         """匹配用户消息"""
@@ -90,6 +151,42 @@ class GalleryPlugin(Star):
         """打开/关闭图库的压缩开关"""
         await self.operator.set_compress(event, mode)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("开启动图优化", priority=1)
+    async def enable_optimize_gif(self, event: AstrMessageEvent):
+        """打开图库的动图优化开关"""
+        await self.operator.set_optimize_gif(event, True)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("关闭动图优化", priority=1)
+    async def disable_optimize_gif(self, event: AstrMessageEvent):
+        """关闭图库的动图优化开关"""
+        await self.operator.set_optimize_gif(event, False)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("开启分桶", priority=1)
+    async def enable_sharded(self, event: AstrMessageEvent):
+        """将图库迁移为分桶存储"""
+        await self.operator.migrate_layout(event, "sharded")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("关闭分桶", priority=1)
+    async def disable_sharded(self, event: AstrMessageEvent):
+        """将图库迁移回平铺存储"""
+        await self.operator.migrate_layout(event, "flat")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("重压缩", priority=1)
+    async def recompress(self, event: AstrMessageEvent):
+        """按当前压缩策略在后台重新编码图库中已有的图片"""
+        await self.operator.recompress(event)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("重压缩进度", priority=1)
+    async def recompress_progress(self, event: AstrMessageEvent):
+        """查看重压缩进度"""
+        yield event.plain_result(self.manager.recompressor.progress())
+
     @filter.command("存图", priority=1)
     async def add_images(self, event: AstrMessageEvent):
         """
@@ -97,6 +194,14 @@ class GalleryPlugin(Star):
         """
         await self.operator.add_images(event)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导入图库", priority=1)
+    async def import_images(self, event: AstrMessageEvent):
+        """
+        导入图库 图库名 本地目录路径 (递归导入目录下的所有图片，中断后再次执行可续传)
+        """
+        await self.operator.import_images(event)
+
     @filter.command("删图", priority=1)
     async def delete_images(self, event: AstrMessageEvent):
         """
@@ -127,6 +232,28 @@ class GalleryPlugin(Star):
         """查看图库路径"""
         await self.operator.find_path(event)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("淘汰策略", priority=1)
+    async def set_eviction(self, event: AstrMessageEvent):
+        """设置图库满了之后再存图时的处理方式"""
+        await self.operator.set_eviction(event)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("建立索引", priority=1)
+    async def index_galleries(self, event: AstrMessageEvent):
+        """读取图库中图片的元数据（相机、拍摄时间等）建立索引"""
+        await self.operator.index_galleries(event)
+
+    @filter.command("筛图", priority=1)
+    async def query_images(self, event: AstrMessageEvent):
+        """按相机、拍摄时间筛选图库中的图片"""
+        await self.operator.query_images(event)
+
+    @filter.command("用量统计", priority=1)
+    async def usage_stats(self, event: AstrMessageEvent):
+        """查看最近几天图库与图片的发送、查看、匹配次数"""
+        await self.operator.usage_stats(event)
+
     @filter.command("上传图库", priority=1)
     async def upload_gallery(self, event: AiocqhttpMessageEvent):
         """压缩并上传图库文件夹(仅aiocqhttp)"""
@@ -139,6 +266,22 @@ class GalleryPlugin(Star):
         """下载图库压缩包并加载(仅aiocqhttp)"""
         await self.share.download_gallery(event, gallery_name)
 
+    @filter.command("同步清单", priority=1)
+    async def upload_manifest(self, event: AiocqhttpMessageEvent):
+        """上传图库清单，供另一个bot打包增量(仅aiocqhttp)"""
+        await self.share.upload_manifest(event)
+
+    @filter.command("增量上传", priority=1)
+    async def upload_delta(self, event: AiocqhttpMessageEvent):
+        """(引用清单)只打包对方缺少的图片并上传(仅aiocqhttp)"""
+        await self.share.upload_delta(event)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("增量下载", priority=1)
+    async def download_delta(self, event: AstrMessageEvent):
+        """(引用增量包)下载增量包并合并进图库(仅aiocqhttp)"""
+        await self.share.download_delta(event)
+
     @filter.command("解析")
     async def parse(self, event: AstrMessageEvent):
         """解析图片的信息"""
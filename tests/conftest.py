@@ -0,0 +1,75 @@
+"""
+让测试脱离 AstrBot 运行：
+- 插件代码以 data.plugins.astrbot_plugin_gallery 的包名互相引用，这里把仓库根目录注册为该包
+- 未安装 AstrBot / jieba 时，为插件用到的少量接口提供最小替身；已安装时使用真实模块
+"""
+
+import importlib.util
+import logging
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE = "data.plugins.astrbot_plugin_gallery"
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__path__ = []  # 作为包，允许导入子模块
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _stub_astrbot():
+    logger = logging.getLogger("astrbot")
+
+    class AstrBotConfig(dict):
+        pass
+
+    class AstrMessageEvent:
+        pass
+
+    components = {
+        name: type(name, (), {})
+        for name in ("At", "Forward", "Image", "Node", "Nodes", "Reply", "Plain")
+    }
+
+    _module("astrbot", logger=logger)
+    _module("astrbot.api", logger=logger)
+    _module("astrbot.core")
+    _module("astrbot.core.config")
+    _module("astrbot.core.config.astrbot_config", AstrBotConfig=AstrBotConfig)
+    _module("astrbot.core.message")
+    _module("astrbot.core.message.components", **components)
+    _module("astrbot.core.platform")
+    _module(
+        "astrbot.core.platform.astr_message_event", AstrMessageEvent=AstrMessageEvent
+    )
+
+
+def _stub_jieba():
+    _module("jieba", cut=lambda text, *a, **k: iter(str(text).split()))
+
+
+def _register_package():
+    """把仓库根目录注册为 data.plugins.astrbot_plugin_gallery"""
+    parts = PACKAGE.split(".")
+    for i in range(1, len(parts)):
+        name = ".".join(parts[:i])
+        if name not in sys.modules:
+            _module(name)
+    package = _module(PACKAGE)
+    package.__path__ = [str(ROOT)]
+
+
+if importlib.util.find_spec("astrbot") is None:
+    _stub_astrbot()
+if importlib.util.find_spec("jieba") is None:
+    _stub_jieba()
+if PACKAGE not in sys.modules:
+    try:
+        importlib.import_module(PACKAGE)
+    except ImportError:
+        _register_package()
@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import io
+
+from PIL import Image
+
+from data.plugins.astrbot_plugin_gallery.core.gallery import Gallery, SaveResult
+
+
+def make_images(count: int, seed: int = 0) -> list[bytes]:
+    """生成 count 张内容各不相同的小图"""
+    images = []
+    for i in range(count):
+        buf = io.BytesIO()
+        color = ((i + seed) % 256, (i + seed) // 256 % 256, seed % 256)
+        Image.new("RGB", (4, 4), color).save(buf, format="PNG")
+        images.append(buf.getvalue())
+    return images
+
+
+async def make_gallery(path: str, capacity: int = 2000) -> Gallery:
+    gallery = Gallery(path=path, capacity=capacity)
+    # 等待初始化任务建好图片目录
+    while gallery._catalog is None:
+        await asyncio.sleep(0.01)
+    return gallery
+
+
+async def add(gallery: Gallery, image: bytes, author: str) -> SaveResult:
+    """与自动收集相同的存图方式：预处理不持锁，写入时排队"""
+    prepared = await asyncio.to_thread(gallery.prepare_image, image)
+    async with gallery.lock:
+        return await asyncio.to_thread(gallery.save_prepared, prepared, author)
+
+
+def stored_files(gallery: Gallery) -> dict[str, bytes]:
+    files = {}
+    for entry in gallery._get_images():
+        with open(entry.path, "rb") as f:
+            files[entry.name] = f.read()
+    return files
+
+
+def test_concurrent_add_assigns_unique_seqs(tmp_path):
+    images = make_images(300)
+    # 混入重复图片，重复的应被拒收
+    submitted = images + images[:50]
+
+    async def run():
+        gallery = await make_gallery(str(tmp_path / "g"))
+        results = await asyncio.gather(
+            *(add(gallery, image, f"u{i % 7}") for i, image in enumerate(submitted))
+        )
+        return gallery, results
+
+    gallery, results = asyncio.run(run())
+    accepted = sum(1 for result in results if result.ok)
+    files = stored_files(gallery)
+
+    assert accepted == len(images)
+    assert len(files) == accepted
+    assert gallery.image_count() == accepted
+
+    seqs = [name.split("_")[1] for name in files]
+    assert len(set(seqs)) == len(seqs)
+
+    input_shas = {hashlib.sha256(image).hexdigest() for image in images}
+    stored_shas = {hashlib.sha256(data).hexdigest() for data in files.values()}
+    assert stored_shas == input_shas
+
+
+def test_galleries_do_not_serialize_on_each_other(tmp_path):
+    images = make_images(100, seed=1)
+
+    async def run():
+        busy = await make_gallery(str(tmp_path / "busy"))
+        free = await make_gallery(str(tmp_path / "free"))
+        # 占住一个图库的两把锁，另一个图库的存图应照常完成
+        async with busy.lock:
+            with busy.file_lock:
+                results = await asyncio.wait_for(
+                    asyncio.gather(*(add(free, image, "u") for image in images)),
+                    timeout=30,
+                )
+        return free, results
+
+    free, results = asyncio.run(run())
+    assert all(result.ok for result in results)
+    assert len(stored_files(free)) == len(images)
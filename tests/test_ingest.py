@@ -0,0 +1,100 @@
+import asyncio
+import io
+import os
+
+from PIL import Image
+
+from data.plugins.astrbot_plugin_gallery.core.gallery import Gallery
+from data.plugins.astrbot_plugin_gallery.core.ingest import ImageIngestor
+
+
+def make_images(count: int, seed: int) -> list[bytes]:
+    images = []
+    for i in range(count):
+        buf = io.BytesIO()
+        Image.new("RGB", (4, 4), (i, seed, 0)).save(buf, format="PNG")
+        images.append(buf.getvalue())
+    return images
+
+
+async def make_gallery(path: str, capacity: int) -> Gallery:
+    gallery = Gallery(path=path, capacity=capacity)
+    while gallery._catalog is None:
+        await asyncio.sleep(0.01)
+    return gallery
+
+
+def stored_files(gallery: Gallery) -> list[str]:
+    return [name for name in os.listdir(gallery.path) if name != Gallery.LOCK_NAME]
+
+
+def sources(images: list[bytes]):
+    async def load(image: bytes) -> bytes:
+        return image
+
+    return [(f"img{i}", lambda image=image: load(image)) for i, image in enumerate(images)]
+
+
+def test_ingest_into_full_gallery_reports_added_names(tmp_path):
+    images = make_images(8, seed=2)
+
+    async def run():
+        gallery = await make_gallery(str(tmp_path / "g"), capacity=5)
+        gallery.set_eviction("oldest")
+        report = await ImageIngestor(concurrency=4).ingest(gallery, sources(images))
+        return gallery, report
+
+    gallery, report = asyncio.run(run())
+    files = stored_files(gallery)
+
+    assert len(files) == 5
+    assert len(report.added) == len(images)
+    assert len(report.evicted) == len(images) - 5
+    # 报告里是新存入的文件名，不是淘汰信息
+    assert all(name.startswith(f"{gallery.name}_") for name in report.added)
+    assert set(files) <= set(report.added)
+
+
+def test_ingest_into_full_rejecting_gallery_counts_full(tmp_path):
+    images = make_images(8, seed=3)
+
+    async def run():
+        gallery = await make_gallery(str(tmp_path / "g"), capacity=5)
+        report = await ImageIngestor(concurrency=4).ingest(gallery, sources(images))
+        return gallery, report
+
+    gallery, report = asyncio.run(run())
+
+    assert len(stored_files(gallery)) == 5
+    assert len(report.added) == 5
+    assert report.full == 3
+    assert report.failed == 0
+
+
+def test_ingest_bounds_prepared_images_while_writer_is_blocked(tmp_path):
+    images = make_images(50, seed=4)
+    concurrency = 3
+    loaded = 0
+
+    async def load(image: bytes) -> bytes:
+        nonlocal loaded
+        loaded += 1
+        return image
+
+    async def run():
+        gallery = await make_gallery(str(tmp_path / "g"), capacity=100)
+        ingestor = ImageIngestor(concurrency=concurrency)
+        srcs = [(f"img{i}", lambda image=image: load(image)) for i, image in enumerate(images)]
+        # 占住图库锁，写者无法写入，worker 应在待写队列满后停下
+        async with gallery.lock:
+            task = asyncio.create_task(ingestor.ingest(gallery, srcs))
+            await asyncio.sleep(0.5)
+            in_flight = loaded
+        report = await task
+        return report, in_flight
+
+    report, in_flight = asyncio.run(run())
+
+    # 写者手上 1 张 + 队列中 concurrency 张 + 每个 worker 手上 1 张
+    assert in_flight <= 2 * concurrency + 1
+    assert len(report.added) == len(images)
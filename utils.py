@@ -1,13 +1,14 @@
 
+import hashlib
 import io
 import os
 import re
 
-import aiohttp
 from PIL import Image as PILImage
+from PIL import ImageChops, ImageSequence
 
 from astrbot import logger
-from astrbot.core.message.components import At, Image, Reply
+from astrbot.core.message.components import At, Forward, Image, Node, Nodes, Reply
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 
 HELP_TEXT = (
@@ -21,18 +22,33 @@ HELP_TEXT = (
     "设置容量 <图库名> <容量> - 设置指定图库的容量上限\n\n"
     "开启压缩 <图库名s> 打开指定图库的压缩开关\n\n"
     "关闭压缩 <图库名s> 关闭指定图库的压缩开关\n\n"
+    "开启动图优化 <图库名s> 存入动图时去除重复帧、共用调色板以减小体积\n\n"
+    "关闭动图优化 <图库名s> 关闭指定图库的动图优化开关\n\n"
+    "重压缩 <图库名s> 按当前压缩策略在后台重新编码图库中已有的图片，中断后再次执行可续传\n\n"
+    "重压缩进度 - 查看重压缩任务的进度与节省的空间\n\n"
     "开启去重 <图库名s> 打开指定图库的去重开关\n\n"
     "关闭去重 <图库名s> 关闭指定图库的去重开关\n\n"
     "去重 <图库名s> 去除图库里重复的图片\n\n"
-    "存图 <图库名> <序号> - 存图到指定图库，序号指定时会替换掉原图，图库名不填则默认自己昵称，可也@他人作为图库名\n\n"
+    "存图 <图库名> <序号> - 存图到指定图库，序号指定时会替换掉原图，图库名不填则默认自己昵称，可也@他人作为图库名，消息、引用消息及合并转发中的多张图片会一并存入\n\n"
+    "开启分桶 <图库名s> 将图库迁移为分桶存储（每1000张一个子目录），容量不再受9999张限制\n\n"
+    "关闭分桶 <图库名s> 将图库迁移回平铺存储\n\n"
     "删图 <图库名> <序号s> - 删除指定图库中的图片，序号不指定表示删除整个图库\n\n"
     "查看 <序号s/图库名> - 查看指定图库中的图片或图库详情，序号指定时查看单张图片\n\n"
     "图库列表 - 查看所有图库\n\n"
     "图库详情 <图库名s> - 查看指定图库的详细信息\n\n"
     "(引用图片)/路径 <图库名s> - 查看指定图片的路径，需指定在哪个图库查找\n\n"
-    "(引用图片)/解析 - 解析图片的信息"
-    "上传图库 <图库名s> - 将图库打包成ZIP上传"
-    "(引用ZIP)下载图库 <图库名> - 下载ZIP重命名后加载为图库"
+    "(引用图片)/解析 - 解析图片的信息\n\n"
+    "收集状态 - 查看自动收集队列的运行状态\n\n"
+    "淘汰策略 <图库名s> <拒绝/最旧/最少发送/LFU> - 设置图库满了之后的处理方式\n\n"
+    "建立索引 <图库名s> - 读取图片的相机、拍摄时间等元数据建立索引\n\n"
+    "筛图 <图库名> [相机=型号] [之后=日期] [之前=日期] - 按元数据筛选图片\n\n"
+    "用量统计 [图库名] [天数] - 查看最近几天的发送、查看、匹配次数与热门图片\n\n"
+    "导入图库 <图库名> <目录路径> - 从本地目录批量导入图片，中断后再次执行可续传\n\n"
+    "上传图库 <图库名s> - 将图库打包成ZIP上传\n\n"
+    "(引用ZIP)下载图库 <图库名> - 下载ZIP重命名后加载为图库\n\n"
+    "同步清单 <图库名s> - 上传图库清单，供另一个bot打包增量\n\n"
+    "(引用清单)增量上传 <图库名> - 只打包对方缺少的图片并上传\n\n"
+    "(引用增量包)增量下载 <图库名> - 把增量包合并进图库，已有的图片自动跳过"
 )
 
 def get_dirs(path: str) ->  list[str]:
@@ -47,16 +63,46 @@ def get_dirs(path: str) ->  list[str]:
     return directories
 
 
-async def download_file(url: str) -> bytes | None:
-    """下载图片"""
-    url = url.replace("https://", "http://")
-    try:
-        async with aiohttp.ClientSession() as client:
-            response = await client.get(url)
-            img_bytes = await response.read()
-            return img_bytes
-    except Exception as e:
-        logger.error(f"图片下载失败: {e}")
+async def download_file(
+    url: str, max_bytes: int | None = None, image_only: bool = True
+) -> bytes | None:
+    """
+    下载文件（默认只接受图片），使用插件共享的连接池
+    :param max_bytes: 大小上限，不填则使用配置的默认值
+    :param image_only: 是否校验文件头，非图片立即中止
+    """
+    from .core.downloader import downloader
+
+    return await downloader.fetch(url, max_bytes=max_bytes, image_only=image_only)
+
+
+async def download_to_file(url: str, path, max_bytes: int | None = None) -> bool:
+    """流式下载大文件（如图库压缩包）到 path，不整个读入内存"""
+    from .core.downloader import downloader
+
+    return await downloader.fetch_to_file(url, path, max_bytes=max_bytes)
+
+
+# 常见图片格式的文件头
+IMAGE_MAGIC = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+
+
+def sniff_image_format(head: bytes) -> str | None:
+    """根据文件头判断图片格式，不是图片返回 None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for magic, fmt in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return None
 
 
 async def get_nickname(event: AstrMessageEvent, target_id: str):
@@ -101,6 +147,60 @@ async def get_image(
                 if msg_image := await download_file(img_url):
                     return msg_image
 
+async def _get_forward_image_urls(event: AstrMessageEvent, forward_id: str) -> list[str]:
+    """从消息平台拉取合并转发消息里的图片URL，目前只有 aiocqhttp 提供该接口"""
+    platform = event.get_platform_name()
+    if platform != "aiocqhttp":
+        logger.debug(f"{platform} 平台不支持拉取合并转发消息，已跳过：{forward_id}")
+        return []
+
+    from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+        AiocqhttpMessageEvent,
+    )
+
+    assert isinstance(event, AiocqhttpMessageEvent)
+    try:
+        result = await event.bot.api.call_action("get_forward_msg", id=forward_id)
+    except Exception as e:
+        logger.warning(f"获取转发消息失败：{e}")
+        return []
+    urls = []
+    for node in result.get("messages", []):
+        for seg in node.get("message") or node.get("content") or []:
+            if seg.get("type") == "image" and (url := seg.get("data", {}).get("url")):
+                urls.append(url)
+    return urls
+
+
+async def _collect_image_urls(event: AstrMessageEvent, chain: list) -> list[str]:
+    """提取消息链中的图片URL，包括合并转发里的图片"""
+    urls: list[str] = []
+    for seg in chain:
+        if isinstance(seg, Image):
+            if seg.url:
+                urls.append(seg.url)
+        elif isinstance(seg, Node):
+            urls.extend(await _collect_image_urls(event, seg.content or []))
+        elif isinstance(seg, Nodes):
+            for node in seg.nodes:
+                urls.extend(await _collect_image_urls(event, node.content or []))
+        elif isinstance(seg, Forward) and seg.id:
+            urls.extend(await _get_forward_image_urls(event, seg.id))
+    return urls
+
+
+async def get_image_urls(event: AstrMessageEvent, reply: bool = True) -> list[str]:
+    """获取消息中的所有图片URL（引用消息在前，去重并保持顺序）"""
+    chain = event.get_messages()
+    urls: list[str] = []
+    if reply:
+        reply_seg = next((seg for seg in chain if isinstance(seg, Reply)), None)
+        if reply_seg and reply_seg.chain:
+            urls.extend(await _collect_image_urls(event, reply_seg.chain))
+    urls.extend(await _collect_image_urls(event, chain))
+    return list(dict.fromkeys(urls))
+
+
 def filter_text(text: str, max_length: int = 128) -> str:
     """过滤字符，只保留中文、数字和字母, 并截短非数字字符串"""
     f_str = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9]", "", text)
@@ -125,6 +225,9 @@ async def get_args(event: AstrMessageEvent):
                     numbers.append(num)  # 满足条件的数字加入 indexs
                 else:
                     texts.append(arg)  # 不满足条件的数字加入 texts
+            elif arg.startswith("#") and arg[1:].isdigit() and int(arg[1:]) > 0:
+                # #12345：显式序号，用于 5 位及以上的序号（纯数字会被当作QQ号等文本）
+                numbers.append(int(arg[1:]))
             else:  # 如果是文本
                 if filtered_arg := filter_text(arg):
                     if arg.startswith("@"):
@@ -168,22 +271,254 @@ async def get_args(event: AstrMessageEvent):
         }
 
 
+# 图片解码限制，插件初始化时按配置覆盖
+IMAGE_LIMITS = {
+    "max_pixels": 50_000_000,
+    "max_bytes": 50 * 1024 * 1024,
+}
+
+
+class ImageTooLargeError(ValueError):
+    """图片字节数或像素数超出限制"""
+
+
+def configure_image_limits(max_pixels: int, max_bytes: int):
+    """
+    设置图片解码限制，只在 open_image_safely / probe_image 中生效；
+    不改动 PIL 的全局设置，以免影响同进程中的其他插件
+    """
+    IMAGE_LIMITS["max_pixels"] = max_pixels
+    IMAGE_LIMITS["max_bytes"] = max_bytes
+
+
+def open_image_safely(
+    source: bytes | str | os.PathLike, target_size: int | None = None
+) -> PILImage.Image:
+    """
+    安全打开图片：只读取文件头检查字节数与像素数，超限抛 ImageTooLargeError；
+    指定 target_size 时对 JPEG 启用 draft 降采样解码（1/2~1/8），
+    解码的内存占用与目标尺寸而非原图尺寸成正比。
+    返回尚未解码像素的 Image，调用方负责关闭
+    """
+    if isinstance(source, bytes):
+        size = len(source)
+        fp = io.BytesIO(source)
+    else:
+        size = os.path.getsize(source)
+        fp = source
+    if size > IMAGE_LIMITS["max_bytes"]:
+        raise ImageTooLargeError(f"图片过大：{size} 字节")
+
+    try:
+        img = PILImage.open(fp)
+    except PILImage.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    if img.width * img.height > IMAGE_LIMITS["max_pixels"]:
+        img.close()
+        raise ImageTooLargeError(f"图片像素过多：{img.width}x{img.height}")
+    if target_size:
+        img.draft(img.mode, (target_size, target_size))
+    return img
+
+
+def probe_image(source: bytes | str | os.PathLike) -> tuple[str | None, int, int]:
+    """只读文件头获取 (格式, 宽, 高)，同时检查解码限制"""
+    with open_image_safely(source) as img:
+        return img.format, img.width, img.height
+
+
 def compress_image(image: bytes, max_size: int = 512) -> bytes | None:
     """压缩图片"""
     try:
-        with PILImage.open(io.BytesIO(image)) as img:
-            # GIF 不压缩
-            if img.format == "GIF":
-                return image
-            # 尺寸不超过 max_size，不压缩
-            if img.width <= max_size and img.height <= max_size:
-                return image
-            # 执行压缩
-            img.thumbnail((max_size, max_size), PILImage.Resampling.LANCZOS)
+        fmt, width, height = probe_image(image)
+        # GIF 不压缩
+        if fmt == "GIF":
+            return image
+        # 尺寸不超过 max_size，不压缩
+        if width <= max_size and height <= max_size:
+            return image
+        # 执行压缩：JPEG 直接按接近目标的尺寸解码，其余格式解码后逐级缩小
+        with open_image_safely(image, target_size=max_size) as img:
+            img.thumbnail(
+                (max_size, max_size), PILImage.Resampling.LANCZOS, reducing_gap=3.0
+            )
             output = io.BytesIO()
-            img.save(output, format=img.format)
+            img.save(output, format=fmt)
             return output.getvalue()
     except Exception as e:
         logger.error(f"压缩图片失败：{e}")
         return None
 
+
+def transcode_image(
+    image: bytes, max_size: int, fmt: str | None = None, quality: int = 85
+) -> tuple[bytes, str] | None:
+    """
+    按策略重新编码静态图片：等比缩小到 max_size 以内，并转为 fmt 格式
+    :param fmt: 目标格式（JPEG/WEBP/PNG），None 表示保持原格式
+        （JPEG/WEBP/PNG/BMP/TIFF 保持不变，其余格式转为 JPEG）
+    :return: (新字节, 新格式)，动图或不支持的格式返回 None
+    """
+    with open_image_safely(image, target_size=max_size) as img:
+        src_fmt = img.format or "JPEG"
+        if src_fmt == "GIF" or getattr(img, "n_frames", 1) > 1:
+            return None
+        if fmt is None:
+            # MPO 是相机拍摄的多图 JPEG，按 JPEG 处理
+            fmt = "JPEG" if src_fmt == "MPO" else src_fmt
+        fmt = fmt.upper()
+        if fmt not in ("JPEG", "WEBP", "PNG", "BMP", "TIFF"):
+            fmt = "JPEG"
+        img.thumbnail(
+            (max_size, max_size), PILImage.Resampling.LANCZOS, reducing_gap=3.0
+        )
+        if fmt == "JPEG" and img.mode != "RGB":
+            # JPEG 不支持透明，透明部分铺白底
+            rgba = img.convert("RGBA")
+            img = PILImage.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        output = io.BytesIO()
+        if fmt == "PNG":
+            img.save(output, format=fmt, optimize=True)
+        elif fmt == "TIFF":
+            img.save(output, format=fmt, compression="tiff_lzw")
+        elif fmt == "BMP":
+            img.save(output, format=fmt)
+        else:
+            img.save(output, format=fmt, quality=quality)
+        return output.getvalue(), fmt
+
+
+def optimize_gif(image: bytes, max_size: int | None = None) -> bytes | None:
+    """
+    优化动图体积：
+    - 合并相邻的重复帧，时长累加到前一帧
+    - 可选按 max_size 等比缩小
+    - 所有帧量化到同一个调色板（透明图预留一个透明色），不再逐帧携带局部调色板
+    - 保存时 Pillow 只写入每帧相对上一帧变化的矩形区域
+    结果不比原图小时返回原图，失败返回 None
+    """
+    try:
+        with open_image_safely(image) as img:
+            n_frames = getattr(img, "n_frames", 1)
+            if img.format != "GIF" or n_frames <= 1:
+                return image
+            # 所有帧都要展开保存在内存中，像素总量与单张图片共用同一解码上限
+            if img.width * img.height * n_frames > IMAGE_LIMITS["max_pixels"]:
+                return image
+            loop = img.info.get("loop", 0)
+            default_duration = img.info.get("duration", 100)
+
+            frames: list[PILImage.Image] = []
+            durations: list[int] = []
+            for frame in ImageSequence.Iterator(img):
+                rgba = frame.convert("RGBA")
+                duration = frame.info.get("duration", default_duration)
+                if frames and _same_pixels(rgba, frames[-1]):
+                    durations[-1] += duration
+                    continue
+                frames.append(rgba)
+                durations.append(duration)
+
+        if max_size and max(frames[0].size) > max_size:
+            scale = max_size / max(frames[0].size)
+            size = (
+                max(1, round(frames[0].width * scale)),
+                max(1, round(frames[0].height * scale)),
+            )
+            frames = [f.resize(size, PILImage.Resampling.LANCZOS) for f in frames]
+
+        transparent = any(f.getchannel("A").getextrema()[0] < 128 for f in frames)
+        palette = _shared_palette(frames, 255 if transparent else 256)
+
+        quantized: list[PILImage.Image] = []
+        for frame in frames:
+            q = frame.convert("RGB").quantize(
+                palette=palette, dither=PILImage.Dither.NONE
+            )
+            if transparent:
+                # 与补位颜色打平时可能落到 255，先改回 0，255 只表示透明
+                q = q.point([*range(255), 0])
+                mask = frame.getchannel("A").point(lambda a: 255 if a < 128 else 0)
+                q.paste(255, mask=mask)
+            quantized.append(q)
+
+        output = io.BytesIO()
+        options: dict = {"transparency": 255, "disposal": 2} if transparent else {}
+        quantized[0].save(
+            output,
+            format="GIF",
+            save_all=True,
+            append_images=quantized[1:],
+            duration=durations,
+            loop=loop,
+            optimize=False,
+            **options,
+        )
+        result = output.getvalue()
+        return result if len(result) < len(image) else image
+    except Exception as e:
+        logger.error(f"优化动图失败：{e}")
+        return None
+
+
+def _same_pixels(a: PILImage.Image, b: PILImage.Image) -> bool:
+    """两帧像素完全相同（逐通道求差，不复制出整帧字节）"""
+    return all(hi == 0 for _, hi in ImageChops.difference(a, b).getextrema())
+
+
+def _shared_palette(frames: list[PILImage.Image], colors: int) -> PILImage.Image:
+    """从均匀抽样的帧中生成共享调色板，透明图的第 256 色留给透明"""
+    step = max(1, len(frames) // 16)
+    samples = [f.convert("RGB") for f in frames[::step]]
+    for sample in samples:
+        sample.thumbnail((128, 128))
+    width = max(s.width for s in samples)
+    montage = PILImage.new("RGB", (width, sum(s.height for s in samples)))
+    y = 0
+    for sample in samples:
+        montage.paste(sample, (0, y))
+        y += sample.height
+    palette = montage.quantize(colors=colors, method=PILImage.Quantize.MEDIANCUT)
+    # 补齐 256 色，空位填第一个颜色，避免像素被映射到未使用的黑色空位
+    raw = palette.getpalette() or [0, 0, 0]
+    raw = raw[: colors * 3]
+    raw += raw[:3] * (256 - len(raw) // 3)
+    palette.putpalette(raw)
+    return palette
+
+
+def content_hash(image: bytes) -> str:
+    """图片内容哈希(sha256)，用于精确去重"""
+    return hashlib.sha256(image).hexdigest()
+
+
+def image_dhash(image: bytes, hash_size: int = 8) -> int | None:
+    """
+    计算图片的差值感知哈希(dHash)，缩放、重新编码后的同一张图哈希值相近，
+    返回 hash_size * hash_size 位整数，解析失败返回 None
+    """
+    try:
+        # JPEG 可直接按缩小的尺寸解码
+        with open_image_safely(image, target_size=hash_size * 8) as img:
+            small = img.convert("L").resize(
+                (hash_size + 1, hash_size), PILImage.Resampling.LANCZOS
+            )
+            pixels = small.tobytes()
+    except Exception as e:
+        logger.warning(f"计算感知哈希失败：{e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """两个哈希值的汉明距离"""
+    return (a ^ b).bit_count()